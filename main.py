@@ -1,7 +1,7 @@
 from asyncio import gather, run
 from typing import Type
 
-from src.utils import log_info, log_warn, ArgParser, generate_hash, prettify
+from src.utils import log_debug, log_info, log_warn, ArgParser, generate_hash, prettify
 from src.model import Config, Tsdb, TsdbAdapter
 import src.state as state
 
@@ -53,6 +53,17 @@ async def start_ingester(config: Config):
     return
   await gather(*cron_monitors)
 
+async def start_backfill(config: Config):
+  # backfills run in their own process, next to the live ingesters
+  from src.ingesters.evm_logger import backfill
+  if state.args.from_block is None: # no implicit genesis backfill
+    raise ValueError("--from_block is required with --backfill")
+  c = next((c for c in config.ingesters if c.name == state.args.backfill), None)
+  if not c or c.ingester_type != "evm_logger":
+    raise ValueError(f"No evm_logger ingester named {state.args.backfill} in {state.args.config_path}")
+  count = await backfill(c, state.args.from_block, state.args.to_block)
+  log_info(f"Backfilled {count} {c.name} events")
+
 async def start_server(config: Config):
   # server specific imports
   from src.server import start
@@ -83,12 +94,18 @@ async def main(ap: ArgParser):
 
   try:
     config = state.config
-    await (start_server(config) if state.args.server else start_ingester(config))
+    await (start_server(config) if state.args.server else start_backfill(config) if state.args.backfill else start_ingester(config))
   except KeyboardInterrupt:
     log_info("Shutting down...")
   finally:
+    if not state.args.server:
+      from src.actions import flush_ticks
+      await flush_ticks() # buffered ws_api ticks
+    log_debug(f"HTTP pool stats: {state.http.stats()}, websocket stats: {state.ws.stats()}, RPC pools stats: {state.web3.stats()}")
     await state.tsdb.close()
     await state.redis.close()
+    await state.http.close()
+    await state.ws.close()
 
 if __name__ == "__main__":
   log_info(f"""
@@ -112,6 +129,9 @@ if __name__ == "__main__":
     ],
     "Ingester runtime": [
       (("-p", "--perpetual_indexing"), bool, False, 'store_true', "Perpetually listen for new blocks to index, requires capable RPCs"),
+      (("-bf", "--backfill"), str, "", None, "Name of an evm_logger ingester to backfill from --from_block (exits when done, resumable)"),
+      (("-fb", "--from_block"), int, None, None, "Backfill start block, required with --backfill"),
+      (("-tb", "--to_block"), int, 0, None, "Backfill end block, defaults to where live ingestion started"),
     ],
     "Server runtime": [
       (("-s", "--server"), bool, False, 'store_true', "Run as server (ingester by default)"),
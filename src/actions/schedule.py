@@ -5,6 +5,7 @@ from src.cache import claim_task, ensure_claim_task, is_task_claimed
 from src.utils import log_debug, log_info, log_warn, log_error, submit_to_threadpool,\
   Interval, interval_to_cron
 from src.model import Ingester, IngesterType
+from src.actions.transform import compile_transformers, is_offloadable, warm_series_windows
 import src.state as state
 
 def get_scheduler(ingestor_type: IngesterType) -> callable:
@@ -99,6 +100,10 @@ async def schedule(c: Ingester) -> list[Task]:
   if not schedule:
     raise ValueError(f"Unsupported ingester type: {c.type}")
   await ensure_claim_task(c)
+  compile_transformers(c) # parse transformer chains once, not every tick
+  if c.executor == "process" and not is_offloadable(c):
+    log_warn(f"{c.name} series transformers rely on in-process windows, transformers will not be offloaded")
+  await warm_series_windows(c) # series ops are then served from memory
   tasks = await schedule(c)
   log_debug(f"Scheduled for ingestion: {c.name}.{c.interval} [{', '.join([field.name for field in c.fields])}]")
   return tasks
@@ -1,15 +1,23 @@
-from datetime import datetime, timezone
+from asyncio import Lock, Task, gather, get_running_loop, sleep
+from datetime import datetime, timedelta, timezone
+from os import environ as env
 import pickle
+from time import time_ns
 from typing import Optional
 
 from src.utils.date import floor_utc
-from src.utils.format import log_debug
+from src.utils.format import log_debug, log_error, log_warn
+from src.utils.runtime import compile_selector, select_path
 import src.state as state
-from src.model import Ingester
+from src.model import Ingester, FieldType, ResourceField
 from src.cache import cache, pub
-from src.actions.transform import transform_all
+from src.actions.transform import transform_all_remote, transform_all_threaded, transform_batch
 
 UTC = timezone.utc
+EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+TICKS_BATCH_SIZE = int(env.get("TICKS_BATCH_SIZE", 5000)) # buffered ticks flushed at once
+TICKS_FLUSH_SEC = float(env.get("TICKS_FLUSH_SEC", 1)) # max buffering time
+TICKS_MAX_BUFFER = int(env.get("TICKS_MAX_BUFFER", 100_000)) # ticks retained while the tsdb is unavailable
 
 async def store(c: Ingester, table="", publish=True) -> list:
   data = pickle.dumps(c.values_dict())
@@ -21,19 +29,104 @@ async def store(c: Ingester, table="", publish=True) -> list:
   if state.args.verbose:
     log_debug(f"Ingested and stored {c.name}-{c.interval}")
 
-async def store_batch(c: Ingester, values: list, from_date: datetime, to_date: Optional[datetime], aggregation_interval=None) -> dict:
+async def store_batch(c: Ingester, values: list, from_date: datetime, to_date: Optional[datetime], table="") -> dict:
   if not to_date:
     to_date = datetime.now(UTC)
   if c.resource_type == "value":
     raise ValueError("Cannot store batch for inplace value ingesters (series data required)")
-  ok = await state.tsdb.insert_many(c, values, from_date, to_date, aggregation_interval)
+  ok = await state.tsdb.insert_many(c, values, table)
   if state.args.verbose:
     log_debug(f"Ingested and stored {len(values)} values for {c.name}-{c.interval} [{from_date} -> {to_date}]")
   return ok
 
 async def transform_and_store(c: Ingester, table="", publish=True):
-  if transform_all(c) > 0:
+  count = await (transform_all_remote(c) if c.executor == "process" else transform_all_threaded(c))
+  if count > 0:
     c.ingestion_time = floor_utc(c.interval)
     await store(c, table, publish)
   else:
     log_debug(f"No new values for {c.name}")
+
+async def transform_and_store_batch(c: Ingester, columns: dict, dates: list[datetime], table="") -> int:
+  transformed = transform_batch(c, columns)
+  persistent_fields = [f.name for f in c.fields if not f.transient]
+  values = list(zip(dates, *[transformed[name].tolist() for name in persistent_fields]))
+  if values:
+    await store_batch(c, values, dates[0], dates[-1], table)
+  return len(values)
+
+def tick_cast(type: FieldType) -> callable:
+  if type.startswith(("int", "uint")):
+    return int
+  if type.startswith(("float", "ufloat")):
+    return float
+  return bool if type == "bool" else str
+
+TICK_WRITERS: list["TickWriter"] = [] # flushed on shutdown
+
+class TickWriter:
+  """
+  Write buffer of raw stream messages (ticks), projected on the ingester's `ticks` columns
+  and bulk inserted into its own <name>_ticks table on size or time thresholds.
+  Rows are keyed by unique microsecond timestamps, with the source stream and a sequence number.
+  """
+
+  def __init__(self, c: Ingester, batch_size=0, flush_sec=0.0):
+    fields = c.ticks + [ResourceField(name="stream", type="string"), ResourceField(name="seq", type="int64")]
+    self.resource = Ingester(name=f"{c.name}_ticks", resource_type="timeseries", interval=c.interval, fields=fields)
+    self.columns = [(compile_selector(f.selector), tick_cast(f.type)) for f in c.ticks]
+    self.batch_size = batch_size or TICKS_BATCH_SIZE
+    self.flush_sec = flush_sec or TICKS_FLUSH_SEC
+    self.rows: list[tuple] = []
+    self.last_us = self.seq = 0
+    self.lock = Lock()
+    self.created = False
+    self.task: Task = None
+    self.written = self.dropped = 0
+    TICK_WRITERS.append(self)
+
+  def append(self, msg: any, stream=""):
+    # strictly increasing us timestamps (only ahead of the wall clock above 1M ticks/s), ticks sharing one would overwrite each other
+    us = max(time_ns() // 1000, self.last_us + 1)
+    self.last_us = us
+    self.seq += 1
+    row = [EPOCH + timedelta(microseconds=us)]
+    for path, cast in self.columns:
+      value = select_path(path, msg)
+      row.append(None if value is None else cast(value))
+    row += [stream, self.seq]
+    self.rows.append(tuple(row))
+    if len(self.rows) >= self.batch_size and not self.lock.locked():
+      get_running_loop().create_task(self.flush())
+
+  async def flush(self):
+    async with self.lock:
+      rows, self.rows = self.rows, []
+      if not rows:
+        return
+      try:
+        if not self.created:
+          await state.tsdb.create_table(self.resource) # if not exists
+          self.created = True
+        await state.tsdb.insert_many(self.resource, rows)
+        self.written += len(rows)
+      except Exception as e:
+        self.rows = rows + self.rows # retry with the next flush, bounded
+        if len(self.rows) > TICKS_MAX_BUFFER:
+          self.dropped += len(self.rows) - TICKS_MAX_BUFFER
+          self.rows = self.rows[-TICKS_MAX_BUFFER:]
+        log_error(f"Failed to write {len(rows)} ticks to {self.resource.name} ({self.dropped} dropped so far): {e}")
+
+  async def run(self):
+    while True:
+      await sleep(self.flush_sec)
+      await self.flush()
+
+  def start(self) -> Task:
+    if not self.task:
+      self.task = get_running_loop().create_task(self.run())
+    return self.task
+
+async def flush_ticks():
+  # write the buffered ticks of every writer (eg. on shutdown)
+  await gather(*[writer.flush() for writer in TICK_WRITERS])
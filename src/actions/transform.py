@@ -1,15 +1,30 @@
+from collections import ChainMap
+from typing import Optional
+from datetime import datetime, timedelta, timezone
+import ast
+import inspect
 import re
 import string
 import json
 from hashlib import sha256, md5
+from math import isnan, log
 import numpy as np
-from asyncio import TimeoutError as FutureTimeoutError
+from asyncio import TimeoutError as FutureTimeoutError, gather, wait_for, wrap_future
+from concurrent.futures import ThreadPoolExecutor
+from os import environ as env, cpu_count
+from types import SimpleNamespace
+
+import pandas as pd
 
 import src.state as state
-from src.model import Ingester, Resource, ResourceField, Tsdb
-from src.utils import safe_eval, interval_to_delta, log_debug, log_error
+from src.model import FieldType, Ingester, Resource, ResourceField, Tsdb
+from src.utils import safe_eval, interval_to_delta, interval_to_seconds, log_debug, log_error, log_warn,\
+  run_async_in_thread, RollingWindow
 from src.actions.load import load
 
+UTC = timezone.utc
+TRANSFORM_TIMEOUT_SEC = float(env.get("TRANSFORM_TIMEOUT_SEC", 2)) # max transformer chain time per field
+
 BASE_TRANSFORMERS: dict[str, callable] = {
   "lower": lambda r, self: str(self).lower(),
   "upper": lambda r, self: str(self).upper(),
@@ -33,7 +48,7 @@ BASE_TRANSFORMERS: dict[str, callable] = {
   "hex": lambda r, self: hex(int(self))[2:], # int to hex
   "sha256digest": lambda r, self: sha256(str(self).encode()).hexdigest(),
   "md5digest": lambda r, self: md5(str(self).encode()).hexdigest(),
-  "round": lambda r, self: round(float(self)), # TODO: genericize to roundN
+  "round": lambda r, self: round(float(self)), # see PARAM_TRANSFORMERS for round(n)
   "round2": lambda r, self: round(float(self), 2),
   "round4": lambda r, self: round(float(self), 4),
   "round6": lambda r, self: round(float(self), 6),
@@ -53,68 +68,571 @@ SERIES_TRANSFORMERS: dict[str, callable] = {
   "prod": lambda r, series: np.prod(series)
 }
 
-# TODO: optimize
+# parametrized transformers eg. "round(6)", "scale(1e-18)", "decimals({USDCUSD_decimals})", "clamp(0, 1)"
+# as (scalar, vectorized) implementations, arguments are literals or sibling fields
+PARAM_TRANSFORMERS: dict[str, tuple[callable, callable]] = {
+  "round": (lambda r, self, n=0: round(float(self), int(n)), lambda r, col, n=0: np.round(col.astype(np.float64), int(n))),
+  "scale": (lambda r, self, factor: float(self) * factor, lambda r, col, factor: col.astype(np.float64) * factor),
+  "mul": (lambda r, self, factor: self * factor, lambda r, col, factor: col * factor),
+  "div": (lambda r, self, divisor: self / divisor, lambda r, col, divisor: col / divisor),
+  "add": (lambda r, self, term: self + term, lambda r, col, term: col + term),
+  "sub": (lambda r, self, term: self - term, lambda r, col, term: col - term),
+  "pow": (lambda r, self, exponent: self ** exponent, lambda r, col, exponent: np.power(col.astype(np.float64), exponent)),
+  "decimals": (lambda r, self, n: self / 10 ** n, lambda r, col, n: col / np.power(10.0, n)), # integer to decimal amount
+  "clamp": (lambda r, self, lo, hi: min(max(self, lo), hi), lambda r, col, lo, hi: np.clip(col, lo, hi)),
+  "abs": (lambda r, self: abs(self), lambda r, col: np.abs(col)),
+  "get": (lambda r, self, key: self[key], None), # eg. get(1) on tuples, get('price') on dicts
+  "default": (lambda r, self, value: value if self is None else self, None),
+}
+
+# transformers of the previous and current values of a field eg. "pct_change" (nan on the first value)
+DELTA_TRANSFORMERS: dict[str, tuple[callable, callable]] = {
+  "diff": (lambda prev, x: x - prev, lambda prev, col: col - prev),
+  "pct_change": (lambda prev, x: (x - prev) / prev, lambda prev, col: (col - prev) / prev),
+  "log_return": (lambda prev, x: log(x / prev), lambda prev, col: np.log(col / prev)),
+}
+
+PARAM_CALL = re.compile(r"(\w+)(?:\((.*)\))?", re.DOTALL) # eg. "clamp(0, {max})"
+SERIES_OP = re.compile(r"(\w+)\((\w+)\)") # series op format spec eg. "mean(h1)" in {self::mean(h1)}
+FORMATTER = string.Formatter()
+COMPILED_TRANSFORMERS: dict[str, callable] = {} # transformer -> compiled step, shared across fields
+SERIES_WINDOWS: dict[str, dict[str, RollingWindow]] = {} # "ingester.field" -> lookback -> in-memory window
+PREV_VALUES: dict[str, float] = {} # "ingester.field:transformer" -> previous value, for delta transformers
+
+def parse_accessor(accessor: str) -> str:
+  # str.format style accessors to python ones, eg. "[0][price]" -> "[0]['price']"
+  return re.sub(r"\[([^\]]+)\]", lambda m: f"[{m.group(1)}]" if m.group(1).isdigit() else f"[{m.group(1)!r}]", accessor)
+
+def parse_transformer(transformer: str) -> tuple[str, list[str], list[tuple[str, str, str]]]:
+  """
+  Translate a transformer into a python expression with bound variables instead of injected values.
+
+  :param transformer: transformer expression eg. "({self}[1] / 10 ** {USDCUSD_decimals}) * {self::mean(h1)}"
+  :return: (expression, sibling field references, series ops as (target, fn, lookback))
+  """
+  expr, refs, series = [], [], []
+  for literal, name, spec, conversion in FORMATTER.parse(transformer):
+    expr.append(literal)
+    if name is None:
+      continue
+    if not name:
+      raise ValueError(f"Invalid transformer: {transformer}, positional placeholders are not supported")
+    if conversion:
+      raise ValueError(f"Invalid transformer: {transformer}, conversions are not supported")
+    if spec:
+      # series op eg. {self::mean(h1)}, parsed by str.format as name "self" and spec ":mean(h1)"
+      match = SERIES_OP.fullmatch(spec[1:]) if spec.startswith(":") else None
+      if not match:
+        raise ValueError(f"Invalid transformer: {transformer}")
+      fn, lookback = match.groups()
+      if fn not in SERIES_TRANSFORMERS:
+        raise ValueError(f"Invalid series transformer: {fn} in {transformer}")
+      interval_to_delta(lookback) # raises if invalid
+      expr.append(f"_s{len(series)}")
+      series.append((name, fn, lookback))
+      continue
+    base, accessor = re.match(r"([^.\[]+)(.*)", name).groups()
+    if base == "self":
+      var = "self"
+    else:
+      if base not in refs:
+        refs.append(base)
+      var = f"_r{refs.index(base)}"
+    expr.append(var + parse_accessor(accessor))
+  return "".join(expr), refs, series
+
+def parse_param_transformer(transformer: str) -> Optional[tuple[str, list[tuple[bool, any]], list[str]]]:
+  """
+  Parse a native parametrized transformer eg. "round(6)" or "div({USDCUSD})".
+
+  :param transformer: transformer
+  :return: (name, args as (is_ref, field name or literal), sibling references) or None if not a native transformer call
+  """
+  match = PARAM_CALL.fullmatch(transformer.strip())
+  if not match or not (match.group(1) in PARAM_TRANSFORMERS or match.group(1) in DELTA_TRANSFORMERS):
+    return None
+  name, args_src = match.groups()
+  expr, refs, series = parse_transformer(f"_({args_src or ''})")
+  try:
+    call = ast.parse(expr, mode="eval").body
+  except SyntaxError:
+    return None
+  if not isinstance(call, ast.Call):
+    return None # several calls eg. round({self}) + round({X}), matched greedily
+  if series or call.keywords or any(isinstance(n, ast.Name) and n.id == "self" for n in ast.walk(call)):
+    return None # expression on {self}, eg. round({self} * 2, 2)
+  args = []
+  for node in call.args:
+    if isinstance(node, ast.Name) and node.id.startswith("_r"):
+      args.append((True, refs[int(node.id[2:])]))
+      continue
+    try:
+      args.append((False, ast.literal_eval(node)))
+    except ValueError:
+      args.append((False, safe_eval(ast.unparse(node)))) # constant expression eg. 10 ** -18, evaluated once
+  try:
+    if name in PARAM_TRANSFORMERS:
+      inspect.signature(PARAM_TRANSFORMERS[name][0]).bind(None, None, *args)
+    elif args:
+      return None
+  except TypeError:
+    return None # arity mismatch, evaluate as an expression instead
+  return name, args, refs
+
+def series_key(c: Ingester, name: str) -> str:
+  return f"{c.name}.{name}"
+
+def apply_series_transformer(c: Ingester, field: ResourceField, target: str, fn: str, lookback: str) -> any:
+  target_field = field if target == "self" else next((f for f in c.fields if f.name == target), None)
+  if not target_field:
+    raise ValueError(f"Invalid transformer target: {target}")
+  window = SERIES_WINDOWS.get(series_key(c, target_field.name), {}).get(lookback)
+  if window is not None:
+    return window.reduce(fn)
+  # unregistered series (transformer not compiled with its ingester), query the tsdb
+  from_date = datetime.now(UTC) + interval_to_delta(lookback, backwards=True)
+  rows = run_async_in_thread(load(c, from_date, None, c.interval, columns=[(target_field.name,)]))
+  return SERIES_TRANSFORMERS[fn](c, [r[0] for r in rows or []])
+
+def register_series_windows(c: Ingester) -> int:
+  count = 0
+  for f in c.fields:
+    for step in f.pipeline:
+      for target, fn, lookback in getattr(step, "series", []):
+        windows = SERIES_WINDOWS.setdefault(series_key(c, f.name if target == "self" else target), {})
+        if lookback not in windows:
+          span = interval_to_seconds(lookback)
+          windows[lookback] = RollingWindow(span, maxlen=span // c.interval_sec + 1)
+          count += 1
+  return count
+
+def push_series_value(c: Ingester, f: ResourceField, ts: float=None):
+  windows = SERIES_WINDOWS.get(series_key(c, f.name))
+  if not windows:
+    return
+  try:
+    value = float(f.value)
+  except (TypeError, ValueError):
+    return
+  if isnan(value):
+    return
+  for window in windows.values():
+    window.push(value, ts)
+
+async def warm_series_windows(c: Ingester) -> int:
+  if c.resource_type == "value":
+    return 0
+  now, count = datetime.now(UTC), 0
+  for f in c.fields:
+    windows = SERIES_WINDOWS.get(series_key(c, f.name))
+    if not windows:
+      continue
+    span = max(w.span for w in windows.values())
+    try:
+      rows = await load(c, now - timedelta(seconds=span), now, c.interval, columns=[("ts",), (f.name,)])
+    except Exception as e:
+      log_warn(f"Failed to warm {c.name}.{f.name} series windows from tsdb: {e}")
+      continue
+    for ts, value in rows or []:
+      if value is None:
+        continue
+      for window in windows.values():
+        window.push(float(value), ts.timestamp())
+      count += 1
+  return count
+
+def compile_transformer(transformer: str) -> callable:
+  """
+  Compile a transformer into a step callable as step(c, field) -> value.
+
+  :param transformer: native transformer (eg. "round6", "round(6)") or expression (eg. "{self} * {USDCUSD}")
+  :return: compiled step, cached by transformer
+  """
+  if transformer in COMPILED_TRANSFORMERS:
+    return COMPILED_TRANSFORMERS[transformer]
+
+  param = None if transformer in BASE_TRANSFORMERS else parse_param_transformer(transformer)
+  if transformer in BASE_TRANSFORMERS:
+    base = BASE_TRANSFORMERS[transformer]
+    step = lambda c, field: base(c, field.value)
+    step.base = base
+  elif param and param[0] in DELTA_TRANSFORMERS:
+    delta = DELTA_TRANSFORMERS[param[0]][0]
+    def step(c: Ingester, field: ResourceField) -> any:
+      key = f"{series_key(c, field.name)}:{transformer}"
+      prev, PREV_VALUES[key] = PREV_VALUES.get(key), field.value
+      return np.nan if prev is None else delta(prev, field.value)
+    step.delta = True
+  elif param:
+    name, args, refs = param
+    fn = PARAM_TRANSFORMERS[name][0]
+    if not refs:
+      literals = [value for _, value in args]
+      step = lambda c, field: fn(c, field.value, *literals)
+    else:
+      step = lambda c, field: fn(c, field.value, *[c.data_by_field[value] if is_ref else value for is_ref, value in args])
+    step.refs = refs
+  else:
+    expr, refs, series = parse_transformer(transformer)
+    args = ["self"] + [f"_r{i}" for i in range(len(refs))] + [f"_s{i}" for i in range(len(series))]
+    fn = safe_eval(f"lambda {', '.join(args)}: {expr}", lambda_check=True)
+    if not refs and not series:
+      step = lambda c, field: fn(field.value)
+    else:
+      def step(c: Ingester, field: ResourceField) -> any:
+        values = [field.value] + [c.data_by_field[name] for name in refs]
+        for target, op, lookback in series:
+          values.append(apply_series_transformer(c, field, target, op, lookback))
+        return fn(*values)
+    step.refs, step.series, step.fn = refs, series, fn
+
+  COMPILED_TRANSFORMERS[transformer] = step
+  return step
+
+def field_dependencies(f: ResourceField) -> set[str]:
+  # sibling fields read by the pipeline, including series targets whose window is fed once they are transformed
+  refs = set(name for step in f.pipeline for name in getattr(step, "refs", []))
+  refs.update(s[0] for step in f.pipeline for s in getattr(step, "series", []))
+  return refs - {"self", f.name}
+
+def build_transform_waves(c: Ingester) -> list[list[ResourceField]]:
+  """
+  Sort the ingester fields into topological waves of their transformer dependencies.
+
+  :param c: ingester with compiled field pipelines
+  :return: waves of fields, each depending only on fields of previous waves
+  """
+  deps_by_field = {f.name: field_dependencies(f) for f in c.fields}
+  waves, done = [], set()
+  pending = list(c.fields)
+  while pending:
+    wave = [f for f in pending if deps_by_field[f.name] <= done]
+    if not wave:
+      raise ValueError(f"Circular transformer dependencies in {c.name}: {', '.join(f.name for f in pending)}")
+    waves.append(wave)
+    done.update(f.name for f in wave)
+    pending = [f for f in pending if f.name not in done]
+  return waves
+
+def compile_transformers(c: Ingester) -> int:
+  names = set(f.name for f in c.fields)
+  count = 0
+  for f in c.fields:
+    f.pipeline = [compile_transformer(t) for t in f.transformers or [] if t]
+    for step in f.pipeline:
+      for name in getattr(step, "refs", []) + [s[0] for s in getattr(step, "series", []) if s[0] != "self"]:
+        if name not in names:
+          raise ValueError(f"Invalid transformer reference in {c.name}.{f.name}: {name}")
+    count += len(f.pipeline)
+  c.transform_waves = build_transform_waves(c)
+  register_series_windows(c)
+  return count
+
 def apply_transformer(c: Ingester, field: ResourceField, transformer: str) -> any:
   if not transformer:
     return field.value
+  return compile_transformer(transformer)(c, field)
+
+def transformed(c: Ingester, f: ResourceField) -> any:
+  # pipeline output of the field's value, the field and ingester are left untouched (cf. apply_transformed)
+  if f.transformers and not f.pipeline:
+    f.pipeline = [compile_transformer(t) for t in f.transformers if t]
+  scratch = SimpleNamespace(name=f.name, value=f.value) # what steps read of their field
+  for step in f.pipeline:
+    scratch.value = step(c, scratch)
+  return scratch.value
 
-  # Checks if single word and does not contain injected variables ('{' or '}')
-  if bool(re.fullmatch(r"[^\s{}]+", transformer)):
-    return BASE_TRANSFORMERS.get(transformer)(c, field.value)
-
-  # If transformer contains a series op "::", replace with the result of the series transformer
-  if "{" in transformer:
-    # step 0: extract the series transformers that starts with '{' and ends with '}', and contain '::'
-    search = re.search(r"\{(.+?)\}", transformer)
-    for group in search.groups():
-      if "::" in group:
-        # step 1: identify the target series, word between '{' and '::'
-        search = re.search(r"\{(.+?)::", transformer)
-        target = search.group(1) if search else None
-        # step 2: identify the transformer, word between '::' and '('
-        search = re.search(r"::(.+?)\(", transformer)
-        fn = search.group(1) if search else None
-        # step 3: identify the lookback, word between '(' and ')'
-        search = re.search(r"\((.+?)\)", transformer)
-        lookback = search.group(1) if search else None
-        # step 4: check integrity of the transformer
-        if not target or not fn or not lookback:
-          raise ValueError(f"Invalid transformer: {transformer}")
-        # step 5: translate the lookback timeframe into a timedelta
-        from_date = interval_to_delta(lookback, backwards=True)
-        # step 6: make sure that target is either self (field) or other resource field
-        if target == "self":
-          target_field = field
-        else:
-          # filter the resource field that match the target
-          target_field = next((f for f in c.fields if f.name == target), None)
-          if not target_field:
-            raise ValueError(f"Invalid transformer target: {target}")
-        # step 7: extract the series from the target field
-        series = load(c, from_date, interval=c.interval, field=target_field)
-        # step 8: apply the series transformer
-        res = SERIES_TRANSFORMERS.get(fn)(c, series)
-        # step 9: inject the result in the transformer for recursive evaluation
-        transformer = transformer.replace(group, res)
-  # eval the transformer after injecting all computed values
-  return safe_eval(transformer.format(self=field.value, **c.data_by_field)) # TODO: precompile
+def apply_transformed(c: Ingester, f: ResourceField, value: any) -> any:
+  f.value = value
+  c.data_by_field[f.name] = value
+  push_series_value(c, f)
+  return value
 
 def transform(c: Ingester, f: ResourceField) -> any:
-  for t in f.transformers or []:
-    f.value = apply_transformer(c, f, t)
-  c.data_by_field[f.name] = f.value
-  return f.value
+  return apply_transformed(c, f, transformed(c, f))
 
 def transform_all(c: Ingester) -> int:
-  tp = state.thread_pool
+  # inline, in the calling thread (off the event loop eg. process pool workers, benchmarks)
+  if not c.transform_waves:
+    compile_transformers(c)
   count = 0
-  for field in c.fields:
+  for wave in c.transform_waves:
+    for f in wave:
+      try:
+        transform(c, f)
+        count += 1
+      except Exception as e:
+        log_error(f"{c.name}.{f.name} transformer failed ({e}), check {c.ingester_type} output and transformer chain")
+  return count
+
+TRANSFORM_POOL: ThreadPoolExecutor = None # dedicated to transformers: jobs running in state.thread_pool cannot starve it
+
+def transform_pool() -> ThreadPoolExecutor:
+  global TRANSFORM_POOL
+  if not TRANSFORM_POOL:
+    TRANSFORM_POOL = ThreadPoolExecutor(max_workers=cpu_count() if state.args.threaded else 2, thread_name_prefix="transform")
+  return TRANSFORM_POOL
+
+async def transform_all_threaded(c: Ingester) -> int:
+  """
+  Transform the ingester fields wave by wave without blocking the event loop:
+  the fields of a wave are transformed concurrently in the transformers thread pool, each within TRANSFORM_TIMEOUT_SEC.
+  Results are applied on the event loop, a timed out transformer still running cannot overwrite a later tick.
+
+  :param c: ingester
+  :return: number of fields transformed
+  """
+  if not c.transform_waves:
+    compile_transformers(c)
+  pool = transform_pool()
+
+  async def transform_field(f: ResourceField) -> int:
     try:
-      tp.submit(transform, c, field).result(timeout=2)
-      count += 1
-    except (FutureTimeoutError, Exception):
-      log_error(f"{c.name}.{field.name} transformer timeout, check {c.ingester_type} output and transformer chain")
+      value = await wait_for(wrap_future(pool.submit(transformed, c, f)), TRANSFORM_TIMEOUT_SEC)
+      apply_transformed(c, f, value)
+      return 1
+    except FutureTimeoutError:
+      log_error(f"{c.name}.{f.name} transformer timeout, check {c.ingester_type} output and transformer chain")
+    except Exception as e:
+      log_error(f"{c.name}.{f.name} transformer failed ({e}), check {c.ingester_type} output and transformer chain")
+    return 0
+
+  count = 0
+  for wave in c.transform_waves:
+    count += sum(await gather(*[transform_field(f) for f in wave]))
 
   if state.args.verbose:
     log_debug(f"Transformed {c.name} -> {c.data_by_field}")
   return count
+
+# process pool offloading (Ingester.executor == "process")
+REMOTE_INGESTERS: dict[str, Ingester] = {} # worker side compiled ingesters, by id
+
+def is_offloadable(c: Ingester) -> bool:
+  # series windows and delta previous values live in the ingester process, their transformers cannot run elsewhere
+  return not any(getattr(step, "series", None) or getattr(step, "delta", False) for f in c.fields for step in f.pipeline)
+
+def ingester_spec(c: Ingester) -> dict:
+  return {
+    "name": c.name, "interval": c.interval, "resource_type": c.resource_type, "ingester_type": c.ingester_type,
+    "fields": [{"name": f.name, "type": f.type, "transient": f.transient, "transformers": f.transformers} for f in c.fields]
+  }
+
+def transform_remote(id: str, spec: dict, values: list) -> tuple[list, int]:
+  # process pool worker entrypoint, the ingester is compiled once per worker
+  c = REMOTE_INGESTERS.get(id)
+  if not c:
+    c = REMOTE_INGESTERS[id] = Ingester.from_dict(spec)
+    compile_transformers(c)
+  for f, value in zip(c.fields, values):
+    f.value = value
+  count = transform_all(c)
+  return [f.value for f in c.fields], count
+
+async def transform_all_remote(c: Ingester) -> int:
+  if not c.transform_waves:
+    compile_transformers(c)
+  if not is_offloadable(c):
+    return await transform_all_threaded(c)
+  future = state.process_pool.submit(transform_remote, c.id, ingester_spec(c), [f.value for f in c.fields])
+  values, count = await wrap_future(future)
+  for f, value in zip(c.fields, values):
+    f.value = value
+    c.data_by_field[f.name] = value
+
+  if state.args.verbose:
+    log_debug(f"Transformed {c.name} in process pool -> {c.data_by_field}")
+  return count
+
+# vectorized (batch) transformers, applied to columns of raw values with one row per timestamp
+NP_TYPES: dict[FieldType, type] = {
+  "int8": np.int8, "uint8": np.uint8,
+  "int16": np.int16, "uint16": np.uint16,
+  "int32": np.int32, "uint32": np.uint32,
+  "int64": np.int64, "uint64": np.uint64,
+  "float32": np.float32, "ufloat32": np.float32,
+  "float64": np.float64, "ufloat64": np.float64,
+  "bool": np.bool_,
+}
+
+VECTOR_TRANSFORMERS: dict[str, callable] = {
+  "lower": lambda r, col: np.char.lower(col.astype(str)),
+  "upper": lambda r, col: np.char.upper(col.astype(str)),
+  "capitalize": lambda r, col: np.char.capitalize(col.astype(str)),
+  "title": lambda r, col: np.char.title(col.astype(str)),
+  "strip": lambda r, col: np.char.strip(col.astype(str)),
+  "int": lambda r, col: col.astype(np.int64),
+  "float": lambda r, col: col.astype(np.float64),
+  "str": lambda r, col: col.astype(str),
+  "bool": lambda r, col: col.astype(np.bool_),
+  "round": lambda r, col: np.round(col.astype(np.float64)),
+  "round2": lambda r, col: np.round(col.astype(np.float64), 2),
+  "round4": lambda r, col: np.round(col.astype(np.float64), 4),
+  "round6": lambda r, col: np.round(col.astype(np.float64), 6),
+  "round8": lambda r, col: np.round(col.astype(np.float64), 8),
+  "round10": lambda r, col: np.round(col.astype(np.float64), 10),
+}
+
+# builtins shadowed in vectorized expressions eg. float({self}) * {USDCUSD}
+VECTOR_NAMESPACE: dict[str, callable] = {
+  "int": lambda x: np.asarray(x).astype(np.int64),
+  "float": lambda x: np.asarray(x).astype(np.float64),
+  "str": lambda x: np.asarray(x).astype(str),
+  "bool": lambda x: np.asarray(x).astype(np.bool_),
+  "abs": np.abs,
+  "round": np.round,
+}
+
+# rolling equivalents of SERIES_TRANSFORMERS, numpy's ddof=0 is kept for std/var
+ROLLING_TRANSFORMERS: dict[str, callable] = {
+  "median": lambda w: w.median(),
+  "mean": lambda w: w.mean(),
+  "std": lambda w: w.std(ddof=0),
+  "var": lambda w: w.var(ddof=0),
+  "min": lambda w: w.min(),
+  "max": lambda w: w.max(),
+  "sum": lambda w: w.sum(),
+  "prod": lambda w: w.apply(np.prod, raw=True),
+}
+
+COMPILED_VECTOR_TRANSFORMERS: dict[str, callable] = {} # transformer -> compiled vectorized step
+
+class Rows:
+  """
+  Column of structured raw values (tuples, dicts), indexed per row like their scalar counterparts.
+  eg. rows[1] on latestRoundData() outputs returns the column of answers.
+  Structured arrays (eg. decoded event columns) are indexed by field name or position.
+  """
+  __slots__ = ("values",)
+
+  def __init__(self, values: np.ndarray):
+    self.values = values
+
+  def __getitem__(self, key) -> np.ndarray:
+    v = self.values
+    if v.dtype.names:
+      return as_column(v[v.dtype.names[key]] if isinstance(key, (int, np.integer)) else v[key])
+    if v.ndim > 1:
+      return as_column(v[:, key])
+    return as_column([row[key] for row in v])
+
+  def __len__(self) -> int:
+    return len(self.values)
+
+  def tolist(self) -> list:
+    return self.values.tolist()
+
+def as_column(values: any) -> np.ndarray|Rows:
+  if isinstance(values, Rows):
+    return values
+  try:
+    a = np.asarray(values)
+  except ValueError: # ragged rows
+    a = np.empty(len(values), dtype=object)
+    a[:] = values
+  if a.ndim > 1 or a.dtype.names or (a.dtype == object and len(a) and isinstance(a[0], (tuple, list, dict))):
+    return Rows(a)
+  return a
+
+def widen(col: np.ndarray|Rows) -> np.ndarray|Rows:
+  # scalar transformers work on python ints, avoid small int overflows eg. 10 ** {decimals} on uint8
+  if isinstance(col, np.ndarray) and col.dtype.kind in "iu" and col.dtype.itemsize < 8:
+    return col.astype(np.int64)
+  return col
+
+def row_values(col: np.ndarray|Rows) -> np.ndarray:
+  return col.values if isinstance(col, Rows) else col
+
+def rolling_series(c: Ingester, col: np.ndarray|Rows, fn: str, lookback: str) -> np.ndarray:
+  if fn not in ROLLING_TRANSFORMERS:
+    raise ValueError(f"Series transformer {fn} is not supported in batch mode")
+  window = max(1, interval_to_seconds(lookback) // c.interval_sec) # lookback in rows
+  rolling = pd.Series(row_values(col), dtype=np.float64).rolling(window, min_periods=1)
+  return ROLLING_TRANSFORMERS[fn](rolling).to_numpy()
+
+def compile_vector_transformer(transformer: str) -> callable:
+  """
+  Compile a transformer into a vectorized step callable as step(c, col, columns) -> col.
+  Steps that cannot be vectorized fall back to their scalar transformer, applied row by row.
+
+  :param transformer: native transformer (eg. "round6", "round(6)") or expression (eg. "{self} * {USDCUSD}")
+  :return: compiled step, cached by transformer
+  """
+  if transformer in COMPILED_VECTOR_TRANSFORMERS:
+    return COMPILED_VECTOR_TRANSFORMERS[transformer]
+
+  scalar = compile_transformer(transformer)
+  param = None if transformer in BASE_TRANSFORMERS else parse_param_transformer(transformer)
+  if param:
+    name, args, refs = param
+    vector = (DELTA_TRANSFORMERS.get(name) or PARAM_TRANSFORMERS.get(name))[1]
+    def step(c: Ingester, col: np.ndarray|Rows, columns: dict) -> np.ndarray|Rows:
+      if vector and not isinstance(col, Rows):
+        try:
+          if name in DELTA_TRANSFORMERS:
+            col = widen(col).astype(np.float64)
+            return vector(np.concatenate(([np.nan], col[:-1])), col)
+          return vector(c, widen(col), *[widen(columns[value]) if is_ref else value for is_ref, value in args])
+        except (ValueError, TypeError):
+          pass
+      if name in DELTA_TRANSFORMERS:
+        values = row_values(col)
+        return as_column([np.nan] + [scalar_delta(prev, x) for prev, x in zip(values[:-1], values[1:])])
+      fn = PARAM_TRANSFORMERS[name][0]
+      arg_cols = [row_values(columns[value]) if is_ref else [value] * len(col) for is_ref, value in args]
+      return as_column([fn(c, v, *row) for v, *row in zip(row_values(col), *arg_cols)])
+    scalar_delta = DELTA_TRANSFORMERS[name][0] if name in DELTA_TRANSFORMERS else None
+  elif transformer in BASE_TRANSFORMERS:
+    vector = VECTOR_TRANSFORMERS.get(transformer)
+    def step(c: Ingester, col: np.ndarray|Rows, columns: dict) -> np.ndarray|Rows:
+      if vector and not isinstance(col, Rows):
+        try:
+          return vector(c, col)
+        except (ValueError, TypeError):
+          pass
+      return as_column([scalar.base(c, v) for v in row_values(col)])
+  else:
+    expr, refs, series = parse_transformer(transformer)
+    args = ["self"] + [f"_r{i}" for i in range(len(refs))] + [f"_s{i}" for i in range(len(series))]
+    fn = safe_eval(f"lambda {', '.join(args)}: {expr}", lambda_check=True, **VECTOR_NAMESPACE)
+    def step(c: Ingester, col: np.ndarray|Rows, columns: dict) -> np.ndarray|Rows:
+      values = [widen(col)] + [widen(columns[name]) for name in refs]
+      for target, op, lookback in series:
+        values.append(rolling_series(c, col if target == "self" else columns[target], op, lookback))
+      try:
+        return as_column(fn(*values))
+      except Exception:
+        # not vectorizable (eg. str ops, arbitrary size ints), fallback to row-wise evaluation
+        return as_column([scalar.fn(*row) for row in zip(*[row_values(v) for v in values])])
+
+  COMPILED_VECTOR_TRANSFORMERS[transformer] = step
+  return step
+
+def transform_batch(c: Ingester, columns: dict[str, any]) -> dict[str, np.ndarray|Rows]:
+  """
+  Apply the ingester transformer chains to a columnar block of raw values, eg. for backfills.
+  Fields are processed in their dependency order, series ops are evaluated as rolling windows over the block.
+
+  :param c: ingester
+  :param columns: raw values by field name, one row per timestamp (fields without raw values are set to None)
+  :return: transformed values by field name
+  """
+  if not c.transform_waves:
+    compile_transformers(c)
+  n = len(next(iter(columns.values()))) if columns else 0
+  out: dict[str, np.ndarray|Rows] = {}
+  available = ChainMap(out, columns) # series ops may target fields not yet transformed
+  for wave in c.transform_waves:
+    for f in wave:
+      col = as_column(columns[f.name]) if f.name in columns else np.full(n, None, dtype=object)
+      for t in f.transformers or []:
+        if t:
+          col = compile_vector_transformer(t)(c, col, available)
+      dtype = NP_TYPES.get(f.type)
+      if dtype and not isinstance(col, Rows) and col.dtype != dtype:
+        try:
+          col = col.astype(dtype)
+        except (ValueError, TypeError, OverflowError):
+          log_error(f"Failed to cast {c.name}.{f.name} batch to {f.type}, keeping {col.dtype}")
+      out[f.name] = col
+  return out
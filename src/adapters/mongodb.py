@@ -4,11 +4,11 @@ from os import environ as env
 from pymongo import MongoClient
 from pymongo.collection import Collection
 from pymongo.database import Database
-from typing import Optional
+from typing import ClassVar, Optional
 from datetime import datetime, timedelta, timezone
 from dateutil.relativedelta import relativedelta
 
-from src.utils import log_info, Interval
+from src.utils import log_info, Interval, TimeUnit
 from src.model import Ingester, Tsdb
 
 UTC = timezone.utc
@@ -38,6 +38,7 @@ def interval_to_mongo(interval: Optional[str]) -> str:
   return INTERVAL_TO_MONGO.get(interval, None)
 
 class MongoDb(Tsdb):
+  precision: ClassVar[TimeUnit] = "ms" # bson dates
   client: Optional[MongoClient] = None
   db: Optional[Database] = None
   collection: Optional[Collection] = None
@@ -1,7 +1,8 @@
 from asyncio import gather, sleep
 from datetime import datetime, timezone
 from os import environ as env
-from taos import TaosConnection, TaosCursor, TaosResult, TaosStmt, connect, new_bind_params, new_multi_binds
+from typing import ClassVar
+from taos import TaosConnection, TaosCursor, TaosResult, TaosStmt, PrecisionEnum, connect, new_bind_params, new_multi_binds
 from dateutil.relativedelta import relativedelta
 
 from src.cache import get_or_set_cache
@@ -64,12 +65,15 @@ PREPARE_STMT = {}
 for k, v in TYPES.items():
   PREPARE_STMT[k] = v.replace(" ", "_")
 
-PRECISION: TimeUnit = "ms" # ns, us, ms, s, m
+PRECISION: TimeUnit = env.get("TAOS_PRECISION", "ms") # ms or us (required for ws_api ticks above 1000/s), set on database creation
+if PRECISION not in ("ms", "us"):
+  raise ValueError(f"Invalid TAOS_PRECISION: {PRECISION}, must be one of ms or us")
 TIMEZONE="UTC" # making sure the front-end and back-end are in sync
 
 class Taos(Tsdb):
   conn: TaosConnection
   cursor: TaosCursor
+  precision: ClassVar[TimeUnit] = PRECISION
 
   @classmethod
   async def connect(
@@ -225,17 +229,23 @@ class Taos(Tsdb):
         raise e
 
   async def insert_many(self, c: Ingester, values: list[tuple], table=""):
+    await self.ensure_connected()
     table = table or c.name
-    persistent_fields = [field.name for field in c.fields if not field.transient]
-    fields = "`, `".join(persistent_fields)
-    field_count = len(persistent_fields)
-    stmt = self.conn.statement(f"INSER INTO {self.db}.`{table}` VALUES(?" + ",?" * (field_count - 1) + ")")
-    params = new_multi_binds(field_count)
-    types = [PREPARE_STMT[field.type] for field in c.fields]
-    for i in fields:
-      params[i][types[i]]([v[i] for v in values])
-    stmt.bind(params)
-    stmt.execute()
+    persistent_data = [field for field in c.fields if not field.transient]
+    fields = "`, `".join(field.name for field in persistent_data)
+    stmt = self.conn.statement(f"INSERT INTO {self.db}.`{table}` (ts, `{fields}`) VALUES(?" + ",?" * len(persistent_data) + ")")
+    params = new_multi_binds(len(persistent_data) + 1)
+    params[0].timestamp([v[0] for v in values], PrecisionEnum.Microseconds if PRECISION == "us" else PrecisionEnum.Milliseconds) # rows as (ts, *persistent values)
+    for i, field in enumerate(persistent_data, start=1):
+      getattr(params[i], PREPARE_STMT[field.type])([v[i] for v in values])
+    try:
+      stmt.bind_param_batch(params)
+      stmt.execute()
+    except Exception as e:
+      log_error(f"Failed to insert {len(values)} rows into {self.db}.{table}", e)
+      raise e
+    finally:
+      stmt.close()
 
   async def get_columns(self, table: str) -> list[tuple[str, str, str]]:
     try:
@@ -1,8 +1,9 @@
 # TODO: batch redis tx commit whenever possible (cf. limiter.py)
-from asyncio import gather, iscoroutinefunction, iscoroutine
+from asyncio import Future, gather, get_running_loop, iscoroutinefunction, iscoroutine, shield, sleep
 from os import environ as env
 import pickle
 from random import random
+from time import monotonic, time
 
 from src.model import Ingester
 import src.state as state
@@ -10,6 +11,8 @@ from src.state import redis
 from src.utils import log_debug, log_error, log_warn, YEAR_SECONDS
 
 NS = env.get("REDIS_NS", "chomp")
+SINGLEFLIGHT_LOCK_SEC = float(env.get("SINGLEFLIGHT_LOCK_SEC", 30)) # max time a worker holds a fetch lock
+INFLIGHT: dict[str, Future] = {} # cache key -> pending in-process fetch
 
 async def ping() -> bool:
   try:
@@ -103,6 +106,85 @@ async def get_or_set_cache(name: str, callback: callable, expiry=YEAR_SECONDS, p
     await cache(key, value, expiry=expiry, pickled=pickled)
   return value
 
+def lock_key(name: str) -> str:
+  return f"{NS}:lock:{name}"
+
+# compare-and-delete: a lock expired then taken by another worker is left untouched
+# KEYS: lock | ARGV: owner
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+release_script = None
+
+async def release_lock(key: str) -> bool:
+  global release_script
+  if not release_script:
+    release_script = redis.register_script(RELEASE_SCRIPT)
+  return bool(await release_script(keys=[key], args=[state.args.proc_id]))
+
+async def await_flight(key: str, lock: str, timeout: float) -> any:
+  # poll the cache until the lock holder (another worker) publishes its result or gives up
+  delay, deadline = 0.02, monotonic() + timeout
+  while monotonic() < deadline:
+    await sleep(delay)
+    value = await redis.get(key)
+    if value not in (None, b""):
+      return value
+    if not await redis.exists(lock):
+      return await redis.get(key) # released without result
+    delay = min(delay * 2, 0.5)
+  return None
+
+async def singleflight(name: str, callback: callable, expiry: float, pickled=False, encoding="") -> any:
+  """
+  Coalesce identical fetches: one callback per (name, expiry bucket) runs across the cluster,
+  concurrent in-process callers await it and other workers read its cached result.
+
+  :param name: resource key (eg. hashed url)
+  :param callback: fetching function or coroutine
+  :param expiry: bucket size and cache expiry in seconds (eg. ingester interval)
+  :return: cached or fetched value, None if the fetch failed
+  """
+  key = cache_key(f"{name}:{int(time() // expiry)}")
+  if key in INFLIGHT:
+    return await shield(INFLIGHT[key]) # same worker, already fetching
+  flight = INFLIGHT[key] = get_running_loop().create_future()
+  try:
+    value = await redis.get(key)
+    lock = lock_key(key)
+    if value in (None, b"") and await redis.set(lock, state.args.proc_id, nx=True, px=round(SINGLEFLIGHT_LOCK_SEC * 1000)):
+      try:
+        value = callback() if not iscoroutinefunction(callback) else await callback()
+        if iscoroutine(value):
+          value = await value
+        if value in (None, b"", ""):
+          log_warn(f"Cache could not be rehydrated for key: {key}")
+          value = None
+        else:
+          await cache(key, value, expiry=expiry, raw_key=True, pickled=pickled, encoding=encoding)
+      finally:
+        await release_lock(lock)
+    else:
+      if value in (None, b""):
+        value = await await_flight(key, lock, SINGLEFLIGHT_LOCK_SEC) # another worker is fetching
+      if value not in (None, b""):
+        value = pickle.loads(value) if pickled else value.decode(encoding) if encoding else value
+      else:
+        value = None
+    flight.set_result(value)
+    return value
+  except Exception as e:
+    flight.set_exception(e)
+    raise
+  finally:
+    if not flight.done(): # leader cancelled, in-process waiters fail instead of hanging
+      flight.set_exception(RuntimeError(f"Fetch of {name} was cancelled"))
+    flight.exception() # mark as retrieved in case nobody else awaits it
+    if INFLIGHT.get(key) is flight:
+      del INFLIGHT[key]
+
 # pubsub
 async def pub(topics: list[str], msg: str):
   tasks = []
@@ -0,0 +1,247 @@
+# cross-ingester contract view calls batching: calls due within the same tick window are packed per chain
+# into as few multicall3 aggregate3 eth_calls as gas and calldata limits allow, then routed back to their callers
+from asyncio import Future, TimerHandle, gather, get_running_loop, shield
+from functools import lru_cache
+from os import environ as env
+import pickle
+from time import monotonic
+from multicall import constants as mc_const
+from multicall.signature import Signature
+from web3 import AsyncWeb3
+
+from src.utils import log_debug, log_error, log_warn, SEC_BY_TF, YEAR_SECONDS
+import src.state as state
+from src.state import redis
+from src.cache import cache_key
+from src.ratelimit import throttle_rpc
+
+MULTICALL_WINDOW_MS = float(env.get("MULTICALL_WINDOW_MS", 25)) # calls collection window before packing
+MULTICALL_MAX_CALLS = int(env.get("MULTICALL_MAX_CALLS", 500)) # max view calls per aggregate3
+MULTICALL_MAX_CALLDATA = int(env.get("MULTICALL_MAX_CALLDATA", 128_000)) # max aggregate3 calldata bytes (node request size limits)
+MULTICALL_GAS_LIMIT = int(env.get("MULTICALL_GAS_LIMIT", 50_000_000)) # eth_call gas cap (geth default RPCGasCap)
+MULTICALL_CALL_GAS = int(env.get("MULTICALL_CALL_GAS", 50_000)) # gas budgeted per view call
+
+MULTICALL3 = "0xcA11bde05977b3631167028862bE2a173976CA11" # canonical (create2) deployment
+AGGREGATE3 = Signature("aggregate3((address,bool,bytes)[])((bool,bytes)[])")
+CALL_CACHE_BLOCK_SEC = float(env.get("CALL_CACHE_BLOCK_SEC", 1)) # latest block number reuse across ingesters
+CALL_OVERHEAD = 192 # abi encoded (address, bool, bytes) tuple head, offsets and length words
+
+@lru_cache(maxsize=4096)
+def signature(sig: str) -> Signature:
+  return Signature(sig)
+
+def multicall_address(chain_id: str | int) -> str:
+  try:
+    return mc_const.MULTICALL3_ADDRESSES.get(int(chain_id), MULTICALL3)
+  except ValueError: # non-evm or named chain
+    return MULTICALL3
+
+def is_size_error(e: Exception) -> bool:
+  # node side limits (out of gas, request/response too large): smaller batches may succeed
+  msg = str(e).lower()
+  return any(s in msg for s in ("gas", "too large", "size", "exceeds"))
+
+class ChainBatcher:
+  """
+  Collects the view calls of every ingester due on a chain within MULTICALL_WINDOW_MS,
+  deduplicates them (same target and calldata) and executes them as aggregate3 batches on an async provider.
+  """
+
+  def __init__(self, chain_id: str | int):
+    self.chain_id = chain_id
+    self.pending: dict[tuple[str, bytes], tuple[Signature, list[Future]]] = {}
+    self.timer: TimerHandle = None
+    self.calls = self.unique_calls = self.batches = 0
+
+  def submit(self, target: str, sig: str, args: list | tuple=None) -> Future:
+    s = signature(sig)
+    key = (target.lower(), s.encode_data(args))
+    loop = get_running_loop()
+    future = loop.create_future()
+    self.pending.setdefault(key, (s, []))[1].append(future)
+    self.calls += 1
+    if not self.timer:
+      self.timer = loop.call_later(MULTICALL_WINDOW_MS / 1000, lambda: loop.create_task(self.flush()))
+    return future
+
+  def pack(self, calls: list) -> list[list]:
+    max_calls = max(min(MULTICALL_MAX_CALLS, MULTICALL_GAS_LIMIT // MULTICALL_CALL_GAS), 1)
+    batches, batch, size = [], [], 0
+    for call in calls:
+      call_size = len(call[0][1]) + CALL_OVERHEAD
+      if batch and (len(batch) >= max_calls or size + call_size > MULTICALL_MAX_CALLDATA):
+        batches.append(batch)
+        batch, size = [], 0
+      batch.append(call)
+      size += call_size
+    if batch:
+      batches.append(batch)
+    return batches
+
+  async def flush(self):
+    pending, self.pending, self.timer = self.pending, {}, None
+    batches = self.pack(list(pending.items()))
+    self.unique_calls += len(pending)
+    if state.args.verbose:
+      log_debug(f"Packed {sum(len(f) for _, f in pending.values())} view calls ({len(pending)} unique) into {len(batches)} aggregate3 on chain {self.chain_id}")
+    errors = await gather(*[self.execute(batch) for batch in batches], return_exceptions=True)
+    for batch, error in zip(batches, errors):
+      if isinstance(error, Exception): # eg. invalid target address, never leave callers hanging
+        for _, (_, futures) in batch:
+          for future in futures:
+            if not future.done():
+              future.set_exception(error)
+
+  async def execute(self, batch: list):
+    data = AGGREGATE3.encode_data([[(target, True, calldata) for (target, calldata), _ in batch]])
+    tx = {"to": multicall_address(self.chain_id), "data": data, "gas": MULTICALL_GAS_LIMIT}
+    async def aggregate(w3: AsyncWeb3) -> list:
+      await throttle_rpc(w3.provider.endpoint_uri) # one eth_call per batch
+      self.batches += 1
+      return AGGREGATE3.decode_data(await w3.eth.call(tx, "latest"))[0]
+
+    results, error = None, None
+    try:
+      # best scored RPC first, failing over (and hedging if enabled) to the next ones
+      results = await state.web3.call(self.chain_id, aggregate, fatal=lambda e: len(batch) > 1 and is_size_error(e))
+    except Exception as e:
+      if len(batch) > 1 and is_size_error(e): # split until the node accepts it
+        half = len(batch) // 2
+        log_warn(f"aggregate3 of {len(batch)} calls rejected on chain {self.chain_id} ({e}), splitting...")
+        return await gather(self.execute(batch[:half]), self.execute(batch[half:]))
+      error = e
+      log_error(f"aggregate3 on chain {self.chain_id} failed: {e}")
+
+    for i, ((target, _), (s, futures)) in enumerate(batch):
+      if results is None:
+        value = error
+      else:
+        success, output = results[i]
+        try:
+          value = s.decode_data(output) if success else ValueError(f"{s.signature} reverted on {target}")
+          if not isinstance(value, Exception):
+            value = value[0] if len(value) == 1 else value
+        except Exception as e: # malformed output (eg. not a contract)
+          value = e
+      for future in futures:
+        if future.done():
+          continue
+        if isinstance(value, Exception):
+          future.set_exception(value)
+        else:
+          future.set_result(value)
+
+  def stats(self) -> dict:
+    return {"calls": self.calls, "unique_calls": self.unique_calls, "batches": self.batches}
+
+BATCHER_BY_CHAIN: dict[str | int, ChainBatcher] = {}
+
+async def call_many(chain_id: str | int, calls: list[tuple[str, str, list]]) -> list[any]:
+  """
+  Execute contract view calls through the chain's shared aggregate3 batcher.
+
+  :param chain_id: chain id the calls are made on
+  :param calls: (target address, signature eg. "balanceOf(address)(uint256)", arguments)
+  :return: decoded values in order, exceptions for failed calls
+  """
+  if chain_id not in BATCHER_BY_CHAIN:
+    BATCHER_BY_CHAIN[chain_id] = ChainBatcher(chain_id)
+  batcher = BATCHER_BY_CHAIN[chain_id]
+  return await gather(*[batcher.submit(*call) for call in calls], return_exceptions=True)
+
+# call caching policies: immutable (fetched once), block (reused within the same block) or ttl (interval eg. "h1" or seconds)
+IMMUTABLE_CALLS: dict[str, any] = {} # in-process layer, redis is only hit once per process
+BLOCK_BY_CHAIN: dict[str | int, tuple[float, Future]] = {}
+
+def cache_expiry(policy: str | int) -> float:
+  if policy == "immutable":
+    return YEAR_SECONDS
+  if policy == "block":
+    return 3600 # stale blocks are ignored, expiry only bounds memory
+  try:
+    expiry = SEC_BY_TF.get(policy) or float(policy)
+  except (TypeError, ValueError):
+    expiry = 0
+  if expiry <= 0:
+    raise ValueError(f"Invalid call cache policy {policy}, must be immutable, block or a ttl (eg. 'h1' or seconds)")
+  return expiry
+
+def call_key(chain_id: str | int, target: str, sig: str, args: list | tuple=None) -> str:
+  return cache_key(f"calls:{chain_id}:{target.lower()}:{sig}:{args or ''}")
+
+async def fetch_block_number(chain_id: str | int) -> int:
+  async def get_block_number(w3: AsyncWeb3) -> int:
+    await throttle_rpc(w3.provider.endpoint_uri)
+    return await w3.eth.block_number
+  return await state.web3.call(chain_id, get_block_number)
+
+async def block_number(chain_id: str | int) -> int:
+  # shared by every ingester due on the chain within CALL_CACHE_BLOCK_SEC
+  fetched_at, future = BLOCK_BY_CHAIN.get(chain_id, (0, None))
+  stale = not future or monotonic() - fetched_at > CALL_CACHE_BLOCK_SEC
+  if stale or (future.done() and (future.cancelled() or future.exception())): # failed or cancelled fetches are retried
+    future = get_running_loop().create_task(fetch_block_number(chain_id))
+    BLOCK_BY_CHAIN[chain_id] = (monotonic(), future)
+  return await shield(future) # a cancelled caller does not cancel the fetch shared with the others
+
+async def call_many_cached(chain_id: str | int, calls: list[tuple[str, str, list]], policies: list[str | int | None]) -> list[any]:
+  """
+  Same as call_many, calls with a caching policy are served from cache when fresh and left out of the aggregate3.
+
+  :param chain_id: chain id the calls are made on
+  :param calls: (target address, signature, arguments)
+  :param policies: caching policy of every call (None if not cached)
+  :return: decoded values in order, exceptions for failed calls
+  """
+  values, keys = [None] * len(calls), [None] * len(calls)
+  lookups = []
+  for i, (call, policy) in enumerate(zip(calls, policies)):
+    if not policy:
+      continue
+    keys[i] = call_key(chain_id, *call)
+    if policy == "immutable" and keys[i] in IMMUTABLE_CALLS:
+      values[i] = IMMUTABLE_CALLS[keys[i]]
+    else:
+      lookups.append(i)
+
+  hits = [i for i, p in enumerate(policies) if p and values[i] is not None]
+  block = None
+  if any(policies[i] == "block" for i in lookups):
+    try:
+      block = await block_number(chain_id)
+    except Exception as e:
+      log_warn(f"Failed to fetch chain {chain_id} block number, per-block cached calls are called through: {e}")
+  if lookups:
+    try:
+      for i, cached in zip(lookups, await redis.mget(*[keys[i] for i in lookups])):
+        if cached is None:
+          continue
+        cached_block, value = pickle.loads(cached)
+        if policies[i] == "block" and (block is None or cached_block != block):
+          continue
+        values[i] = value
+        hits.append(i)
+        if policies[i] == "immutable":
+          IMMUTABLE_CALLS[keys[i]] = value
+    except Exception as e:
+      log_warn(f"Call cache unavailable on chain {chain_id}, calling through: {e}")
+
+  hit = set(hits)
+  misses = [i for i in range(len(calls)) if i not in hit]
+  if misses:
+    for i, value in zip(misses, await call_many(chain_id, [calls[i] for i in misses])):
+      values[i] = value
+  to_cache = [i for i in misses if policies[i] and not isinstance(values[i], Exception) and (policies[i] != "block" or block is not None)]
+  if to_cache:
+    try:
+      async with redis.pipeline() as pipe:
+        for i in to_cache:
+          pipe.setex(keys[i], round(cache_expiry(policies[i])), pickle.dumps((block, values[i])))
+          if policies[i] == "immutable":
+            IMMUTABLE_CALLS[keys[i]] = values[i]
+        await pipe.execute()
+    except Exception as e:
+      log_warn(f"Failed to cache {len(to_cache)} calls on chain {chain_id}: {e}")
+  if state.args.verbose and hits:
+    log_debug(f"Served {len(hits)}/{len(calls)} calls from cache on chain {chain_id}")
+  return values
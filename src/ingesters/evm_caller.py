@@ -1,21 +1,21 @@
-from asyncio import Task
-from multicall import Call, Multicall, constants as mc_const
+from asyncio import Task, gather
 
 from src.model import Ingester, ResourceField
 from src.utils import log_debug, log_error, log_warn
 from src.actions import store, transform_and_store, scheduler
 from src.cache import ensure_claim_task, get_or_set_cache
 import src.state as state
-
-def parse_generic(data: any) -> any:
-  return data
+from src.calls import call_many_cached, cache_expiry
 
 async def schedule(c: Ingester) -> list[Task]:
 
+  for field in c.fields:
+    if field.cache:
+      cache_expiry(field.cache) # validate the caching policy early
+
   async def ingest(c: Ingester):
     await ensure_claim_task(c)
-    unique_calls, calls_by_chain = set(), {}
-    field_by_name = {f.name: f for f in c.fields}
+    unique_calls, fields_by_chain = set(), {}
 
     for field in c.fields:
       if not field.target or field.id in unique_calls:
@@ -23,43 +23,19 @@ async def schedule(c: Ingester) -> list[Task]:
           log_warn(f"Duplicate target smart contract view {field.target} in {c.name}.{field.name}, skipping...")
         continue
       unique_calls.add(field.id)
-
-      chain_id, addr = field.chain_addr()
-      if chain_id not in calls_by_chain:
-        client = state.web3.client(chain_id)
-        calls_by_chain[chain_id] = Multicall(calls=[], _w3=client, require_success=True, gas_limit=mc_const.GAS_LIMIT)
-      calls_by_chain[chain_id].calls.append(Call(target=addr, function=[field.selector, *field.params], returns=[[field.name, parse_generic]]))
-
-    tp = state.thread_pool
-
-    def call_multi(m: Multicall):
-      try:
-        output = None
-        retry_count = 0
-        while not output and retry_count < state.args.max_retries:
-          try:
-            output = tp.submit(m).result(timeout=3)
-            return output
-          except Exception as e: # (TimeoutError, FutureTimeoutError):
-            log_error(f"Multicall for chain {chain_id} failed: {e}, switching RPC...")
-            m.w3 = state.web3.client(chain_id, rolling=True)
-            retry_count += 1
-
-        if not output:
-            log_error(f"Failed to execute multicall for chain {chain_id} after {state.args.max_retries} retries.")
-            return {}
-
-      except Exception as e:
-        log_error(f"Failed to execute multicall for chain {chain_id}: {e}")
-
-    futures = []
-    for chain_id, m in calls_by_chain.items():
-      futures.append(tp.submit(call_multi, m))
-
-    for future in futures:
-      output = future.result() # max 3s timeout
-      for name, value in output.items():
-        field = field_by_name.get(name)
+      chain_id, _ = field.chain_addr()
+      fields_by_chain.setdefault(chain_id, []).append(field)
+
+    # cached calls are served from cache, others are packed with every other ingester's due on the same chain (cf. src/calls.py)
+    outputs = await gather(*[
+      call_many_cached(chain_id, [(field.chain_addr()[1], field.selector, field.params) for field in fields], [field.cache for field in fields])
+      for chain_id, fields in fields_by_chain.items()])
+
+    for fields, values in zip(fields_by_chain.values(), outputs):
+      for field, value in zip(fields, values):
+        if isinstance(value, Exception):
+          log_error(f"Failed to call {field.selector} on {field.target} for {c.name}.{field.name}: {value}")
+          continue
         field.value = value
         c.data_by_field[field.name] = field.value
 
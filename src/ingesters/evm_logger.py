@@ -1,137 +1,420 @@
-from asyncio import Task
-from web3 import Web3
+from asyncio import Queue, Task, create_task, gather, sleep
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from os import environ as env
+import re
+from time import monotonic
+import numpy as np
+from eth_abi import decode as abi_decode
+from web3 import AsyncWeb3, Web3
 
 from src.model import Ingester, ResourceField
-from src.utils import log_debug, log_error, log_info, log_warn, split_chain_addr
-from src.actions import store, transform_and_store, scheduler
-from src.cache import ensure_claim_task, get_or_set_cache
+from src.utils import log_debug, log_error, log_info, log_warn, split_chain_addr, to_hex
+from src.actions import store, transform_and_store_batch, scheduler
+from src.cache import NS, ensure_claim_task, get_or_set_cache
 import src.state as state
+from src.state import redis
+from src.ratelimit import throttle_rpc
+from src.calls import block_number
+
+LOGS_CHUNK_BLOCKS = int(env.get("LOGS_CHUNK_BLOCKS", 2000)) # initial eth_getLogs block range, adapted to what providers accept
+LOGS_MAX_CHUNK_BLOCKS = int(env.get("LOGS_MAX_CHUNK_BLOCKS", 50_000))
+LOGS_CONCURRENCY = int(env.get("LOGS_CONCURRENCY", 4)) # chunks fetched concurrently across the RPC pool
+LOGS_MAX_CHUNKS_PER_TICK = int(env.get("LOGS_MAX_CHUNKS_PER_TICK", 64)) # catch-up bound per ingestion, the cursor resumes next tick
+LOGS_REJECTED_TTL_SEC = float(env.get("LOGS_REJECTED_TTL_SEC", 600)) # rejected ranges bound the chunk growth this long
+
+BACKFILL_SEGMENT_BLOCKS = int(env.get("BACKFILL_SEGMENT_BLOCKS", 20_000)) # blocks per backfill work unit (checkpoint granularity)
+BACKFILL_WORKERS_PER_RPC = int(env.get("BACKFILL_WORKERS_PER_RPC", 2)) # concurrent segments per configured RPC
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+CHUNK_BLOCKS_BY_CHAIN: dict[str | int, int] = {}
+REJECTED_CHUNK_BLOCKS_BY_CHAIN: dict[str | int, tuple[int, float]] = {} # smallest rejected range and when, growth converges below it
+
+RANGE_ERRORS = ("range", "too many results", "more than", "10000 results", "response size", "too large", "timed out", "timeout")
+RATE_LIMIT_ERRORS = ("rate limit", "too many requests", "429", "request limit", "budget", "capacity", "throttl")
+
+def is_range_error(e: Exception) -> bool:
+  # providers rejecting a range (too many blocks or results, response too large or too slow)
+  # rate limiting is not, it is failed over like any endpoint error
+  msg = str(e).lower()
+  return not any(s in msg for s in RATE_LIMIT_ERRORS) and any(s in msg for s in RANGE_ERRORS)
+
+def rejected_chunk_blocks(chain_id: str | int) -> int:
+  # providers' limits may be raised, or the rejecting endpoint out of rotation: the bound expires
+  rejected, at = REJECTED_CHUNK_BLOCKS_BY_CHAIN.get(chain_id, (0, 0.0))
+  if not rejected or monotonic() - at > LOGS_REJECTED_TTL_SEC:
+    return LOGS_MAX_CHUNK_BLOCKS + 1
+  return rejected
+
+def cursor_key(name: str, contract: str) -> str:
+  return f"{NS}:cursors:{name}:{contract}"
+
+async def get_logs(chain_id: str | int, f: dict, from_block: int, to_block: int) -> list[dict]:
+  async def fetch(w3: AsyncWeb3) -> list[dict]:
+    await throttle_rpc(w3.provider.endpoint_uri)
+    return await w3.eth.get_logs({**f, "fromBlock": hex(from_block), "toBlock": hex(to_block)})
+  return await state.web3.call(chain_id, fetch, fatal=is_range_error) # range errors are not failed over, but split
+
+async def get_logs_chunked(chain_id: str | int, f: dict, from_block: int, to_block: int, max_chunks=0) -> tuple[list[dict], int]:
+  """
+  Fetch the logs of [from_block, to_block] in chunks fetched concurrently, whose size adapts to the providers:
+  halved when a range is rejected, grown after a successful round.
+
+  :param chain_id: chain id
+  :param f: eth_getLogs filter (address, topics)
+  :param from_block: first block (inclusive)
+  :param to_block: last block (inclusive)
+  :param max_chunks: max chunks fetched, unbounded if 0
+  :return: logs in block order and the next block to fetch (gapless: stops at the first failing chunk)
+  """
+  logs, next_block, chunks = [], from_block, 0
+  while next_block <= to_block and (not max_chunks or chunks < max_chunks):
+    size = CHUNK_BLOCKS_BY_CHAIN.get(chain_id, LOGS_CHUNK_BLOCKS)
+    ranges, start = [], next_block
+    while start <= to_block and len(ranges) < LOGS_CONCURRENCY and (not max_chunks or chunks + len(ranges) < max_chunks):
+      ranges.append((start, min(start + size - 1, to_block)))
+      start = ranges[-1][1] + 1
+    chunks += len(ranges)
+    for (start, end), res in zip(ranges, await gather(*[get_logs(chain_id, f, *r) for r in ranges], return_exceptions=True)):
+      if isinstance(res, Exception):
+        if not is_range_error(res) or size <= 1:
+          log_error(f"Failed to get chain {chain_id} logs of blocks {start}-{end}: {res}")
+          return logs, next_block
+        REJECTED_CHUNK_BLOCKS_BY_CHAIN[chain_id] = (min(rejected_chunk_blocks(chain_id), end - start + 1), monotonic())
+        CHUNK_BLOCKS_BY_CHAIN[chain_id] = min(CHUNK_BLOCKS_BY_CHAIN.get(chain_id, size), max(size // 2, 1))
+        log_debug(f"Chain {chain_id} logs range of {size} blocks rejected ({res}), lowered to {CHUNK_BLOCKS_BY_CHAIN[chain_id]}")
+        break # later chunks are refetched from here with the smaller size
+      logs.extend(res)
+      next_block = end + 1
+    else:
+      rejected = rejected_chunk_blocks(chain_id)
+      CHUNK_BLOCKS_BY_CHAIN[chain_id] = max(min(size * 3 // 2, (size + rejected) // 2), size) # bisects towards the provider's limit
+  return logs, next_block
+
+def split_params(params: str) -> list[str]:
+  # top level params, tuple types nest their own (eg. "indexed address,(address,uint256)[]")
+  out, depth, start = [], 0, 0
+  for i, ch in enumerate(params):
+    depth += (ch == "(") - (ch == ")")
+    if ch == "," and not depth:
+      out.append(params[start:i])
+      start = i + 1
+  out.append(params[start:])
+  return [p.strip() for p in out if p.strip()]
 
 def parse_event_signature(signature: str) -> tuple[str, list[str], list[bool]]:
-  event_name, params = signature.split('(')
-  param_list = params.rstrip(')').split(',')
-  param_types = [param.split(' ')[-1] for param in param_list]
-  indexed = ['indexed' in param for param in param_list]
+  event_name, sep, params = signature.strip().partition('(')
+  if not sep or not params.endswith(')') or params.count('(') != params.count(')') - 1:
+    raise ValueError(f"Invalid event signature {signature}, expected eg. Transfer(indexed address,indexed address,uint256)")
+  param_list = split_params(params[:-1])
+  param_types = [" ".join(w for w in param.split(' ') if w != 'indexed').replace(" ", "") for param in param_list]
+  indexed = ['indexed' in param.split(' ') for param in param_list]
   return event_name.strip(), param_types, indexed
 
-def decode_log_data(client: Web3, log: dict, topics_first: list[str], indexed: list[bool]) -> tuple:
-  topics = log['topics'][1:]
-  data = bytes()
-  for t in topics:
-    data += t
-  data += log['data']
-  decoded = client.codec.decode(types=topics_first, data=data)
-  return tuple(reorder_decoded_params(decoded, indexed))
-
-def reorder_decoded_params(decoded: list, indexed: list[bool]) -> list:
-  reordered = []
-  index_count, non_index_count = 0, 0
-
-  for is_indexed in indexed:
-    if is_indexed:
-      reordered.append(decoded[index_count])
-      index_count += 1
-    else:
-      reordered.append(decoded[index_count + non_index_count])
-      non_index_count += 1
-  return reordered
+def canonical_signature(signature: str) -> str:
+  # hashed as topic0 (eg. Swap(address,address,int256,...))
+  event_name, param_types, _ = parse_event_signature(signature)
+  return f"{event_name}({','.join(param_types)})"
 
-async def schedule(c: Ingester) -> list[Task]:
+STATIC_WORD_TYPES = re.compile(r"address|bool|u?int(\d*)|bytes(\d+)") # elementary types fitting a 32 bytes word
+
+def is_dynamic(t: str) -> bool:
+  return t in ("string", "bytes") or t.endswith("[]")
+
+class EventDecoder:
+  """
+  Event decoder precompiled from its signature: elementary params (address, bool, (u)intN, bytesN) are sliced
+  straight out of the topics and data head words of a whole block of logs at once, into numpy columns.
+  Other params (string, bytes, arrays, tuples) fall back to eth_abi, indexed ones are their topic (keccak hash).
+  """
+
+  def __init__(self, signature: str):
+    self.signature = signature
+    _, self.types, self.indexed = parse_event_signature(signature)
+    self.topics = sum(self.indexed) # topic1..3
+    self.data_types = [t for t, i in zip(self.types, self.indexed) if not i]
+    # static tuples and fixed size arrays span several head words: no per-param offsets, fully eth_abi decoded
+    aligned = all(STATIC_WORD_TYPES.fullmatch(t) or is_dynamic(t) for t in self.data_types)
+    self.head = 32 * len(self.data_types) if aligned else 0 # data bytes sliced
+    self.slots: list[int | None] = [] # param -> word index (topics first, then data head), None if eth_abi decoded
+    self.fallback: list[int | None] = [] # param -> index in the eth_abi decoded data
+    topic, word = 0, 0
+    for t, is_indexed in zip(self.types, self.indexed):
+      if is_indexed:
+        self.slots.append(topic) # dynamic ones are hashes, sliced as bytes32
+        self.fallback.append(None)
+        topic += 1
+        continue
+      self.slots.append(self.topics + word if aligned and STATIC_WORD_TYPES.fullmatch(t) else None)
+      self.fallback.append(None if self.slots[-1] is not None else word)
+      word += 1
+    self.words = self.topics + self.head // 32
+    self.word_types = ["bytes32" if i and (is_dynamic(t) or not STATIC_WORD_TYPES.fullmatch(t)) else t for t, i in zip(self.types, self.indexed)]
+
+  def accepts(self, log: dict) -> bool:
+    # same topic0 with a different indexing (eg. ERC20 and ERC721 Transfer) or truncated data
+    return len(log["topics"]) == 1 + self.topics and len(log["data"]) >= self.head
+
+  def decode_word(self, t: str, w: np.ndarray) -> np.ndarray:
+    # w: (n, 32) big endian words
+    n = len(w)
+    if t == "bool":
+      return w[:, 31] != 0
+    if t == "address":
+      h = np.ascontiguousarray(w[:, 12:]).tobytes().hex()
+      return np.array(["0x" + h[i:i + 40] for i in range(0, 40 * n, 40)], dtype=object)
+    match = STATIC_WORD_TYPES.fullmatch(t)
+    if match.group(2): # bytesN
+      size = int(match.group(2))
+      raw = np.ascontiguousarray(w[:, :size]).tobytes()
+      col = np.empty(n, dtype=object)
+      col[:] = [raw[i:i + size] for i in range(0, size * n, size)]
+      return col
+    signed = t.startswith("int")
+    low = np.ascontiguousarray(w[:, 24:]).view(">i8" if signed else ">u8").ravel()
+    if int(match.group(1) or 256) > 64: # fits 64 bits unless any high byte is set (or unset for negative ints)
+      high = w[:, :24]
+      fits = (high == 0).all(axis=1)
+      if signed:
+        fits = (fits & (low >= 0)) | ((high == 0xff).all(axis=1) & (low < 0))
+      if not fits.all(): # arbitrary size python ints
+        col = np.empty(n, dtype=object)
+        col[:] = [int.from_bytes(bytes(row), "big", signed=signed) for row in w]
+        return col
+    return low.astype(np.int64 if signed else np.uint64)
+
+  def decode(self, logs: list[dict]) -> np.ndarray:
+    """
+    Decode a block of logs of this event into columns.
 
-  contracts: set[str] = set()
-  data_by_event: dict[str, dict] = {}
-  index_first_types_by_event: dict[str, list[str]] = {}
-  event_hashes: dict[str, str] = {}
+    :param logs: logs of this event (cf. accepts)
+    :return: structured array of one row per log, one field per param in signature order (rows[i] indexing)
+    """
+    n = len(logs)
+    if not n:
+      return np.empty(0, dtype=[(f"p{i}", object) for i in range(len(self.types))])
+    columns: list[np.ndarray] = [None] * len(self.types)
+    if self.words:
+      buf = b"".join(b"".join(l["topics"][1:]) + bytes(l["data"][:self.head]) for l in logs)
+      words = np.frombuffer(buf, dtype=np.uint8).reshape(n, self.words, 32)
+      for i, slot in enumerate(self.slots):
+        if slot is not None:
+          columns[i] = self.decode_word(self.word_types[i], words[:, slot])
+    if any(j is not None for j in self.fallback):
+      decoded = [abi_decode(self.data_types, bytes(l["data"])) for l in logs]
+      for i, j in enumerate(self.fallback):
+        if j is not None:
+          columns[i] = np.empty(n, dtype=object)
+          for k, d in enumerate(decoded): # item-wise, tuples and arrays would be broadcast
+            columns[i][k] = d[j]
+    rows = np.empty(n, dtype=[(f"p{i}", col.dtype) for i, col in enumerate(columns)])
+    for i, col in enumerate(columns):
+      rows[f"p{i}"] = col
+    return rows
+
+@dataclass
+class EventFilters:
+  contracts: set[str] = field(default_factory=set)
+  filter_by_contract: dict[str, dict] = field(default_factory=dict) # eth_getLogs filters
+  event_hashes: dict[str, str] = field(default_factory=dict) # event id <-> topic0
+  decoder_by_event: dict[str, EventDecoder] = field(default_factory=dict)
+
+def compile_filters(c: Ingester) -> EventFilters:
+  ef = EventFilters()
   events_by_contract: dict[str, set[str]] = {}
-  filter_by_contract: dict[str, dict] = {}
-  filter_index_by_event: dict[str, int] = {}
-  last_block_by_contract: dict[str, int] = {}
 
-  for field in c.fields:
-    contracts.add(field.target)
-    events_by_contract.setdefault(field.target, set()).add(field.selector)
+  for f in c.fields:
+    ef.contracts.add(f.target)
+    events_by_contract.setdefault(f.target, set()).add(f.selector)
 
-  for contract in contracts:
+  for contract in ef.contracts:
 
     chain_id, addr = split_chain_addr(contract)
     addr = Web3.to_checksum_address(addr) # enforce checksum
 
-    for event in events_by_contract[contract].copy(): # copy to avoid modifying while iterating
-      event_name, param_types, indexed = parse_event_signature(field.selector)
-      index_types, non_index_types = [], []
-      event_id = f"{field.target}:{field.selector}"
-
-      event_hash = Web3.keccak(text=field.selector.replace('indexed ', '')).hex()
-      event_hashes[event_id] = event_hash; event_hashes[event_hash] = event_id
+    for event in events_by_contract[contract]:
+      event_id = f"{contract}:{event}"
 
-      for i, is_indexed in enumerate(indexed):
-        index_types.append(param_types[i]) if is_indexed else non_index_types.append(param_types[i])
-      index_first_types_by_event[event_id] = list(index_types) + non_index_types
+      event_hash = to_hex(Web3.keccak(text=canonical_signature(event)))
+      ef.event_hashes[event_id] = event_hash; ef.event_hashes[event_hash] = event_id
 
-      events_by_contract.setdefault(field.target, set()).add(event_id)
-      data_by_event.setdefault(event_id, {})
+      ef.decoder_by_event[event_id] = EventDecoder(event)
 
-      filter_by_contract.setdefault(field.target, {
-        "fromBlock": "latest",
-        "toBlock": "latest",
+      ef.filter_by_contract.setdefault(contract, {
         "address": addr,
-        "topics": []
-      })["topics"].append(event_hashes[event_id])
+        "topics": [[]] # any of the contract's events (topic0)
+      })["topics"][0].append(event_hash)
 
-      filter_index_by_event[event_id] = len(filter_by_contract[field.target]["topics"]) - 1
+    ef.filter_by_contract[contract]["topics"][0] = list(set(ef.filter_by_contract[contract]["topics"][0])) # remove duplicates
+  return ef
 
-    filter_by_contract[contract]["topics"] = list(set(filter_by_contract[contract]["topics"])) # remove duplicates
+def decode_logs(ef: EventFilters, logs: list[dict]) -> dict[str, tuple[list[dict], np.ndarray]]:
+  # (logs, decoded events) by event id, in block order
+  logs_by_id: dict[str, list[dict]] = {}
+  for l in logs:
+    event_id = ef.event_hashes.get(to_hex(l["topics"][0]))
+    if not event_id:
+      continue
+    if not ef.decoder_by_event[event_id].accepts(l):
+      log_warn(f"Skipping log {to_hex(l['transactionHash'])}:{l['logIndex']} not matching {event_id}")
+      continue
+    logs_by_id.setdefault(event_id, []).append(l)
+  events_by_id = {event_id: (logs, ef.decoder_by_event[event_id].decode(logs)) for event_id, logs in logs_by_id.items()}
+  if state.args.verbose:
+    for event_id, (logs, _) in events_by_id.items():
+      log_debug(f"Decoded {len(logs)} {event_id} events of blocks {logs[0]['blockNumber']}-{logs[-1]['blockNumber']}")
+  return events_by_id
 
-  def poll_events(contract: str):
-    chain_id, addr = split_chain_addr(contract)
-    client = state.web3.client(chain_id)
-    f = filter_by_contract[contract]
-    retry_count = 0
-    output = None
-    current_block = client.eth.block_number
-    last_block_by_contract.setdefault(contract, current_block)
-    prev_block = last_block_by_contract[contract]
-    while not output and retry_count < state.args.max_retries:
-      if state.args.verbose:
-        log_debug(f"Polling for {contract} events...")
-      start_block = prev_block
-      end_block = current_block
-      f.update({"fromBlock": hex(start_block), "toBlock": hex(end_block)})
-      if start_block >= end_block:
-        log_info(f"No new blocks for {contract}, skipping event polling for {c.interval}")
-        break
-      try:
-        logs = client.eth.get_logs(f)
-        for l in logs:
-          event_id = l["topics"][0]
-          decoded_event = decode_log_data(client, l, index_first_types_by_event[event_id], indexed)
-          if state.args.verbose:
-            log_debug(f"Block: {l['blockNumber']} | Event: {decoded_event}")
-        start_block = end_block + 1
-      except Exception as l:
-        log_error(f"Failed to poll event logs for contract {c}: {l}")
-        client = state.web3.client(chain_id, rolling=True)
-        retry_count += 1
+def backfill_key(name: str, contract: str) -> str:
+  return f"{NS}:backfill:{name}:{contract}"
 
-  async def ingest(c: Ingester):
-    await ensure_claim_task(c)
+async def block_timestamps(chain_id: str | int, blocks: list[int]) -> dict[int, int]:
+  # concurrent header fetches share JSON-RPC batches (cf. BatchHTTPProvider)
+  async def fetch(n: int) -> int:
+    async def get_block(w3: AsyncWeb3) -> dict:
+      await throttle_rpc(w3.provider.endpoint_uri)
+      return await w3.eth.get_block(n)
+    return (await state.web3.call(chain_id, get_block))["timestamp"]
+  return dict(zip(blocks, await gather(*[fetch(n) for n in blocks])))
+
+def events_resource(c: Ingester, fields: list[ResourceField]) -> Ingester:
+  # event rows carry their position on chain, their unique key
+  return Ingester(name=c.name, resource_type=c.resource_type, interval=c.interval, ingester_type=c.ingester_type,
+    fields=fields + [ResourceField(name="block", type="uint64"), ResourceField(name="log_index", type="uint32")])
+
+def event_date(block_ts: int, block: int, log_index: int) -> datetime:
+  # unique microseconds within the block's second: blocks sharing a timestamp (eg. Arbitrum) and up to 10k logs per block
+  return EPOCH + timedelta(seconds=block_ts, microseconds=(block % 100) * 10_000 + log_index % 10_000)
+
+def ensure_event_precision():
+  # coarser timestamps collapse the events of a block onto a single row (cf. event_date)
+  if state.tsdb.precision not in ("us", "ns"):
+    raise ValueError(f"evm_logger requires a us tsdb precision, got {state.tsdb.precision} (eg. TAOS_PRECISION=us)")
+
+async def store_events(c: Ingester, chain_id: str | int, events_by_id: dict[str, tuple[list[dict], np.ndarray]]) -> int:
+  """
+  Transform and bulk insert decoded events, one row per event keyed by its block and log index
+  (cf. event_date, us precision is required for tsdbs keying rows on their timestamp).
+  Fields are transformed in batches per event, with only the fields selecting it.
+  """
+  blocks = sorted({l["blockNumber"] for logs, _ in events_by_id.values() for l in logs})
+  ts_by_block = await block_timestamps(chain_id, blocks)
+  count = 0
+  for event_id, (logs, decoded) in events_by_id.items():
+    fields = [f for f in c.fields if f"{f.target}:{f.selector}" == event_id]
+    sub = events_resource(c, fields)
+    columns = {f.name: decoded for f in fields}
+    columns["block"] = np.array([l["blockNumber"] for l in logs], dtype=np.uint64)
+    columns["log_index"] = np.array([l["logIndex"] for l in logs], dtype=np.uint32)
+    dates = [event_date(ts_by_block[l["blockNumber"]], l["blockNumber"], l["logIndex"]) for l in logs]
+    count += await transform_and_store_batch(sub, columns, dates, table=c.name)
+  return count
 
-    future_by_contract = {}
-    tp = state.thread_pool
-    for contract in contracts:
-      future_by_contract[contract] = tp.submit(poll_events, contract)
+async def backfill(c: Ingester, from_block: int, to_block=0) -> int:
+  """
+  Index the ingester's past events from `from_block`, next to (and without blocking) the live tip ingestion.
+  History is split into segments fetched by a worker pool spread across the chain's RPCs,
+  decoded and bulk inserted per segment, progress is checkpointed in redis so that a killed backfill resumes.
 
-    for field in c.fields:
-      try:
-        field.value = future_by_contract[field.target].result(timeout=3)
-        c.data_by_field[field.name] = field.value
-      except Exception as e:
-        log_error(f"Failed to poll events for {field.target}: {e}")
+  :param c: evm_logger ingester
+  :param from_block: first block to index
+  :param to_block: last block to index, defaults to where the live cursor started
+  :return: number of events stored
+  """
+  ef = compile_filters(c)
+  ensure_event_precision()
+  await state.tsdb.create_table(events_resource(c, c.fields)) # if not exists
+  total = 0
+  for contract in ef.contracts:
+    chain_id, _ = split_chain_addr(contract)
+    live_key, key = cursor_key(c.name, contract), backfill_key(c.name, contract)
+    end = to_block
+    if not end: # hand over to the live ingestion: backfill up to its cursor, or start it right after the backfilled range
+      await redis.set(live_key, await block_number(chain_id) + 1, nx=True)
+      end = int(await redis.get(live_key)) - 1
+    checkpoint = await redis.get(key)
+    start = max(from_block, int(checkpoint)) if checkpoint else from_block
+    if start > end:
+      log_info(f"{c.name} {contract} already backfilled up to block {end}")
+      continue
 
+    segments = Queue()
+    for s in range(start, end + 1, BACKFILL_SEGMENT_BLOCKS):
+      segments.put_nowait((s, min(s + BACKFILL_SEGMENT_BLOCKS - 1, end)))
+    done: dict[int, int] = {} # segment start -> end
+    watermark, stored, started = start, 0, monotonic()
+
+    async def worker():
+      nonlocal watermark, stored
+      while not segments.empty():
+        s, e = segments.get_nowait()
+        for attempt in range(state.args.max_retries + 1): # gaps are not an option, the segment is fetched whole
+          logs, next_block = await get_logs_chunked(chain_id, ef.filter_by_contract[contract], s, e)
+          if next_block > e:
+            break
+          if attempt == state.args.max_retries:
+            raise ValueError(f"Backfill of {contract} blocks {s}-{e} stalled at {next_block} after {attempt + 1} attempts, resumable from block {watermark}")
+          log_warn(f"Backfill of {contract} blocks {s}-{e} stalled at {next_block}, retrying...")
+          await sleep(state.args.retry_cooldown)
+        count = await store_events(c, chain_id, decode_logs(ef, logs))
+        stored += count
+        done[s] = e
+        while watermark in done: # contiguous progress only
+          watermark = done.pop(watermark) + 1
+        await redis.set(key, watermark)
+        elapsed = monotonic() - started
+        log_info(f"Backfilled {c.name} {contract} up to block {watermark - 1}/{end} ({stored} events, {(watermark - start) / elapsed:.0f} blocks/s)")
+
+    workers = max(len(state.web3.pool(chain_id).endpoints) * BACKFILL_WORKERS_PER_RPC, 1)
+    tasks = [create_task(worker()) for _ in range(workers)]
+    try:
+      await gather(*tasks)
+    except Exception:
+      for task in tasks: # stop at the first failed segment, the checkpoint only covers contiguous progress
+        task.cancel()
+      raise
+    total += stored
+  return total
+
+async def schedule(c: Ingester) -> list[Task]:
+
+  ef = compile_filters(c)
+  ensure_event_precision()
+  contracts = ef.contracts
+  created = False
+
+  async def ingest_events(contract: str) -> int:
+    chain_id, _ = split_chain_addr(contract)
+    key = cursor_key(c.name, contract)
+    current_block = await block_number(chain_id) # shared with other ingesters on the chain
+    cursor = await redis.get(key) # next block to fetch, shared by the cluster and persisted across restarts
+    from_block = int(cursor) if cursor else current_block
+    if from_block > current_block:
+      log_info(f"No new blocks for {contract}, skipping event polling for {c.interval}")
+      return 0
     if state.args.verbose:
-      log_debug(f"Ingested {c.name} -> {c.data_by_field}")
+      log_debug(f"Polling for {contract} events of blocks {from_block}-{current_block}...")
+    logs, next_block = await get_logs_chunked(chain_id, ef.filter_by_contract[contract], from_block, current_block, LOGS_MAX_CHUNKS_PER_TICK)
+    count = await store_events(c, chain_id, decode_logs(ef, logs)) # one row per event, same as backfills
+    if next_block > from_block:
+      await redis.set(key, next_block) # once stored, failed ticks are refetched
+    if next_block <= current_block:
+      log_warn(f"{contract} events polled up to block {next_block - 1}/{current_block}, resuming next tick")
+    return count
+
+  async def ingest(c: Ingester):
+    nonlocal created
+    await ensure_claim_task(c)
+    if not created:
+      await state.tsdb.create_table(events_resource(c, c.fields)) # if not exists, events are bulk inserted
+      created = True
 
-    await transform_and_store(c)
+    counts = await gather(*[ingest_events(contract) for contract in contracts], return_exceptions=True)
+    for contract, count in zip(contracts, counts):
+      if isinstance(count, Exception):
+        log_error(f"Failed to ingest events for {contract}: {count}")
+      elif state.args.verbose:
+        log_debug(f"Ingested {count} {c.name} events from {contract}")
 
   # globally register/schedule the ingester
   return [await scheduler.add_ingester(c, fn=ingest, start=False)]
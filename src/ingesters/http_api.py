@@ -1,37 +1,82 @@
 from asyncio import Task, gather
-from hashlib import md5
-import json
-from aiohttp import ClientSession
+from hashlib import blake2b, md5
 
-from src.utils import log_error, select_nested
-from src.model import Ingester
-from src.cache import ensure_claim_task, get_or_set_cache
+from src.utils import floor_utc, log_debug, log_error, parse_json, SelectorTree
+from src.model import Ingester, ResourceField
+from src.cache import ensure_claim_task, singleflight
 from src.actions.schedule import scheduler
-from src.actions.store import transform_and_store
+from src.actions.store import store, transform_and_store
+from src.ratelimit import adapt, throttle
+import src.state as state
+
+VALIDATORS: dict[str, tuple[str, str, str]] = {} # url -> (etag, last-modified, body) of the last validated response
 
 async def fetch_json(url: str) -> str:
-  async with ClientSession() as session:
-    async with session.get(url) as response:
-      if response.status == 200:
-        return await response.text()
-      return ""
+  etag, last_modified, body = VALIDATORS.get(url, (None, None, ""))
+  headers = {}
+  if etag:
+    headers["If-None-Match"] = etag
+  if last_modified:
+    headers["If-Modified-Since"] = last_modified
+  if not await throttle(url): # per host budget shared across workers
+    return ""
+  async with state.http.get(url, headers=headers) as response: # pooled keep-alive session
+    await adapt(url, response.status, response.headers)
+    if response.status == 304: # not modified, reuse the last body
+      return body
+    if response.status == 200:
+      text = await response.text()
+      etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+      if etag or last_modified: # only keep bodies of servers supporting conditional requests
+        VALIDATORS[url] = (etag, last_modified, text)
+      return text
+    return ""
+
+def payload_digest(data: str | bytes) -> bytes:
+  return blake2b(data.encode() if isinstance(data, str) else data, digest_size=16).digest()
 
 async def schedule(c: Ingester) -> list[Task]:
 
   data_by_route: dict[str, dict] = {}
+  last_by_route: dict[str, tuple[bytes, dict]] = {} # route -> (payload digest, parsed payload) of the last tick
   hashes: dict[str, str] = {}
 
+  # selectors compiled once per target, fields sharing a target are extracted in a single pass
+  fields_by_target: dict[str, list[ResourceField]] = {}
+  for field in c.fields:
+    if field.target:
+      fields_by_target.setdefault(field.target, []).append(field)
+  trees = {target: SelectorTree([f.selector for f in fields]) for target, fields in fields_by_target.items()}
+
   async def ingest(c: Ingester):
     await ensure_claim_task(c)
 
+    changed = False
+
     async def fetch_hashed(url: str) -> dict:
-      data_str = await get_or_set_cache(hashes[url], lambda: fetch_json(url), c.interval_sec)
+      nonlocal changed
+      h = hashes[url]
+      try:
+        data_str = await singleflight(h, lambda: fetch_json(url), c.interval_sec) # one fetch per url and interval cluster-wide
+      except Exception as e: # failed routes are skipped, not the whole tick
+        log_error(f"Error fetching {url}: {e}")
+        data_str = None
+      if not data_str:
+        changed = True # never mistake a failed fetch for an unchanged payload
+        log_error(f"Failed to fetch {url}")
+        return
+      digest = payload_digest(data_str)
+      if h in last_by_route and last_by_route[h][0] == digest:
+        data_by_route[h] = last_by_route[h][1] # identical payload, skip parsing
+        return
+      changed = True
       try:
-        data_by_route[hashes[url]] = json.loads(data_str)
+        data_by_route[h] = parse_json(data_str)
+        last_by_route[h] = (digest, data_by_route[h])
       except Exception as e:
         log_error(f"Failed to parse JSON response from {url}: {e}")
 
-    fetch_tasks = []
+    fetch_tasks = {} # hash -> fetch, fields sharing a url fetch it once
     for field in c.fields:
       if field.target:
         url = field.target
@@ -40,13 +85,23 @@ async def schedule(c: Ingester) -> list[Task]:
         # Create a unique key using a hash of the URL and interval
         if not url in hashes:
           hashes[url] = md5(f"{url}:{c.interval}".encode()).hexdigest()
-        if not hashes[url] in data_by_route:
-          fetch_tasks.append(fetch_hashed(url))
+        if not hashes[url] in data_by_route and not hashes[url] in fetch_tasks:
+          fetch_tasks[hashes[url]] = fetch_hashed(url)
+
+    await gather(*fetch_tasks.values())
 
-    await gather(*fetch_tasks)
+    if not changed and c.ingestion_time: # all routes unchanged since the last stored values
+      if c.on_unchanged == "store":
+        c.ingestion_time = floor_utc(c.interval)
+        await store(c)
+      else:
+        log_debug(f"Unchanged payloads for {c.name}, skipping...")
+      data_by_route.clear()
+      return
 
-    for field in [f for f in c.fields if f.target]:
-      field.value = select_nested(field.selector, data_by_route[hashes[field.target]])
+    for target, fields in fields_by_target.items():
+      for field, value in zip(fields, trees[target].select(data_by_route[hashes[target]])):
+        field.value = value
 
     await transform_and_store(c)
 
@@ -1,28 +1,31 @@
 from asyncio import Task, gather
-from aiohttp import ClientError, ClientSession
+from aiohttp import ClientError
 from hashlib import md5
 from lxml import html
 from bs4 import BeautifulSoup
 
 from src.utils import floor_utc, interval_to_seconds, log_error
 from src.model import Ingester
-from src.cache import ensure_claim_task, get_or_set_cache
+from src.cache import ensure_claim_task, singleflight
 import src.state as state
 from src.actions import transform_and_store, scheduler
+from src.ratelimit import adapt, throttle
 
 def is_xpath(selector: str) -> bool:
   return selector.startswith(("//", "./"))
 
 async def get_page(url: str) -> str:
-  async with ClientSession() as session:
-    try:
-      async with session.get(url) as response:
-        if response.status == 200:
-          return await response.text()
-        else:
-          log_error(f"Failed to fetch page {url}, status code: {response.status}")
-    except ClientError as e:
-      log_error(f"Error fetching page {url}: {e}")
+  try:
+    if not await throttle(url): # per host budget shared across workers
+      return ""
+    async with state.http.get(url) as response: # pooled keep-alive session
+      await adapt(url, response.status, response.headers)
+      if response.status == 200:
+        return await response.text()
+      else:
+        log_error(f"Failed to fetch page {url}, status code: {response.status}")
+  except (ClientError, ValueError) as e:
+    log_error(f"Error fetching page {url}: {e}")
   return ""
 
 async def schedule(c: Ingester) -> list[Task]:
@@ -42,7 +45,7 @@ async def schedule(c: Ingester) -> list[Task]:
       h = hashes[url]
       if h in pages:
         return pages[h]
-      page = await get_or_set_cache(h, lambda: get_page(url), expiry_sec)
+      page = await singleflight(h, lambda: get_page(url), expiry_sec) # one fetch per url and interval cluster-wide
       if not page:
         log_error(f"Failed to fetch page {url}, skipping...")
 
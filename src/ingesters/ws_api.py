@@ -1,78 +1,89 @@
 from collections import deque
 from hashlib import md5
-from asyncio import gather, Task, sleep
+from asyncio import Task, wrap_future
 import json
-import websockets
+import numpy as np
 
 from src.model import Ingester, ResourceField, Tsdb
-from src.utils import log_debug, log_error, log_warn, select_nested, floor_utc, safe_eval
-from src.actions import store, transform, scheduler
+from src.utils import log_debug, log_error, log_warn, select_nested, parse_json, floor_utc, safe_eval, shared_epochs, attach_epochs,\
+  Column, Epoch, SharedEpochs, new_epochs, Aggregator, parse_stream_reducer, compile_selector, select_path
+from src.actions import store, transform, scheduler, TickWriter
 from src.cache import claim_task, ensure_claim_task
 import src.state as state
 
+def reduce_remote(reducers: list[str], shm_name: str, layout: list[tuple]) -> list:
+  # process pool worker entrypoint, reducers are compiled once per worker (safe_eval cache)
+  shm, epochs = attach_epochs(shm_name, layout)
+  values = []
+  try:
+    for reducer in reducers:
+      try:
+        value = safe_eval(reducer, callable_check=True)(epochs) if reducer else None
+        values.append(np.array(value) if isinstance(value, (np.ndarray, Column)) else value) # detach from shared memory
+      except Exception as e:
+        values.append(e)
+  finally:
+    del epochs
+    if shm:
+      shm.close()
+  return values
+
 async def schedule(c: Ingester) -> list[Task]:
 
-  epochs_by_route: dict[str, deque[dict]] = {}
+  epochs_by_route: dict[str, deque[Epoch]] = {}
+  shared_by_route: dict[str, SharedEpochs] = {} # process executor only
   default_handler_by_route: dict[str, callable] = {}
   batched_fields_by_route: dict[str, list[ResourceField]] = {}
+  reducer_src_by_field: dict[str, str] = {}
+  aggregator_by_field: dict[str, tuple[Aggregator, list[tuple]]] = {} # streaming reducers and their input paths
   subscriptions = set()
+  ticks = TickWriter(c) if c.ticks else None # opt-in raw messages persistence
 
-  # sub function (one per route)
-  async def subscribe(c: Ingester, field: ResourceField, route_hash: str):
-
-    url = field.target
-    if state.args.verbose:
-      log_debug(f"Subscribing to {url} for {c.name}.{field.name}.{c.interval}...")
-
-    retry_count = 0
+  # message handler (one per route), sockets are shared process-wide by state.ws
+  def on_message(route_hash: str, url: str) -> callable:
+    epochs = epochs_by_route.setdefault(url, new_epochs()) # route state for reducers and transformers to use, bounded columns
+    def handle(res: any):
+      if ticks:
+        try:
+          ticks.append(res, url)
+        except Exception as e:
+          log_warn(f"Failed to buffer tick from {url} for {c.name}: {e}")
+      handled = {}
+      for field in batched_fields_by_route[route_hash]:
+        if field.name in aggregator_by_field: # O(1) streaming update, no epoch state
+          aggregator, inputs = aggregator_by_field[field.name]
+          try:
+            data = select_nested(field.selector, res)
+            if data:
+              aggregator.update(*[float(select_path(path, data)) for path in inputs])
+          except Exception as e:
+            log_warn(f"Failed to aggregate websocket data from {url} for {c.name}.{field.name}: {e}")
+          continue
+        if field.handler and not handled.setdefault(field.handler, {}).get(field.selector, False):
+          try:
+            data = select_nested(field.selector, res)
+            if data:
+              field.handler(data, epochs) # map data with handler
+          except Exception as e:
+            log_warn(f"Failed to handle websocket data from {url} for {c.name}.{field.name}: {e}")
+          handled.setdefault(field.handler, {})[field.selector] = True
+    return handle
 
-    while retry_count <= state.args.max_retries:
+  async def reduce(url: str, batch: list[ResourceField], epochs: deque[Epoch]) -> list:
+    if c.executor == "process":
+      # epochs columns are shared with the worker through the route's segment instead of being pickled
+      shared = shared_by_route.get(url) or shared_by_route.setdefault(url, shared_epochs())
+      async with shared.lock:
+        name, layout = shared.share(epochs)
+        reducers = [reducer_src_by_field.get(field.name, "") for field in batch]
+        return await wrap_future(state.process_pool.submit(reduce_remote, reducers, name, layout))
+    values = []
+    for field in batch:
       try:
-        async with websockets.connect(url) as ws:
-          if field.params:
-            await ws.send(json.dumps(field.params)) # send subscription params if any (eg. api key, stream list...)
-          # initialize route state for reducers and transformers to use
-          epochs_by_route.setdefault(url, deque([{}]))
-          while True:
-            if ws.closed:
-              log_error(f"{url} ws connection closed for {c.name}.{field.name}...")
-              break
-            res = await ws.recv() # poll for data
-            res = json.loads(res)
-            handled = {}
-            for field in batched_fields_by_route[route_hash]:
-              if field.handler and not handled.setdefault(field.handler, {}).get(field.selector, False):
-                try:
-                  data = select_nested(field.selector, res)
-                  if data:
-                    field.handler(data, epochs_by_route[url]) # map data with handler
-                    pass
-                except Exception as e:
-                  log_warn(f"Failed to handle websocket data from {url} for {c.name}.{field.name}: {e}")
-                handled.setdefault(field.handler, {})[field.selector] = True
-
-            # if state.args.verbose: # <-- way too verbose
-            #   log_debug(f"Handled websocket data {data} from {url} for {c.name}, route state:\n{epochs_by_route[url][0]}")
-
-        # If we exit the loop without an exception, reset retry count
-        retry_count = 0
-
-      except (websockets.exceptions.ConnectionClosedError, ConnectionResetError) as e:
-        retry_count += 1
-        log_error(f"Connection error ({e}) occurred. Attempting to reconnect to {url} for {c.name} (retry {retry_count}/{state.args.max_retries})...")
-        if retry_count > state.args.max_retries:
-          log_error(f"Exceeded max retries ({state.args.max_retries}). Giving up on {url} for {c.name}.")
-          break
-        sleep_time = state.args.retry_cooldown * retry_count
-        await sleep(sleep_time)
+        values.append(field.reducer(epochs) if field.reducer else None)
       except Exception as e:
-        log_error(f"Unexpected error occurred: {e}")
-        retry_count += 1
-        if retry_count > state.args.max_retries:
-          log_error(f"Exceeded max retries ({state.args.max_retries}). Giving up on {url} for {c.name}.")
-          break
-        sleep_time = state.args.retry_cooldown * retry_count
-        await sleep(sleep_time)
+        values.append(e)
+    return values
 
   # collect function (one per ingester)
   async def ingest(c: Ingester):
@@ -80,22 +91,27 @@ async def schedule(c: Ingester) -> list[Task]:
     # batch of reducers/transformers by route
     # iterate over key/value pairs
     collected_batches = 0
-    for route_hash, batch in batched_fields_by_route.items():
-      url = batch[0].target
+    for route_hash, fields in batched_fields_by_route.items():
+      url = fields[0].target
+      # streaming reducers are collected in O(1), others reduce the route epochs
+      streamed = [f for f in fields if f.name in aggregator_by_field and aggregator_by_field[f.name][0].count]
+      batch = [f for f in fields if f.name not in aggregator_by_field]
       epochs = epochs_by_route.get(url, None)
-      if not epochs or not epochs[0]:
+      if batch and (not epochs or not epochs[0]):
         log_warn(f"Missing state for {c.name} {url} ingestion, skipping...")
+        batch = []
+      if not batch and not streamed:
         continue
       collected_batches += 1
-      for field in batch:
-        # reduce the state to a collectable value
-        try:
-          field.value = field.reducer(epochs) if field.reducer else None
-        except Exception as e:
-          log_warn(f"Failed to reduce {c.name}.{field.name} for {url}, epoch attributes maye be missing: {e}")
+      # reduce the state to collectable values
+      values = await reduce(url, batch, epochs) if batch else []
+      batch += streamed
+      values += [aggregator_by_field[f.name][0].collect() for f in streamed]
+      for field, value in zip(batch, values):
+        if isinstance(value, Exception):
+          log_warn(f"Failed to reduce {c.name}.{field.name} for {url}, epoch attributes maye be missing: {value}")
           continue
-        if len(epochs) > 32: # keep the last 32 epochs (can be costly if many agg trades are stored in memory)
-          epochs.pop()
+        field.value = value
         if state.args.verbose:
           log_debug(f"Reduced {c.name}.{field.name} -> {field.value}")
         # apply transformers to the field value if any
@@ -103,9 +119,10 @@ async def schedule(c: Ingester) -> list[Task]:
           field.value = transform(c, field)
         if state.args.verbose:
           log_debug(f"Transformed {c.name}.{field.name} -> {field.value}")
-      if state.args.verbose:
-        log_debug(f"Appending epoch {len(epochs)} to {c.name}...")
-      epochs.appendleft({}) # new epoch
+      if epochs and epochs[0]:
+        if state.args.verbose:
+          log_debug(f"Appending epoch {len(epochs)} to {c.name}...")
+        epochs.appendleft(Epoch()) # new epoch, the oldest is dropped past WS_MAX_EPOCHS
     if state.args.verbose:
       log_debug(f"{c.name} ingester state:\n{c.data_by_field}")
     if collected_batches > 0:
@@ -121,8 +138,14 @@ async def schedule(c: Ingester) -> list[Task]:
     # Create a unique key using a hash of the URL and interval
     route_hash = md5(f"{url}:{c.interval}".encode()).hexdigest()
     if url:
+      stream_reducer = parse_stream_reducer(field.reducer) if isinstance(field.reducer, str) else None
+      if stream_reducer:
+        # declarative streaming reducer (eg. "vwap(.p, .q)"), updated on every message without handler
+        factory, selectors = stream_reducer
+        aggregator_by_field[field.name] = (factory(), [compile_selector(s) for s in selectors])
+        field.handler = None
       # make sure that a field handler is defined if a target url is set
-      if field.selector and not field.handler:
+      elif field.selector and not field.handler:
         if not route_hash in default_handler_by_route:
           raise ValueError(f"Missing handler for field {c.name}.{field.name} (selector {field.selector})")
         log_warn(f"Using {field.target} default field handler for {c.name}...")
@@ -131,7 +154,8 @@ async def schedule(c: Ingester) -> list[Task]:
         continue
       if field.handler and isinstance(field.handler, str):
         field.handler = safe_eval(field.handler, callable_check=True) # compile the handler
-      if field.reducer and isinstance(field.reducer, str):
+      if field.reducer and isinstance(field.reducer, str) and not stream_reducer:
+        reducer_src_by_field[field.name] = field.reducer
         try:
           field.reducer = safe_eval(field.reducer, callable_check=True) # compile the reducer
         except Exception as e:
@@ -140,14 +164,16 @@ async def schedule(c: Ingester) -> list[Task]:
       batched_fields_by_route.setdefault(route_hash, []).append(field)
       if not route_hash in default_handler_by_route and field.handler:
         default_handler_by_route[route_hash] = field.handler
-      # TODO: make sure that double subscriptions are not made possible since field.name is not part of the hash anymore
-      if field.target_id in subscriptions:
-        continue # only subscribe once per socket route+selector+params combo
-      subscriptions.add(field.target_id)
-      tasks.append(subscribe(c, field, route_hash))
+      subscription = (route_hash, json.dumps(field.params, sort_keys=True))
+      if subscription in subscriptions:
+        continue # only subscribe once per route+params, messages are dispatched to all the route fields
+      subscriptions.add(subscription)
+      if state.args.verbose:
+        log_debug(f"Subscribing to {url} for {c.name}.{field.name}.{c.interval}...")
+      state.ws.subscribe(url, on_message(route_hash, url), field.params)
 
-  # subscribe all at once, run in the background
-  gather(*tasks)
+  if ticks:
+    ticks.start()
 
   # register/schedule the ingester
   return [await scheduler.add_ingester(c, fn=ingest, start=False)]
@@ -2,7 +2,7 @@ from dataclasses import dataclass, field
 from datetime import datetime
 from hashlib import md5
 from aiocron import Cron
-from typing import Literal, Optional, Type
+from typing import ClassVar, Literal, Optional, Type
 
 from src.utils import Interval, TimeUnit, extract_time_unit, interval_to_seconds, split_chain_addr, fmt_date, function_signature
 
@@ -23,6 +23,16 @@ IngesterType = Literal[
 
 TsdbAdapter = Literal["tdengine", "timescale", "influx", "kdb"]
 
+Executor = Literal[
+  "thread", # transformers and reducers run in the ingester process
+  "process", # transformers and reducers are offloaded to the process pool
+]
+
+OnUnchanged = Literal[
+  "store", # previous values are stored again at the new ingestion time
+  "skip", # nothing is stored until the payload changes
+]
+
 FieldType = Literal[
   "int8", "uint8", # char, uchar
   "int16", "uint16", # short, ushort
@@ -54,7 +64,9 @@ class Targettable:
 @dataclass
 class ResourceField(Targettable):
   transient: bool = False
+  cache: Optional[str | int] = None # evm_caller call caching policy: immutable, block or ttl (interval or seconds)
   value: Optional[any] = None
+  pipeline: list[callable] = field(default_factory=list, init=False, repr=False, compare=False) # compiled transformers
 
   def signature(self) -> str:
     return f"{self.name}-{self.type}-{self.target}-{self.selector}-[{','.join(str(self.params))}]-[{','.join(self.transformers) if self.transformers else 'raw'}]"
@@ -102,12 +114,17 @@ class Ingester(Resource, Targettable):
   interval: Interval = "h1"
   probablity: float = 1.0
   ingester_type: IngesterType = "evm_caller"
+  executor: Executor = "thread"
+  on_unchanged: OnUnchanged = "store"
+  ticks: list[ResourceField] = field(default_factory=list) # ws_api only, projection of every message persisted to <name>_ticks
   ingestion_time: datetime = None
   cron: Optional[Cron] = None
+  transform_waves: list[list[ResourceField]] = field(default_factory=list, init=False, repr=False, compare=False) # topologically sorted fields
 
   @classmethod
   def from_dict(cls, d: dict) -> 'Ingester':
     d["fields"] = [ResourceField.from_dict(field) for field in d["fields"]]
+    d["ticks"] = [ResourceField.from_dict(field) for field in d.get("ticks", [])]
     r = cls(**d)
     for field in r.fields:
       if not field.target: field.target = r.target
@@ -200,6 +217,7 @@ class Tsdb:
   password: str = "pass"
   conn: any = None
   cursor: any = None
+  precision: ClassVar[TimeUnit] = "us" # finest timestamp stored, rows closer in time collapse onto the same key
 
   @classmethod
   async def connect(cls, host: str, port: int, db: str, user: str, password: str):
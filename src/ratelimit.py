@@ -0,0 +1,134 @@
+# client-side (upstream) rate limiting, cf. server/middlewares/limiter.py for server-side limits
+from asyncio import sleep
+from email.utils import parsedate_to_datetime
+from os import environ as env
+from random import random
+from time import time
+from urllib.parse import urlsplit
+
+from src.state import redis
+from src.utils import log_debug, log_warn
+from src.cache import NS
+
+RATE_LIMIT_RPS = float(env.get("RATE_LIMIT_RPS", 10)) # default sustained requests per second per upstream host
+RATE_LIMIT_BURST = float(env.get("RATE_LIMIT_BURST", 20)) # default max requests fired at once per upstream host
+RATE_LIMIT_MAX_WAIT_SEC = float(env.get("RATE_LIMIT_MAX_WAIT_SEC", 30)) # requests waiting longer are skipped (RPC calls fail over)
+
+# cluster-wide token bucket: every worker takes from the same host budget, stored in redis
+# requests exceeding the budget reserve a future slot and are delayed accordingly, spreading them over time
+# KEYS: bucket, learned rate override, blocked-until | ARGV: default rate (req/s), burst, cost
+# returns the delay in ms before the request can be fired
+TAKE_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local rate = tonumber(redis.call('GET', KEYS[2]) or ARGV[1])
+local burst = tonumber(ARGV[2])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + (now - ts) * rate / 1000) - tonumber(ARGV[3])
+local wait = 0
+if tokens < 0 then wait = -tokens * 1000 / rate end
+local blocked = redis.call('PTTL', KEYS[3])
+if blocked > wait then wait = blocked end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(60000 + wait))
+return math.ceil(wait)
+"""
+
+take_script = None
+
+class RateLimited(Exception):
+  """Upstream host budget exhausted for longer than RATE_LIMIT_MAX_WAIT_SEC"""
+
+def host_of(url: str) -> str:
+  return urlsplit(url if "://" in url else f"https://{url}").netloc or url
+
+def bucket_keys(host: str) -> list[str]:
+  return [f"{NS}:ratelimit:{host}", f"{NS}:ratelimit:{host}:rate", f"{NS}:ratelimit:{host}:blocked"]
+
+async def throttle(url: str, cost=1) -> bool:
+  """
+  Wait for the upstream host's budget to allow the request.
+
+  :param url: request url or RPC endpoint (the budget is per host)
+  :param cost: request weight (eg. number of batched calls)
+  :return: False if the request should be skipped (budget exhausted for longer than RATE_LIMIT_MAX_WAIT_SEC)
+  """
+  global take_script
+  host = host_of(url)
+  try:
+    if not take_script:
+      take_script = redis.register_script(TAKE_SCRIPT)
+    wait = await take_script(keys=bucket_keys(host), args=[RATE_LIMIT_RPS, RATE_LIMIT_BURST, cost]) / 1000
+  except Exception as e:
+    log_warn(f"Rate limiter unavailable, not throttling {url}: {e}")
+    return True
+  if wait > RATE_LIMIT_MAX_WAIT_SEC:
+    try:
+      await take_script(keys=bucket_keys(host), args=[RATE_LIMIT_RPS, RATE_LIMIT_BURST, -cost]) # refund
+    except Exception as e:
+      log_warn(f"Failed to refund {host} rate limit budget: {e}")
+    log_warn(f"Rate limit budget of {host} exhausted for {wait:.1f}s, skipping request to {url}")
+    return False
+  if wait > 0:
+    wait += random() * min(wait, 1) * 0.1 # de-synchronize workers waiting on the same slot
+    await sleep(wait)
+  return True
+
+async def throttle_rpc(url: str, cost=1):
+  # RPC calls are not skipped but failed over to the pool's next endpoint (other host budget)
+  if not await throttle(url, cost):
+    raise RateLimited(f"Rate limit budget of {host_of(url)} exhausted")
+
+def parse_retry_after(value: str) -> float:
+  # delta-seconds or http-date
+  try:
+    return max(float(value), 0)
+  except ValueError:
+    try:
+      return max(parsedate_to_datetime(value).timestamp() - time(), 0)
+    except (TypeError, ValueError):
+      return 0
+
+def parse_reset(value: str) -> float:
+  # seconds until reset, or epoch seconds/milliseconds depending on providers
+  reset = float(value)
+  if reset > 1e12:
+    reset = reset / 1000 - time()
+  elif reset > 1e9:
+    reset -= time()
+  return max(reset, 0)
+
+async def adapt(url: str, status: int, headers: dict):
+  """
+  Adjust the upstream host's budget to its response: back off on 429/503 (Retry-After)
+  and follow the advertised X-RateLimit-Remaining/X-RateLimit-Reset quota.
+
+  :param url: request url
+  :param status: response status code
+  :param headers: response headers
+  """
+  host = host_of(url)
+  _, rate_key, blocked_key = bucket_keys(host)
+  try:
+    if status in (429, 503):
+      retry_after = parse_retry_after(headers.get("Retry-After", "")) or 1
+      # every worker pauses until the upstream budget is restored
+      await redis.set(blocked_key, 1, px=round(retry_after * 1000))
+      log_warn(f"{host} rate limited (HTTP {status}), pausing requests for {retry_after:.1f}s")
+      return
+    # case-insensitive headers, legacy X- prefixed or IETF draft names
+    remaining = headers.get("X-RateLimit-Remaining") or headers.get("RateLimit-Remaining")
+    reset = headers.get("X-RateLimit-Reset") or headers.get("RateLimit-Reset")
+    if remaining is None or reset is None:
+      return
+    remaining, reset = float(remaining.split(",")[0]), parse_reset(reset.split(",")[0])
+    if reset <= 0:
+      return
+    # spread the remaining quota over the window, overriding the default rate until reset
+    rate = max(remaining, 1) / reset
+    await redis.set(rate_key, rate, px=round(reset * 1000))
+    log_debug(f"{host} budget adjusted to {rate:.2f} req/s ({remaining:.0f} remaining for {reset:.1f}s)")
+  except Exception as e:
+    log_warn(f"Failed to adapt {host} rate limit: {e}")
@@ -3,7 +3,7 @@ from multicall import constants as mc_const
 
 from src.utils.format import log_info
 from src.utils import PackageMeta
-from src.utils.proxies import ThreadPoolProxy, Web3Proxy, TsdbProxy, RedisProxy, ConfigProxy
+from src.utils.proxies import ThreadPoolProxy, ProcessPoolProxy, Web3Proxy, TsdbProxy, RedisProxy, HttpProxy, WsProxy, ConfigProxy
 
 args: any
 meta = PackageMeta(package="chomp")
@@ -11,18 +11,24 @@ server: FastAPI
 
 tsdb: TsdbProxy
 redis: RedisProxy
+http: HttpProxy
+ws: WsProxy
 config: ConfigProxy
 web3: Web3Proxy
 thread_pool: ThreadPoolProxy
+process_pool: ProcessPoolProxy
 
 def init(args_: any):
-  global args, meta, thread_pool, rpcs, web3, tsdb, redis, config
+  global args, meta, thread_pool, process_pool, rpcs, web3, tsdb, redis, http, ws, config
   args = args_
   config = ConfigProxy(args)
   thread_pool = ThreadPoolProxy()
+  process_pool = ProcessPoolProxy()
   tsdb = TsdbProxy()
   redis = RedisProxy()
-  web3 = Web3Proxy()
+  http = HttpProxy()
+  ws = WsProxy(thread_pool, process_pool)
+  web3 = Web3Proxy(http)
 
 # TODO: PR these multicall constants upstream
 mc_const.MULTICALL3_ADDRESSES[238] = "0xcA11bde05977b3631167028862bE2a173976CA11" # blast
@@ -3,4 +3,8 @@ from .format import *
 from .date import *
 from .argparser import *
 from .safe_eval import *
+from .epochs import *
 from .runtime import *
+from .rolling import *
+from .aggregators import *
+from .rpcpool import *
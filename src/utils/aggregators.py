@@ -0,0 +1,202 @@
+from math import ceil, floor, log, nan, sqrt
+import re
+
+class Aggregator:
+  """
+  Streaming reducer updated on every message, collected (then reset) once per ingestion epoch in O(1).
+  """
+  def __init__(self):
+    self.count = 0
+
+  def update(self, *values: float):
+    self.count += 1
+
+  def collect(self) -> any:
+    value = self.value()
+    self.reset()
+    return value
+
+  def value(self) -> any:
+    return self.count
+
+  def reset(self):
+    self.count = 0
+
+class Last(Aggregator):
+  def update(self, value: float):
+    self.count += 1
+    self.last = value
+
+  def value(self) -> float:
+    return self.last if self.count else nan
+
+class Sum(Aggregator):
+  def __init__(self):
+    super().__init__()
+    self.total = 0.0
+
+  def update(self, value: float):
+    self.count += 1
+    self.total += value
+
+  def value(self) -> float:
+    return self.total
+
+  def reset(self):
+    self.count, self.total = 0, 0.0
+
+class Ohlc(Aggregator):
+  FIELDS = ("open", "high", "low", "close")
+
+  def __init__(self, output: str=""):
+    super().__init__()
+    self.output = output # one of FIELDS, or all as a tuple
+    self.reset()
+
+  def update(self, value: float):
+    if not self.count:
+      self.open = self.high = self.low = value
+    elif value > self.high:
+      self.high = value
+    elif value < self.low:
+      self.low = value
+    self.close = value
+    self.count += 1
+
+  def value(self) -> float | tuple:
+    if not self.count:
+      return nan if self.output else (nan,) * 4
+    return getattr(self, self.output) if self.output else (self.open, self.high, self.low, self.close)
+
+  def reset(self):
+    self.count = 0
+    self.open = self.high = self.low = self.close = nan
+
+class Vwap(Aggregator):
+  def __init__(self):
+    super().__init__()
+    self.reset()
+
+  def update(self, price: float, volume: float):
+    self.count += 1
+    self.notional += price * volume
+    self.volume += volume
+
+  def value(self) -> float:
+    return self.notional / self.volume if self.volume else nan
+
+  def reset(self):
+    self.count, self.notional, self.volume = 0, 0.0, 0.0
+
+class Moments(Aggregator):
+  """
+  Welford running mean and (population) variance.
+  """
+  def __init__(self, output="mean"):
+    super().__init__()
+    self.output = output # mean, var or std
+    self.reset()
+
+  def update(self, value: float):
+    self.count += 1
+    delta = value - self.mean
+    self.mean += delta / self.count
+    self.m2 += delta * (value - self.mean)
+
+  def value(self) -> float:
+    if not self.count:
+      return nan
+    if self.output == "mean":
+      return self.mean
+    var = self.m2 / self.count
+    return var if self.output == "var" else sqrt(var)
+
+  def reset(self):
+    self.count, self.mean, self.m2 = 0, 0.0, 0.0
+
+class Sketch(Aggregator):
+  """
+  DDSketch quantiles: values are counted in logarithmic buckets, quantiles are within `accuracy` relative error
+  with memory bounded by the values' dynamic range (not their count).
+  """
+  def __init__(self, q: float=0.5, accuracy: float=0.01):
+    super().__init__()
+    if not 0 <= q <= 1:
+      raise ValueError(f"Invalid quantile {q}, must be within [0, 1]")
+    self.q = q
+    self.gamma = (1 + accuracy) / (1 - accuracy)
+    self.log_gamma = log(self.gamma)
+    self.reset()
+
+  def update(self, value: float):
+    self.count += 1
+    if value > 0:
+      k = ceil(log(value) / self.log_gamma)
+      self.positive[k] = self.positive.get(k, 0) + 1
+    elif value < 0:
+      k = ceil(log(-value) / self.log_gamma)
+      self.negative[k] = self.negative.get(k, 0) + 1
+    else:
+      self.zeros += 1
+
+  def quantile(self, q: float) -> float:
+    if not self.count:
+      return nan
+    rank, seen = floor(q * (self.count - 1)), 0
+    for k in sorted(self.negative, reverse=True): # most negative first
+      seen += self.negative[k]
+      if seen > rank:
+        return -2 * self.gamma ** k / (self.gamma + 1)
+    seen += self.zeros
+    if seen > rank:
+      return 0.0
+    for k in sorted(self.positive):
+      seen += self.positive[k]
+      if seen > rank:
+        return 2 * self.gamma ** k / (self.gamma + 1) # bucket midpoint (relative error bound)
+    return nan
+
+  def value(self) -> float:
+    return self.quantile(self.q)
+
+  def reset(self):
+    self.count, self.zeros = 0, 0
+    self.positive: dict[int, int] = {}
+    self.negative: dict[int, int] = {}
+
+# name -> (factory from literal arguments, number of selected inputs)
+STREAM_REDUCERS: dict[str, tuple[callable, int]] = {
+  "count": (lambda: Aggregator(), 0),
+  "last": (lambda: Last(), 1),
+  "sum": (lambda: Sum(), 1),
+  "ohlc": (lambda: Ohlc(), 1),
+  "open": (lambda: Ohlc("open"), 1),
+  "high": (lambda: Ohlc("high"), 1),
+  "low": (lambda: Ohlc("low"), 1),
+  "close": (lambda: Ohlc("close"), 1),
+  "vwap": (lambda: Vwap(), 2),
+  "mean": (lambda: Moments("mean"), 1),
+  "var": (lambda: Moments("var"), 1),
+  "std": (lambda: Moments("std"), 1),
+  "median": (lambda: Sketch(0.5), 1),
+  "quantile": (lambda q, accuracy=0.01: Sketch(float(q), float(accuracy)), 1),
+}
+
+STREAM_REDUCER_CALL = re.compile(r"(\w+)\((.*)\)", re.DOTALL) # eg. "vwap(.p, .q)" or "quantile(.p, 0.99)"
+
+def parse_stream_reducer(reducer: str) -> tuple[callable, list[str]] | None:
+  """
+  Parse a declarative streaming reducer eg. "vwap(.p, .q)", "ohlc(.price)" or "quantile(.p, 0.95)".
+
+  :param reducer: reducer expression, inputs are selectors relative to the field's selected message data
+  :return: (aggregator factory, input selectors) or None if not a streaming reducer (eg. python lambda)
+  """
+  match = STREAM_REDUCER_CALL.fullmatch(reducer.strip())
+  if not match or match.group(1) not in STREAM_REDUCERS:
+    return None
+  factory, arity = STREAM_REDUCERS[match.group(1)]
+  args = [a.strip() for a in match.group(2).split(",") if a.strip()]
+  selectors, literals = args[:arity], args[arity:]
+  if len(selectors) != arity:
+    raise ValueError(f"Streaming reducer {match.group(1)} expects {arity} selector(s), got {reducer}")
+  return lambda: factory(*literals), selectors
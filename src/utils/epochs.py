@@ -0,0 +1,120 @@
+from collections import deque
+from os import environ as env
+import numpy as np
+
+EPOCH_COLUMN_CAPACITY = int(env.get("WS_EPOCH_CAPACITY", 65536)) # max values kept per epoch column (most recent)
+COLUMN_INITIAL_SIZE = 64 # buffers grow by doubling up to 2x capacity, most columns stay small
+MAX_EPOCHS = int(env.get("WS_MAX_EPOCHS", 32)) # epochs kept per route, most recent first
+
+class Column:
+  """
+  Fixed capacity ring buffer of float64 values, list compatible (append, len, indexing, iteration).
+  Values live in a buffer grown up to 2x capacity so that the retained window is always contiguous:
+  np.asarray(column) and column.view() are zero-copy, reductions (eg. mean(col)) are vectorized.
+  """
+
+  def __init__(self, capacity: int=0, dtype=np.float64):
+    self.capacity = capacity or EPOCH_COLUMN_CAPACITY
+    self.buffer = np.empty(min(COLUMN_INITIAL_SIZE, self.capacity * 2), dtype=dtype)
+    self.start = 0
+    self.end = 0
+
+  def append(self, value: any):
+    if self.end == len(self.buffer):
+      if len(self.buffer) < self.capacity * 2: # grow (amortized O(1))
+        buffer = np.empty(min(len(self.buffer) * 2, self.capacity * 2), dtype=self.buffer.dtype)
+        buffer[:len(self)] = self.view()
+        self.buffer, self.start, self.end = buffer, 0, len(self)
+      else: # wrap: move the retained window to the front (amortized O(1))
+        self.buffer[:self.capacity - 1] = self.buffer[self.end - self.capacity + 1:self.end]
+        self.start, self.end = 0, self.capacity - 1
+    try:
+      self.buffer[self.end] = value
+    except (TypeError, ValueError): # non numeric value, fallback to boxed objects
+      self.buffer = self.buffer.astype(object)
+      self.buffer[self.end] = value
+    self.end += 1
+    if self.end - self.start > self.capacity:
+      self.start += 1 # oldest value dropped
+
+  @classmethod
+  def wrap(cls, values: np.ndarray, capacity: int=0) -> "Column":
+    # column over existing values without copy (eg. shared memory views)
+    col = cls.__new__(cls)
+    col.capacity = capacity or len(values)
+    col.buffer, col.start, col.end = values, 0, len(values)
+    return col
+
+  def extend(self, values: list):
+    for value in values:
+      self.append(value)
+
+  def view(self) -> np.ndarray:
+    return self.buffer[self.start:self.end]
+
+  def tolist(self) -> list:
+    return self.view().tolist()
+
+  def clear(self):
+    self.start = self.end = 0
+
+  def __array__(self, dtype=None, copy=None) -> np.ndarray:
+    view = self.view()
+    if dtype is not None:
+      return view.astype(dtype, copy=bool(copy))
+    return view.copy() if copy else view
+
+  def __len__(self) -> int:
+    return self.end - self.start
+
+  def __bool__(self) -> bool:
+    return self.end > self.start
+
+  def __getitem__(self, index: int | slice) -> any:
+    return self.view()[index]
+
+  def __iter__(self):
+    return iter(self.view())
+
+  def __repr__(self) -> str:
+    return f"Column({self.view()!r}, capacity={self.capacity})"
+
+  def __reduce__(self):
+    return (np.array, (self.view(),)) # pickled as a plain array (eg. process pool reducers)
+
+class Epoch(dict):
+  """
+  Stream epoch state, list defaults (eg. epoch.setdefault("bids", [])) are stored as fixed capacity columns
+  and dict defaults (eg. epoch.setdefault("BTCUSDT", {})) as nested epochs.
+  """
+
+  def __init__(self, capacity: int=0):
+    super().__init__()
+    self.capacity = capacity
+
+  def setdefault(self, key: str, default: any=None) -> any:
+    if key not in self:
+      self[key] = default
+    return self[key]
+
+  def __setitem__(self, key: str, value: any):
+    super().__setitem__(key, self.wrap(value))
+
+  def wrap(self, value: any) -> any:
+    if isinstance(value, list):
+      return self.column(value)
+    if type(value) is dict:
+      epoch = Epoch(self.capacity)
+      for k, v in value.items():
+        epoch[k] = v
+      return epoch
+    return value
+
+  def column(self, values: list) -> Column:
+    col = Column(self.capacity)
+    col.extend(values)
+    return col
+
+def new_epochs(capacity: int=0, max_epochs: int=0) -> deque[Epoch]:
+  # route epochs, most recent first, older epochs are dropped past max_epochs
+  return deque([Epoch(capacity)], maxlen=max_epochs or MAX_EPOCHS)
@@ -79,6 +79,10 @@ def generate_hash(length=32, derive_from="") -> str:
   hash_fn = md5 if length <= 32 else sha256
   return hash_fn((str(derive_from) + urandom(64).hex()).encode()).hexdigest()[:length]
 
+def to_hex(data: bytes) -> str:
+  # 0x prefixed whatever the hexbytes version (HexBytes.hex() is only unprefixed since 1.0)
+  return "0x" + bytes(data).hex()
+
 def split_chain_addr(target: str) -> tuple[str|int, str]:
   tokens = target.split(":")
   n = len(tokens)
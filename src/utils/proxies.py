@@ -1,10 +1,20 @@
-from concurrent.futures import ThreadPoolExecutor
+from asyncio import AbstractEventLoop, Event, Task, get_running_loop, sleep
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+import json
+from multiprocessing import get_all_start_methods, get_context
 import yamale
 from os import cpu_count, environ as env
-from web3 import Web3
+import re
+from time import monotonic
+from typing import Optional
+from web3 import AsyncWeb3
 from redis.asyncio import Redis, ConnectionPool
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, TraceConfig
+import websockets
 
-from src.utils import log_error
+from src.utils import log_debug, log_error, log_warn, parse_json, BatchHTTPProvider, RpcEndpoint, RpcPool
 from src.model import Config, Tsdb
 
 args: any
@@ -23,10 +33,32 @@ class ThreadPoolProxy:
   def __getattr__(self, name):
     return getattr(self.thread_pool, name)
 
-class Web3Proxy:
+def init_worker(args_: any):
+  # process pool workers start with the owner's arguments, their backends connect lazily if ever used
+  import src.state as state
+  state.init(args_)
+
+class ProcessPoolProxy:
   def __init__(self):
-    self._by_chain = {}
-    self._next_index_by_chain = {}
+    self._process_pool = None
+
+  @property
+  def process_pool(self) -> ProcessPoolExecutor:
+    if not self._process_pool:
+      # created lazily, once threads and the event loop run: workers are started from a clean forkserver
+      # (not forked from this process, whose locks may be held by other threads), worker entrypoints are self-contained
+      method = "forkserver" if "forkserver" in get_all_start_methods() else "spawn"
+      self._process_pool = ProcessPoolExecutor(max_workers=int(env.get("MAX_PROCESSES", cpu_count())), mp_context=get_context(method),
+        initializer=init_worker, initargs=(args,))
+    return self._process_pool
+
+  def __getattr__(self, name):
+    return getattr(self.process_pool, name)
+
+class Web3Proxy:
+  def __init__(self, http: "HttpProxy"=None):
+    self._http = http
+    self._pool_by_chain: dict[str | int, RpcPool] = {}
     self._rpcs_by_chain = {}
 
   def rpcs(self, chain_id: str | int, load_all=False) -> dict[str | int, list[str]]:
@@ -40,25 +72,27 @@ class Web3Proxy:
       self._rpcs_by_chain[chain_id] = rpc_env.split(",")
     return self._rpcs_by_chain[chain_id]
 
-  def client(self, chain_id: str | int, rolling=True) -> Web3:
-    if chain_id not in self._by_chain:
+  def pool(self, chain_id: str | int) -> RpcPool:
+    # endpoints are not probed at creation (non-blocking startup), their health is learned from calls
+    if chain_id not in self._pool_by_chain:
       rpcs = self.rpcs(chain_id)
       if not rpcs:
         raise ValueError(f"Missing RPC endpoints for chain {chain_id}")
-      self._by_chain[chain_id] = []
-      for rpc in rpcs:
-        c = Web3(Web3.HTTPProvider("https://" + rpc))
-        if c.is_connected():
-          self._by_chain[chain_id].append(c)
-      if not self._by_chain[chain_id]:
-        raise ValueError(f"Could not connect to chain {chain_id} using any of {rpcs}, skipping...")
-    index = self._next_index_by_chain.get(chain_id, 0)
-    if rolling:
-      self._next_index_by_chain[chain_id] = (index + 1) % len(self._by_chain[chain_id]) # rotate proxy
-    return self._by_chain[chain_id][index]
-
-  # def __getattr__(self, name):
-  #   return getattr(self.client(1), name)
+      self._pool_by_chain[chain_id] = RpcPool([RpcEndpoint(
+        url="https://" + rpc,
+        # concurrent calls to the same endpoint share JSON-RPC batch round trips
+        async_client=AsyncWeb3(BatchHTTPProvider("https://" + rpc, session=self._http and (lambda: self._http.session)))) for rpc in rpcs])
+    return self._pool_by_chain[chain_id]
+
+  def async_client(self, chain_id: str | int) -> AsyncWeb3:
+    return self.pool(chain_id).best().async_client
+
+  async def call(self, chain_id: str | int, fn: callable, hedge: bool=None, fatal: callable=None) -> any:
+    # fn: async callable of an AsyncWeb3 client, routed to the best scored endpoint(s)
+    return await self.pool(chain_id).call(fn, hedge=hedge, retries=args.max_retries, fatal=fatal)
+
+  def stats(self) -> dict:
+    return {chain_id: pool.stats() for chain_id, pool in self._pool_by_chain.items()}
 
 class TsdbProxy:
   def __init__(self):
@@ -108,6 +142,299 @@ class RedisProxy:
   def __getattr__(self, name):
     return getattr(self.redis, name)
 
+class HttpProxy:
+  def __init__(self):
+    self._session_by_loop: dict[AbstractEventLoop, ClientSession] = {}
+    self._stats = {"requests": 0, "errors": 0, "connections_created": 0, "connections_reused": 0}
+    self._in_flight_by_host: dict[str, int] = {} # tracked from traces, aiohttp connector internals are private
+
+  def _trace_config(self) -> TraceConfig:
+    trace = TraceConfig()
+    def count(key: str) -> callable:
+      async def on_event(session, ctx, params):
+        self._stats[key] += 1
+      return on_event
+    def track(delta: int) -> callable:
+      async def on_event(session, ctx, params):
+        host = f"{params.url.host}:{params.url.port}"
+        in_flight = self._in_flight_by_host.get(host, 0) + delta
+        if in_flight > 0:
+          self._in_flight_by_host[host] = in_flight
+        else:
+          self._in_flight_by_host.pop(host, None)
+      return on_event
+    trace.on_request_start.append(track(1))
+    trace.on_request_end.append(track(-1))
+    trace.on_request_exception.append(track(-1))
+    trace.on_request_end.append(count("requests"))
+    trace.on_request_exception.append(count("errors"))
+    trace.on_connection_create_end.append(count("connections_created")) # new TCP/TLS handshakes
+    trace.on_connection_reuseconn.append(count("connections_reused")) # keep-alive hits
+    return trace
+
+  @property
+  def session(self) -> ClientSession:
+    # aiohttp sessions are bound to their event loop, share one per loop
+    loop = get_running_loop()
+    session = self._session_by_loop.get(loop)
+    if not session or session.closed:
+      connector = TCPConnector(
+        limit=int(env.get("HTTP_MAX_CONNECTIONS", 256)),
+        limit_per_host=int(env.get("HTTP_MAX_CONNECTIONS_PER_HOST", 16)),
+        keepalive_timeout=float(env.get("HTTP_KEEPALIVE_SEC", 30)),
+        ttl_dns_cache=int(env.get("HTTP_DNS_TTL_SEC", 300)),
+        enable_cleanup_closed=True,
+      )
+      timeout = ClientTimeout(
+        total=float(env.get("HTTP_TIMEOUT_SEC", 30)),
+        sock_connect=float(env.get("HTTP_CONNECT_TIMEOUT_SEC", 5)),
+      )
+      # responses are transparently decompressed (gzip/deflate, br if brotli is installed)
+      session = ClientSession(connector=connector, timeout=timeout, auto_decompress=True, trace_configs=[self._trace_config()])
+      self._session_by_loop[loop] = session
+    return session
+
+  def stats(self) -> dict:
+    stats = {**self._stats, "sessions": 0, "limit": 0, "limit_per_host": 0,
+      "in_flight": sum(self._in_flight_by_host.values()), "in_flight_by_host": dict(self._in_flight_by_host)}
+    for session in self._session_by_loop.values():
+      if session.closed:
+        continue
+      stats["sessions"] += 1
+      stats["limit"] += session.connector.limit
+      stats["limit_per_host"] = session.connector.limit_per_host
+    return stats
+
+  async def close(self):
+    for session in self._session_by_loop.values():
+      if not session.closed:
+        await session.close()
+    self._session_by_loop.clear()
+
+  def __getattr__(self, name):
+    return getattr(self.session, name)
+
+# providers multiplexing streams over a single socket eg. wss://stream.binance.com:9443/ws/btcusdt@trade
+# host -> (max streams per connection, combined url from base url and streams, live subscription message)
+BINANCE_STREAMS = (
+  lambda base, streams: f"{base}/stream?streams={'/'.join(streams)}",
+  lambda streams, id: {"method": "SUBSCRIBE", "params": streams, "id": id},
+)
+COMBINED_STREAMS: dict[str, tuple[int, callable, callable]] = {
+  "stream.binance.com": (1024, *BINANCE_STREAMS),
+  "data-stream.binance.vision": (1024, *BINANCE_STREAMS),
+  "fstream.binance.com": (200, *BINANCE_STREAMS),
+  "dstream.binance.com": (200, *BINANCE_STREAMS),
+}
+
+WS_QUEUE_SIZE = int(env.get("WS_QUEUE_SIZE", 10_000)) # max pending messages per connection
+WS_BATCH_SIZE = int(env.get("WS_BATCH_SIZE", 256)) # max messages decoded and dispatched at once
+WS_OVERFLOW = env.get("WS_OVERFLOW", "drop_oldest") # drop_oldest, conflate (latest message per stream) or block
+WS_DECODER = env.get("WS_DECODER", "inline") # inline (event loop), thread or process
+if WS_OVERFLOW not in ("drop_oldest", "conflate", "block"):
+  raise ValueError(f"Invalid WS_OVERFLOW policy: {WS_OVERFLOW}, must be one of drop_oldest, conflate or block")
+# identifying fields of a message (combined stream name, topic, channel, symbol...), matched without decoding
+CONFLATION_KEYS = re.compile(rb'"(?:stream|topic|channel|type|e|product_id|symbol|s|instId|arg)"\s*:\s*("[^"]*"|\{[^}]*\})')
+
+def conflation_key(raw: str | bytes) -> Optional[bytes]:
+  # messages are only superseded by later messages of the same key, unidentified messages are never conflated
+  keys = CONFLATION_KEYS.findall((raw if isinstance(raw, bytes) else raw.encode())[:512])
+  return b"|".join(keys) if keys else None
+
+def decode_batch(raws: list[str | bytes]) -> list:
+  # undecodable messages are returned as (picklable) errors instead of failing the whole batch
+  msgs = []
+  for raw in raws:
+    try:
+      msgs.append(parse_json(raw))
+    except Exception as e:
+      msgs.append(ValueError(str(e)))
+  return msgs
+
+@dataclass
+class WsConnection:
+  url: str = ""
+  params: any = None
+  base: str = "" # combined connections only
+  provider: tuple = None # combined connections only, cf. COMBINED_STREAMS
+  callbacks_by_stream: dict[str, list[callable]] = field(default_factory=dict) # "" for plain connections
+  task: Task = None
+  ws: any = None
+  # receive pipeline: bounded queue of (received at, raw message) drained in batches
+  queue: deque = field(default_factory=deque)
+  pending: Event = field(default_factory=Event) # queue not empty
+  drained: Event = field(default_factory=Event) # queue not full (block policy)
+  counters: dict[str, float] = field(default_factory=lambda: {"received": 0, "dispatched": 0, "dropped": 0, "conflated": 0, "max_depth": 0, "lag_ms": 0.0, "max_lag_ms": 0.0})
+
+class WsProxy:
+  def __init__(self, thread_pool: ThreadPoolExecutor=None, process_pool: ProcessPoolExecutor=None):
+    self._connections: dict[str, WsConnection] = {} # url+params -> shared connection
+    self._executor = process_pool if WS_DECODER == "process" else thread_pool if WS_DECODER == "thread" else None
+
+  @staticmethod
+  def split_stream(url: str) -> tuple[str, str, tuple]:
+    # (base url, stream name, provider) of combinable stream urls
+    scheme, _, rest = url.partition("://")
+    host_port, _, path = rest.partition("/")
+    provider = COMBINED_STREAMS.get(host_port.split(":")[0])
+    if not provider or not path.startswith("ws/") or "?" in path or "/" in path[3:]:
+      return "", "", None
+    symbol, at, kind = path[3:].partition("@")
+    return f"{scheme}://{host_port}", symbol.lower() + at + kind, provider # streams are reported with lowercase symbols
+
+  def subscribe(self, url: str, callback: callable, params: any=None) -> WsConnection:
+    """
+    Subscribe to a websocket stream, sockets are shared by all subscribers of the same url and params
+    and combinable streams are packed into combined connections.
+
+    :param url: stream url
+    :param callback: called with every parsed message of the stream
+    :param params: subscription message sent on connection if any
+    :return: the shared connection
+    """
+    base, stream, provider = self.split_stream(url) if not params else ("", "", None)
+    if base:
+      # pack the stream in the first combined connection with spare capacity
+      for conn in self._connections.values():
+        if conn.base == base and (stream in conn.callbacks_by_stream or len(conn.callbacks_by_stream) < provider[0]):
+          break
+      else:
+        conn = self._connections.setdefault(f"{base}#{len(self._connections)}", WsConnection(base=base, provider=provider))
+      if stream not in conn.callbacks_by_stream and conn.ws:
+        # live connection, subscribe in place (reconnections use the full stream list)
+        get_running_loop().create_task(conn.ws.send(json.dumps(provider[2]([stream], len(conn.callbacks_by_stream)))))
+      conn.callbacks_by_stream.setdefault(stream, []).append(callback)
+    else:
+      key = f"{url}#{json.dumps(params, sort_keys=True)}"
+      conn = self._connections.setdefault(key, WsConnection(url=url, params=params))
+      conn.callbacks_by_stream.setdefault("", []).append(callback)
+    if not conn.task or conn.task.done(): # first subscriber, or restarted after max retries
+      conn.task = get_running_loop().create_task(self._run(conn))
+    return conn
+
+  async def _enqueue(self, conn: WsConnection, raw: str | bytes):
+    # overflow policies keep the read loop (and the event loop) responsive during bursts
+    counters = conn.counters
+    counters["received"] += 1
+    if len(conn.queue) >= WS_QUEUE_SIZE:
+      if WS_OVERFLOW == "block":
+        conn.drained.clear()
+        await conn.drained.wait() # stop reading, the socket buffers then the server throttles
+      elif not (WS_OVERFLOW == "conflate" and self._conflate(conn)):
+        conn.queue.popleft()
+        counters["dropped"] += 1
+    conn.queue.append((monotonic(), raw))
+    counters["max_depth"] = max(counters["max_depth"], len(conn.queue))
+    conn.pending.set()
+
+  @staticmethod
+  def _conflate(conn: WsConnection) -> bool:
+    # full queue: keep the latest message per key (in arrival order), one pass amortized over the freed slots
+    latest, unkeyed = {}, 0
+    for item in conn.queue:
+      key = conflation_key(item[1])
+      if key is None:
+        key, unkeyed = unkeyed, unkeyed + 1 # int keys never collide with bytes keys
+      latest.pop(key, None)
+      latest[key] = item
+    conflated = len(conn.queue) - len(latest)
+    if not conflated:
+      return False
+    conn.queue = deque(latest.values())
+    conn.counters["conflated"] += conflated
+    return True
+
+  async def _drain(self, conn: WsConnection):
+    loop, counters = get_running_loop(), conn.counters
+    while True:
+      await conn.pending.wait()
+      batch = []
+      while conn.queue and len(batch) < WS_BATCH_SIZE:
+        batch.append(conn.queue.popleft())
+      if not conn.queue:
+        conn.pending.clear()
+      conn.drained.set()
+      raws = [raw for _, raw in batch]
+      try:
+        msgs = await loop.run_in_executor(self._executor, decode_batch, raws) if self._executor else decode_batch(raws)
+      except Exception as e:
+        log_warn(f"Failed to decode websocket messages from {conn.url or conn.base}: {e}")
+        continue
+      for msg in msgs:
+        if isinstance(msg, Exception):
+          log_warn(f"Failed to decode websocket message from {conn.url or conn.base}: {msg}")
+          continue
+        if conn.base: # combined stream envelope {"stream": ..., "data": ...}, or subscription acks
+          if not isinstance(msg, dict) or "stream" not in msg:
+            continue
+          callbacks, msg = conn.callbacks_by_stream.get(msg["stream"], []), msg["data"]
+        else:
+          callbacks = conn.callbacks_by_stream[""]
+        for callback in callbacks: # fan out to every subscribed ingester
+          try:
+            callback(msg)
+          except Exception as e:
+            log_warn(f"Failed to handle websocket message from {conn.url or conn.base}: {e}")
+      lag = (monotonic() - batch[0][0]) * 1000 # oldest message of the batch, receive to dispatch
+      counters["dispatched"] += len(batch)
+      counters["lag_ms"] = lag
+      counters["max_lag_ms"] = max(counters["max_lag_ms"], lag)
+      await sleep(0) # yield to crons and other connections between batches
+
+  async def _run(self, conn: WsConnection):
+    await sleep(0) # let subscriptions of the same scheduling pass join before connecting
+    drain = get_running_loop().create_task(self._drain(conn))
+    retry_count = 0
+    try:
+      while retry_count <= args.max_retries:
+        streams = list(conn.callbacks_by_stream.keys())
+        url = conn.provider[1](conn.base, streams) if conn.base else conn.url
+        try:
+          async with websockets.connect(url, max_size=None) as ws:
+            conn.ws = ws
+            missing = [stream for stream in conn.callbacks_by_stream if stream not in streams] if conn.base else []
+            if missing: # subscribed while connecting, after the url snapshot
+              await ws.send(json.dumps(conn.provider[2](missing, len(conn.callbacks_by_stream))))
+            if conn.params:
+              await ws.send(json.dumps(conn.params)) # send subscription params if any (eg. api key, stream list...)
+            if args.verbose:
+              log_debug(f"Connected to {url} ({len(streams)} streams, {sum(len(cbs) for cbs in conn.callbacks_by_stream.values())} subscribers)")
+            retry_count = 0
+            async for raw in ws:
+              await self._enqueue(conn, raw)
+          retry_count += 1 # closed by the server
+        except (websockets.exceptions.ConnectionClosed, OSError) as e:
+          retry_count += 1
+          log_error(f"Connection error ({e}) occurred. Attempting to reconnect to {url} (retry {retry_count}/{args.max_retries})...")
+        except Exception as e:
+          retry_count += 1
+          log_error(f"Unexpected error occurred on {url}: {e}")
+        finally:
+          conn.ws = None
+        await sleep(args.retry_cooldown * retry_count)
+      log_error(f"Exceeded max retries ({args.max_retries}). Giving up on {url}.")
+    finally:
+      drain.cancel()
+
+  def stats(self) -> dict:
+    conns = self._connections.values()
+    return {
+      "connections": len(conns),
+      "connected": sum(1 for conn in conns if conn.ws),
+      "streams": sum(len(conn.callbacks_by_stream) for conn in conns),
+      "subscribers": sum(len(cbs) for conn in conns for cbs in conn.callbacks_by_stream.values()),
+      "queued": sum(len(conn.queue) for conn in conns),
+      **{key: sum(conn.counters[key] for conn in conns) for key in ("received", "dispatched", "dropped", "conflated")},
+      "max_lag_ms": max((conn.counters["max_lag_ms"] for conn in conns), default=0.0),
+      "lag_ms_by_connection": {conn.url or f"{conn.base} ({len(conn.callbacks_by_stream)} streams)": round(conn.counters["lag_ms"], 3) for conn in conns},
+    }
+
+  async def close(self):
+    for conn in self._connections.values():
+      if conn.task:
+        conn.task.cancel()
+    self._connections.clear()
+
 class ConfigProxy:
   def __init__(self, _args):
     global args
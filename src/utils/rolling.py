@@ -0,0 +1,97 @@
+from collections import deque
+from math import sqrt
+from time import time
+import numpy as np
+
+class RollingWindow:
+  """
+  Time bounded window of values with O(1) incremental statistics.
+  Mean and variance are maintained Welford-style (with removals), min/max with monotonic deques.
+  """
+
+  def __init__(self, span: float, maxlen: int=0):
+    self.span = span # seconds
+    self.maxlen = maxlen # optional hard cap on the number of points
+    self.points: deque[tuple[int, float, float]] = deque() # (seq, ts, value)
+    self.mins: deque[tuple[int, float]] = deque() # increasing values (seq, value)
+    self.maxs: deque[tuple[int, float]] = deque() # decreasing values (seq, value)
+    self.seq = 0
+    self.n = 0
+    self.total = 0.0
+    self.mean = 0.0
+    self.m2 = 0.0 # sum of squared deviations from the mean
+
+  def __len__(self) -> int:
+    return self.n
+
+  def push(self, value: float, ts: float=None):
+    ts = ts if ts is not None else time()
+    self.evict(ts)
+    if self.maxlen and self.n >= self.maxlen:
+      self.pop()
+    self.points.append((self.seq, ts, value))
+    while self.mins and self.mins[-1][1] >= value:
+      self.mins.pop()
+    self.mins.append((self.seq, value))
+    while self.maxs and self.maxs[-1][1] <= value:
+      self.maxs.pop()
+    self.maxs.append((self.seq, value))
+    self.seq += 1
+    self.n += 1
+    self.total += value
+    delta = value - self.mean
+    self.mean += delta / self.n
+    self.m2 += delta * (value - self.mean)
+
+  def pop(self):
+    seq, ts, value = self.points.popleft()
+    if self.mins[0][0] == seq:
+      self.mins.popleft()
+    if self.maxs[0][0] == seq:
+      self.maxs.popleft()
+    self.n -= 1
+    if not self.n:
+      self.total = self.mean = self.m2 = 0.0
+      return
+    self.total -= value
+    delta = value - self.mean
+    self.mean -= delta / self.n
+    self.m2 = max(0.0, self.m2 - delta * (value - self.mean))
+
+  def evict(self, now: float=None):
+    cutoff = (now if now is not None else time()) - self.span
+    while self.points and self.points[0][1] < cutoff:
+      self.pop()
+
+  @property
+  def var(self) -> float:
+    return self.m2 / self.n if self.n else np.nan # population variance, same as np.var
+
+  @property
+  def std(self) -> float:
+    return sqrt(self.var) if self.n else np.nan
+
+  @property
+  def min(self) -> float:
+    return self.mins[0][1] if self.n else np.nan
+
+  @property
+  def max(self) -> float:
+    return self.maxs[0][1] if self.n else np.nan
+
+  def values(self) -> np.ndarray:
+    return np.fromiter((p[2] for p in self.points), dtype=np.float64, count=self.n)
+
+  def reduce(self, fn: str) -> any:
+    self.evict()
+    match fn:
+      case "mean": return self.mean if self.n else np.nan
+      case "sum": return self.total
+      case "var": return self.var
+      case "std": return self.std
+      case "min": return self.min
+      case "max": return self.max
+      case "median": return np.median(self.values())
+      case "prod": return np.prod(self.values())
+      case "cumsum": return np.cumsum(self.values())
+    raise ValueError(f"Unsupported rolling window reducer: {fn}")
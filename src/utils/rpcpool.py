@@ -0,0 +1,279 @@
+from asyncio import FIRST_COMPLETED, CancelledError, Future, TimerHandle, create_task, gather, get_running_loop, wait
+from collections import deque
+from os import environ as env
+from time import monotonic
+from aiohttp import ClientSession
+from web3 import AsyncWeb3
+
+from .format import log_debug, log_warn
+
+RPC_LATENCY_WINDOW = int(env.get("RPC_LATENCY_WINDOW", 128)) # latency samples kept per endpoint
+RPC_ERROR_DECAY = float(env.get("RPC_ERROR_DECAY", 0.1)) # error rate moving average weight of the latest call
+RPC_MAX_FAILURES = int(env.get("RPC_MAX_FAILURES", 3)) # consecutive failures before cooldown
+RPC_COOLDOWN_SEC = float(env.get("RPC_COOLDOWN_SEC", 30)) # failing endpoints are out of rotation for this long
+RPC_HEDGE = env.get("RPC_HEDGE", "false").lower() == "true" # duplicate slow calls to a second endpoint
+RPC_HEDGE_MIN_MS = float(env.get("RPC_HEDGE_MIN_MS", 50)) # min hedging delay
+RPC_HEDGE_DEFAULT_MS = float(env.get("RPC_HEDGE_DEFAULT_MS", 1000)) # hedging delay until enough latency samples
+RPC_BATCH_WINDOW_MS = float(env.get("RPC_BATCH_WINDOW_MS", 5)) # concurrent calls collection window, 0 disables batching
+RPC_BATCH_SIZE = int(env.get("RPC_BATCH_SIZE", 50)) # max calls per JSON-RPC batch, lowered to what providers accept
+
+def is_batch_error(error: any) -> bool:
+  # providers rejecting the batch itself rather than the calls (eg. "batch size too large", "batch limit exceeded")
+  msg = str(error.get("message", "") if isinstance(error, dict) else error).lower()
+  return "batch" in msg and any(s in msg for s in ("large", "limit", "exceed", "size", "too many", "not supported"))
+
+class BatchHTTPProvider(AsyncWeb3.AsyncHTTPProvider):
+  """
+  Async HTTP provider sending the concurrent calls made within RPC_BATCH_WINDOW_MS to its endpoint
+  as a single JSON-RPC batch, over the shared http session. Responses are routed back by id,
+  the batch size adapts to the provider's limits (halved when rejected, regrown on success).
+  """
+
+  def __init__(self, endpoint_uri: str, session: callable=None, **kwargs):
+    super().__init__(endpoint_uri, **kwargs)
+    self.session = session or self.own_session # shared session getter (cf. HttpProxy), a session of its own if undefined
+    self._session: ClientSession = None
+    self.pending: list[tuple[dict, Future]] = []
+    self.timer: TimerHandle = None
+    self.batch_size = RPC_BATCH_SIZE
+    self.requests = self.calls = 0
+
+  async def make_request(self, method: str, params: any) -> dict:
+    self.calls += 1
+    if RPC_BATCH_WINDOW_MS <= 0:
+      self.requests += 1
+      return await super().make_request(method, params)
+    loop = get_running_loop()
+    future = loop.create_future()
+    self.pending.append((self.form_request(method, params), future))
+    if len(self.pending) >= self.batch_size:
+      self.flush()
+    elif not self.timer:
+      self.timer = loop.call_later(RPC_BATCH_WINDOW_MS / 1000, self.flush)
+    return await future
+
+  def flush(self):
+    if self.timer:
+      self.timer.cancel()
+      self.timer = None
+    while self.pending:
+      batch, self.pending = self.pending[:self.batch_size], self.pending[self.batch_size:]
+      create_task(self.send(batch))
+
+  def own_session(self) -> ClientSession:
+    if not self._session or self._session.closed:
+      self._session = ClientSession()
+    return self._session
+
+  async def disconnect(self):
+    if self._session and not self._session.closed:
+      await self._session.close()
+    await super().disconnect()
+
+  async def post(self, data: bytes) -> bytes:
+    self.requests += 1
+    async with self.session().post(self.endpoint_uri, data=data, **self.get_request_kwargs()) as res:
+      if res.status == 413: # payload too large
+        raise ValueError(f"JSON-RPC batch too large (HTTP 413)")
+      res.raise_for_status()
+      return await res.read()
+
+  async def send(self, batch: list[tuple[dict, Future]]):
+    try:
+      body = b"[" + b",".join(self.encode_rpc_dict(request) for request, _ in batch) + b"]"
+      response = self.decode_rpc_response(await self.post(body))
+    except Exception as e:
+      if len(batch) > 1 and is_batch_error(e):
+        return await self.split(batch, e)
+      for _, future in batch:
+        if not future.done():
+          future.set_exception(e)
+      return
+
+    if not isinstance(response, list): # the whole batch was rejected with a single error object
+      if len(batch) > 1 and (is_batch_error(response.get("error")) or "id" not in response or response["id"] is None):
+        return await self.split(batch, response.get("error"))
+      response = [{**response, "id": request["id"]} for request, _ in batch]
+
+    by_id = {r.get("id"): r for r in response if isinstance(r, dict)}
+    retry = []
+    for request, future in batch:
+      r = by_id.get(request["id"])
+      if r is None or is_batch_error(r.get("error")): # calls past the provider's batch limit
+        retry.append((request, future))
+      elif not future.done():
+        future.set_result(r)
+    if retry:
+      if len(retry) == len(batch) and len(batch) == 1:
+        if not batch[0][1].done(): # eg. caller cancelled
+          batch[0][1].set_exception(ValueError(f"No JSON-RPC response from {self.endpoint_uri}"))
+        return
+      self.batch_size = max(len(batch) - len(retry), 1)
+      log_warn(f"{self.endpoint_uri} processed {len(batch) - len(retry)}/{len(batch)} batched calls, batch size lowered to {self.batch_size}")
+      return await gather(*[self.send(retry[i:i + self.batch_size]) for i in range(0, len(retry), self.batch_size)])
+    if len(batch) >= self.batch_size and self.batch_size < RPC_BATCH_SIZE:
+      self.batch_size += 1 # additive increase
+
+  async def split(self, batch: list[tuple[dict, Future]], error: any):
+    self.batch_size = max(len(batch) // 2, 1)
+    log_debug(f"{self.endpoint_uri} rejected a batch of {len(batch)} calls ({error}), batch size lowered to {self.batch_size}")
+    await gather(*[self.send(batch[i:i + self.batch_size]) for i in range(0, len(batch), self.batch_size)])
+
+  def stats(self) -> dict:
+    return {"requests": self.requests, "calls": self.calls, "batch_size": self.batch_size}
+
+class RpcEndpoint:
+  """
+  RPC endpoint health: moving latency percentiles, error rate and cooldown.
+  """
+
+  def __init__(self, url: str, async_client: any=None):
+    self.url = url
+    self.async_client = async_client
+    self.latencies: deque[float] = deque(maxlen=RPC_LATENCY_WINDOW)
+    self.sorted: list[float] = None # percentiles cache
+    self.error_rate = 0.0
+    self.failures = 0 # consecutive
+    self.cooldown_until = 0.0
+    self.calls = self.errors = 0
+    self.inflight = 0
+
+  def record(self, latency: float, ok=True):
+    self.calls += 1
+    self.error_rate += RPC_ERROR_DECAY * ((0.0 if ok else 1.0) - self.error_rate)
+    if ok:
+      self.latencies.append(latency)
+      self.sorted = None
+      self.failures = 0
+      return
+    self.errors += 1
+    self.failures += 1
+    if self.failures >= RPC_MAX_FAILURES:
+      self.cooldown_until = monotonic() + RPC_COOLDOWN_SEC
+      self.failures = 0
+      log_warn(f"RPC {self.url} failing, out of rotation for {RPC_COOLDOWN_SEC:.0f}s")
+
+  def percentile(self, q: float) -> float:
+    if not self.latencies:
+      return 0.0
+    if self.sorted is None:
+      self.sorted = sorted(self.latencies)
+    return self.sorted[min(int(q * len(self.sorted)), len(self.sorted) - 1)]
+
+  @property
+  def available(self) -> bool:
+    return monotonic() >= self.cooldown_until
+
+  @property
+  def score(self) -> float:
+    # lower is better, unprobed endpoints are tried first, concurrent load is spread by in-flight calls
+    return (self.percentile(0.5) + 0.001) * (1 + 10 * self.error_rate) * (1 + self.inflight) + self.error_rate
+
+  def stats(self) -> dict:
+    provider = getattr(self.async_client, "provider", None)
+    return {
+      "p50": round(self.percentile(0.5) * 1000, 1), "p95": round(self.percentile(0.95) * 1000, 1),
+      "error_rate": round(self.error_rate, 3), "calls": self.calls, "errors": self.errors, "available": self.available,
+      **(provider.stats() if isinstance(provider, BatchHTTPProvider) else {})}
+
+class RpcPool:
+  """
+  Routes calls to the best scored endpoint, failing over to the next ones
+  and optionally hedging: a call slower than the endpoint's p95 is duplicated to the next best endpoint.
+  """
+
+  def __init__(self, endpoints: list[RpcEndpoint]):
+    if not endpoints:
+      raise ValueError("RPC pool requires at least one endpoint")
+    self.endpoints = endpoints
+    self.hedged = self.hedge_wins = 0
+
+  def ranked(self) -> list[RpcEndpoint]:
+    available = [e for e in self.endpoints if e.available]
+    if not available: # all cooling down: least recently failed first
+      return sorted(self.endpoints, key=lambda e: e.cooldown_until)
+    return sorted(available, key=lambda e: e.score)
+
+  def best(self) -> RpcEndpoint:
+    return self.ranked()[0]
+
+  def hedge_delay(self, e: RpcEndpoint) -> float:
+    if len(e.latencies) < 10:
+      return RPC_HEDGE_DEFAULT_MS / 1000
+    return max(e.percentile(0.95), RPC_HEDGE_MIN_MS / 1000)
+
+  async def timed(self, e: RpcEndpoint, fn: callable, fatal: callable=None) -> any:
+    start = monotonic()
+    e.inflight += 1
+    try:
+      res = await fn(e.async_client)
+    except CancelledError: # lost a hedge race, not the endpoint's fault
+      raise
+    except Exception as ex:
+      if not (fatal and fatal(ex)): # request errors are not the endpoint's fault either
+        e.record(monotonic() - start, ok=False)
+      raise
+    finally:
+      e.inflight -= 1
+    e.record(monotonic() - start)
+    return res
+
+  async def call(self, fn: callable, hedge: bool=None, retries=0, fatal: callable=None) -> any:
+    """
+    :param fn: async callable of an endpoint's async client
+    :param hedge: duplicate slow calls to the next best endpoint, defaults to RPC_HEDGE
+    :param retries: max endpoints tried, defaults to all
+    :param fatal: predicate of errors to raise as-is (eg. invalid request), without failover
+    """
+    hedge = RPC_HEDGE if hedge is None else hedge
+    ranked = self.ranked()
+    max_tried = retries or len(ranked)
+    tried: set[RpcEndpoint] = set() # hedged calls may try two endpoints at once
+    error = None
+    for e in ranked:
+      if len(tried) >= max_tried:
+        break
+      if e in tried:
+        continue
+      tried.add(e)
+      untried = [other for other in ranked if other not in tried]
+      try:
+        if not hedge or not untried:
+          return await self.timed(e, fn, fatal)
+        return await self.race(e, untried[0], fn, fatal, tried)
+      except Exception as ex:
+        if fatal and fatal(ex):
+          raise
+        error = ex
+        log_warn(f"RPC call failed on {e.url}: {ex}, failing over...")
+    raise error
+
+  async def race(self, primary: RpcEndpoint, secondary: RpcEndpoint, fn: callable, fatal: callable=None, tried: set=None) -> any:
+    first, second = create_task(self.timed(primary, fn, fatal)), None
+    try:
+      done, _ = await wait([first], timeout=self.hedge_delay(primary))
+      if done:
+        return first.result()
+      self.hedged += 1
+      second = create_task(self.timed(secondary, fn, fatal))
+      if tried is not None:
+        tried.add(secondary) # not failed over to again
+      pending = {first, second}
+      error = None
+      while pending:
+        done, pending = await wait(pending, return_when=FIRST_COMPLETED)
+        for task in done:
+          if task.exception():
+            error = task.exception()
+            continue
+          if task is second:
+            self.hedge_wins += 1
+          return task.result()
+      raise error
+    finally: # losing call, or both if the caller was cancelled
+      for task in (first, second):
+        if task and not task.done():
+          task.cancel()
+
+  def stats(self) -> dict:
+    return {"hedged": self.hedged, "hedge_wins": self.hedge_wins, **{e.url: e.stats() for e in self.endpoints}}
@@ -1,10 +1,18 @@
 import re
-from asyncio import iscoroutinefunction, new_event_loop
-from importlib import metadata
-from typing import Coroutine, Optional
+from asyncio import Lock, iscoroutinefunction, new_event_loop
+import atexit
+from collections import deque
+from functools import lru_cache
 from importlib import metadata
+import json
+from os import environ as env
+from multiprocessing.shared_memory import SharedMemory
+from typing import Coroutine, Iterable, Optional
+import numpy as np
+import orjson
 
 from src.utils import log_error, log_warn
+from src.utils.epochs import Column, Epoch
 
 class PackageMeta:
   def __init__(self, package="chomp"):
@@ -39,37 +47,191 @@ def submit_to_threadpool(executor, fn, *args, **kwargs):
       return executor.submit(run_async_in_thread, fn(*args, **kwargs))
   return executor.submit(fn, *args, **kwargs)
 
+class SharedEpochs:
+  """
+  Shared memory segment of a route's epochs, reused across reductions (regrown when too small):
+  numeric columns are copied in place for other processes to read, other values are pickled along the layout.
+  """
+
+  def __init__(self):
+    self.shm: Optional[SharedMemory] = None
+    self.lock = Lock() # one reduction at a time per segment
+
+  def share(self, epochs: Iterable[dict]) -> tuple[Optional[str], list[tuple]]:
+    """
+    :param epochs: route epochs, most recent first (eg. [{"bids": Column, "asks": Column}, ...])
+    :return: (shared memory segment name, picklable layout of the epochs) for attach_epochs
+    """
+    arrays, size = [], 0
+
+    def entry(value: any) -> tuple:
+      nonlocal size
+      if isinstance(value, Column) and value.buffer.dtype != object:
+        a = value.view()
+        size += -size % 8 # aligned offsets
+        arrays.append((size, a))
+        size += a.nbytes
+        return ("shm", size - a.nbytes, len(a), a.dtype.str, value.capacity)
+      if isinstance(value, Epoch):
+        return ("epoch", {k: entry(v) for k, v in value.items()}, value.capacity)
+      if type(value) is dict:
+        return ("dict", {k: entry(v) for k, v in value.items()})
+      return ("raw", value) # pickled as-is (eg. lists, scalars), same types as inline reducers get
+
+    layout = [entry(epoch) for epoch in epochs]
+    if not size:
+      return None, layout
+    if not self.shm or self.shm.size < size:
+      self.close()
+      self.shm = SharedMemory(create=True, size=size * 2) # growth headroom
+    for offset, a in arrays:
+      np.ndarray(a.shape, dtype=a.dtype, buffer=self.shm.buf, offset=offset)[:] = a
+    return self.shm.name, layout
+
+  def close(self):
+    if self.shm:
+      self.shm.close()
+      self.shm.unlink()
+      self.shm = None
+
+SHARED_EPOCHS: list[SharedEpochs] = [] # unlinked at exit
+
+def shared_epochs() -> SharedEpochs:
+  if not SHARED_EPOCHS:
+    atexit.register(lambda: [s.close() for s in SHARED_EPOCHS])
+  SHARED_EPOCHS.append(SharedEpochs())
+  return SHARED_EPOCHS[-1]
+
+def attach_epochs(name: Optional[str], layout: list[tuple]) -> tuple[Optional[SharedMemory], deque]:
+  """
+  Rebuild epochs shared by SharedEpochs, numeric columns are zero-copy Columns over the segment:
+  they must be released before closing it.
+
+  :param name: shared memory segment name
+  :param layout: epochs layout
+  :return: (attached shared memory segment, epochs)
+  """
+  shm = SharedMemory(name=name) if name else None # pool workers share the owner's resource tracker
+
+  def rebuild(e: tuple) -> any:
+    match e[0]:
+      case "shm":
+        _, offset, length, dtype, capacity = e
+        return Column.wrap(np.ndarray((length,), dtype=np.dtype(dtype), buffer=shm.buf, offset=offset), capacity)
+      case "epoch":
+        epoch = Epoch(e[2])
+        for k, v in e[1].items():
+          dict.__setitem__(epoch, k, rebuild(v))
+        return epoch
+      case "dict":
+        return {k: rebuild(v) for k, v in e[1].items()}
+    return e[1]
+
+  return shm, deque(rebuild(e) for e in layout)
+
+JSON_DECODER = env.get("JSON_DECODER", "orjson").lower() # orjson or json
+SELECTOR_SEGMENT = re.compile(r'([^.\[\]]+)(?:\[(\d+)\])?') # match selector segments eg. ".key" or ".key[index]"
+MISSED_SELECTORS: set[str] = set() # selectors already reported missing, logged once
+
+SelectorPath = tuple[str | int, ...] # dict keys (str) and list indices (int)
+
+def parse_json(data: str | bytes) -> any:
+  if JSON_DECODER == "orjson":
+    try:
+      return orjson.loads(data)
+    except orjson.JSONDecodeError:
+      pass # orjson rejects NaN literals and >64bit integers, fallback to the standard decoder
+  return json.loads(data)
+
+@lru_cache(maxsize=None)
+def compile_selector(selector: Optional[str]) -> SelectorPath:
+  """
+  Compile a nested attribute selector into an accessor path.
+
+  :param selector: eg. ".data[0].last", "root" or "." for the whole document
+  :return: accessor path eg. ("data", 0, "last")
+  """
+  if not selector or selector.lower() in (".", "root"):
+    return ()
+  path = []
+  for match in SELECTOR_SEGMENT.finditer(selector.lstrip(".")):
+    key, index = match.groups()
+    path.append(int(key) if key.isnumeric() and not index else key) # eg. ".0" is an index
+    if index is not None:
+      path.append(int(index))
+  return tuple(path)
+
+def select_path(path: SelectorPath, data: any, selector="") -> any:
+  current = data
+  for key in path:
+    if isinstance(key, int):
+      if not isinstance(current, list) or key >= len(current):
+        return miss_selector(selector or path, f"index out of range: {key}")
+      current = current[key]
+    else:
+      current = current.get(key) if isinstance(current, dict) else None
+      if current is None:
+        return miss_selector(selector or path, f"key not found: {key}")
+  return current
+
+def miss_selector(selector: str | SelectorPath, reason: str) -> None:
+  # log once per selector, missing keys are recurrent on the hot path
+  if selector not in MISSED_SELECTORS:
+    MISSED_SELECTORS.add(selector)
+    log_warn(f"Selector {selector} {reason} (further misses silenced)")
+
 def select_nested(selector: Optional[str], data: dict) -> any:
 
   # invalid selectors
   if selector and not isinstance(selector, str):
     log_error("Invalid selector. Please use a valid path string")
     return None
-
-  if not selector or [".", "root"].count(selector.lower()) > 0:
+  if not selector:
     return data
+  return select_path(compile_selector(selector), data, selector)
 
-  # optional starting dot and "root" keyword (case-insensitive)
-  if selector.startswith("."):
-    selector = selector[1:]
+def format_path(path: SelectorPath) -> str:
+  return "".join(f"[{k}]" if isinstance(k, int) else f".{k}" for k in path)
 
-  current = data # base access
-  segment_pattern = re.compile(r'([^.\[\]]+)(?:\[(\d+)\])?') # match selector segments eg. ".key" or ".key[index]"
+class SelectorTree:
+  """
+  Trie of compiled selectors, extracting several fields from a document in a single pass:
+  common path prefixes (eg. ".data[0]" of ".data[0].bid" and ".data[0].ask") are only walked once.
+  The trie is compiled into a flat accessor function, keys being inlined as literals.
+  """
+  def __init__(self, selectors: list[Optional[str]]):
+    self.size = len(selectors)
+    self.root = ([], {}, ()) # (indices of selectors ending here, children by path segment, path)
+    for i, selector in enumerate(selectors):
+      node = self.root
+      for key in compile_selector(selector):
+        node = node[1].setdefault(key, ([], {}, node[2] + (key,)))
+      node[0].append(i)
+    self.select = self.compile()
 
-  # loop through segments
-  for match in segment_pattern.finditer(selector):
-    key, index = match.groups()
-    if key.isnumeric() and not index:
-      key, index = None, int(key)
-    # dict access
-    if key and isinstance(current, dict):
-      current = current.get(key)
-    if not current:
-      return log_warn(f"Key not found in dict: {key}")
-    # list access
-    if index is not None:
-      index = int(index)
-      if not isinstance(current, list) or index >= len(current):
-        return log_error(f"Index out of range in dict.{key}: {index}")
-      current = current[index]
-  return current
+  def compile(self) -> callable:
+    lines = ["def select(data):", f"  out = [None] * {self.size}"]
+    depth = 0
+
+    def emit(node: tuple, var: str, indent: str):
+      nonlocal depth
+      leaves, children, _ = node
+      for i in leaves:
+        lines.append(f"{indent}out[{i}] = {var}")
+      for key, child in children.items():
+        depth += 1
+        child_var = f"_{depth}"
+        if isinstance(key, int):
+          lines.append(f"{indent}{child_var} = {var}[{key}] if {var}.__class__ is list and len({var}) > {key} else None")
+        else:
+          lines.append(f"{indent}{child_var} = {var}.get({key!r}) if {var}.__class__ is dict else None")
+        lines.append(f"{indent}if {child_var} is None:")
+        lines.append(f"{indent}  miss({format_path(child[2])!r})")
+        lines.append(f"{indent}else:")
+        emit(child, child_var, indent + "  ")
+
+    emit(self.root, "data", "  ")
+    lines.append("  return out")
+    namespace = {"miss": lambda selector: miss_selector(selector, "not found")}
+    exec(compile("\n".join(lines), "<selector>", "exec"), namespace) # keys are repr literals, never evaluated
+    return namespace["select"]
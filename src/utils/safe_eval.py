@@ -1,7 +1,10 @@
 import ast
-from hashlib import md5
+from collections import OrderedDict
+from functools import lru_cache
 import operator
+from os import environ as env
 import re  # for math operators
+from threading import Lock
 import numpy
 import pandas
 
@@ -22,60 +25,140 @@ BASE_NAMESPACE = {op.__name__: op for op in SAFE_OPERATORS}
 BASE_NAMESPACE.update({name: getattr(module, func) for module in [numpy, pandas] for name, func in [(f, f) for f in SAFE_FUNCTIONS[module.__name__]]})
 BASE_NAMESPACE.update({t.__name__: t for t in SAFE_TYPES})
 # BASE_NAMESPACE.update({'numpy': numpy, 'pd': pandas}) # Add numpy and pd modules themselves
-SAFE_EXPR_CACHE = set()
-EVAL_CACHE = {}
+COMPILE_CACHE_SIZE = int(env.get("SAFE_EVAL_CACHE_SIZE", 4096)) # parsed/compiled expressions
+RESULT_CACHE_SIZE = int(env.get("SAFE_EVAL_RESULT_CACHE_SIZE", 1024)) # memoized pure results, 0 to disable
+MEMOIZABLE_TYPES = (int, float, complex, str, bytes, bool, tuple, frozenset, type(None)) # immutable results only
+
+class LRUCache:
+  """Size bounded mapping evicting the least recently used keys, with hit/miss counters (thread safe)"""
+
+  def __init__(self, maxsize: int):
+    self.maxsize = maxsize
+    self.data = OrderedDict()
+    self.lock = Lock() # transformer threads share the cache
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key, default=None):
+    with self.lock:
+      try:
+        self.data.move_to_end(key)
+      except KeyError:
+        self.misses += 1
+        return default
+      self.hits += 1
+      return self.data[key]
+
+  def set(self, key, value):
+    if self.maxsize <= 0:
+      return
+    with self.lock:
+      self.data[key] = value
+      self.data.move_to_end(key)
+      while len(self.data) > self.maxsize:
+        self.data.popitem(last=False)
+
+  def clear(self):
+    with self.lock:
+      self.data.clear()
+      self.hits = self.misses = 0
+
+  def __len__(self) -> int:
+    return len(self.data)
+
+  def stats(self) -> dict:
+    return {"hits": self.hits, "misses": self.misses, "size": len(self.data), "maxsize": self.maxsize}
+
+RESULT_CACHE = LRUCache(RESULT_CACHE_SIZE)
+
+@lru_cache(maxsize=COMPILE_CACHE_SIZE)
+def compile_expr(expr: str, lambda_check=False, callable_check=False) -> tuple[any, str, bool]:
+  """
+  Parse, check and compile an expression once, cached by expression.
 
-def safe_eval(expr, lambda_check=False, callable_check=False, **kwargs):
+  :param expr: string expression to compile
+  :return: (code object, function name if a def else "", purity of the expression)
+  """
+  match = re.match(r'^\s*(def\s+\w+\s*\(|lambda\s+)', expr)
+  should_be_func = match and match.group(1).startswith('def')
+  should_be_lambda = match and match.group(1).startswith('lambda')
+
+  tree = ast.parse(expr, mode='exec' if should_be_func else 'eval')
+  is_func = should_be_func and isinstance(tree.body[0], ast.FunctionDef)
+  is_lambda = should_be_lambda and isinstance(tree.body, ast.Lambda)
+
+  if lambda_check and not is_lambda:
+    raise ValueError("Expression must be a lambda")
+  if callable_check and not (is_func or is_lambda):
+    raise ValueError("Expression must be callable")
+
+  # basic AST safety analysis
+  if not is_ast_safe(tree):
+    raise ValueError("Invalid or unsafe expression")
+
+  if is_func:
+    return compile(tree, filename='<ast>', mode='exec'), tree.body[0].name, True
+  return compile(tree, filename='<ast>', mode='eval'), "", is_lambda or is_ast_pure(tree)
+
+def is_ast_pure(tree) -> bool:
+  # only calls to namespace builtins, no attribute calls (eg. list.append) or injected callables
+  for node in ast.walk(tree):
+    if isinstance(node, ast.Call) and not (isinstance(node.func, ast.Name) and node.func.id in BASE_NAMESPACE):
+      return False
+  return True
+
+def safe_eval_cache_stats() -> dict:
+  info = compile_expr.cache_info()
+  return {
+    "compiled": {"hits": info.hits, "misses": info.misses, "size": info.currsize, "maxsize": info.maxsize},
+    "results": RESULT_CACHE.stats(),
+  }
+
+def clear_safe_eval_cache():
+  compile_expr.cache_clear()
+  RESULT_CACHE.clear()
+
+def safe_eval(expr, lambda_check=False, callable_check=False, memoize=True, **kwargs):
   """
   Evaluate a string expression in a safe environment.
+  Compiled expressions are cached by text, results of pure expressions are memoized by inputs.
 
   :param expr: string expression to evaluate
+  :param memoize: reuse the result of a previous evaluation with the same inputs if the expression is pure
   :param **kwargs: additional variables to inject into the evaluation namespace
   :return: result of the evaluation
   """
 
   if type(expr) is not str:
-    if type(expr) is callable:
+    if callable(expr):
       return expr
     raise ValueError("Expression must be a string")
 
-  id = md5(f"{expr}{lambda_check}{callable_check}{kwargs}".encode()).hexdigest()
-  if id in EVAL_CACHE:
-    return EVAL_CACHE[id]
-  ns = BASE_NAMESPACE.copy()
-  ns.update(kwargs)
-
   try:
-    match = re.match(r'^\s*(def\s+\w+\s*\(|lambda\s+)', expr)
-    should_be_func = match and match.group(1).startswith('def')
-    should_be_lambda = match and match.group(1).startswith('lambda')
-
-    tree = ast.parse(expr, mode='exec' if should_be_func else 'eval')
-    is_func = should_be_func and isinstance(tree.body[0], ast.FunctionDef)
-    is_lambda = should_be_lambda and isinstance(tree.body, ast.Lambda)
-
-    if lambda_check and not is_lambda:
-      raise ValueError("Expression must be a lambda")
-    if callable_check and not (is_func or is_lambda):
-      raise ValueError("Expression must be callable")
-
-    # basic AST safety analysis
-    if not expr in SAFE_EXPR_CACHE and not is_ast_safe(tree):
-      raise ValueError("Invalid or unsafe expression")
-
-    # compile the AST and evaluate
-    if is_func:
-      code = compile(tree, filename='<ast>', mode='exec')
-      func_name = tree.body[0].name if is_func else None
+    code, func_name, pure = compile_expr(expr, lambda_check, callable_check)
+
+    key = None
+    if memoize and pure and RESULT_CACHE.maxsize > 0:
+      try:
+        key = (expr, tuple((k, type(v), v) for k, v in sorted(kwargs.items()))) # typed to tell 1, 1.0 and True apart
+        hash(key)
+      except TypeError: # unhashable inputs
+        key = None
+      if key is not None:
+        result = RESULT_CACHE.get(key, RESULT_CACHE)
+        if result is not RESULT_CACHE:
+          return result
+
+    ns = BASE_NAMESPACE.copy()
+    ns.update(kwargs)
+    if func_name:
       exec(code, ns)
       result = ns[func_name] # function reference to be used as lambda
     else:
-      code = compile(tree, filename='<ast>', mode='eval')
       result = eval(code, ns)
 
-    # cache the expression as safe for faster evals
-    SAFE_EXPR_CACHE.add(expr)
-    EVAL_CACHE[id] = result
+    if key is not None and (callable(result) or isinstance(result, MEMOIZABLE_TYPES)):
+      RESULT_CACHE.set(key, result)
     return result
 
   except Exception as e:
@@ -0,0 +1,206 @@
+"""
+Micro-benchmarks of the ingestion hot path (select -> transform -> serialize).
+
+Synthetic ingesters are built from the shapes of the ./examples configs: raw documents are generated to
+satisfy each field's selector and the accessors its transformers apply to {self}.
+
+  python -m tests.benchmark -n 2000 -o bench.json        # run and save machine-readable results
+  python -m tests.benchmark -b bench.json                  # run and compare against previous results
+"""
+from datetime import datetime, timezone
+from glob import glob
+import json
+import pickle
+import platform
+import re
+import subprocess
+from time import perf_counter_ns
+from types import SimpleNamespace
+
+import src.state as state
+from src.utils import ArgParser, prettify
+
+UTC = timezone.utc
+BENCHED_TYPES = ["scrapper", "http_api", "ws_api", "evm_caller", "evm_logger"]
+SELF_ACCESSORS = re.compile(r"\{self\}((?:\[[^\]]+\])+)") # eg. {self}['asks'][0][0]
+SEGMENTS = re.compile(r"([^.\[\]]+)(?:\[(\d+)\])?") # select_nested segments
+
+def git_commit() -> str:
+  try:
+    return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+  except Exception:
+    return "unknown"
+
+def nest(path: list, leaf: any, into: any=None) -> any:
+  # build (or extend) nested dicts/lists so that following path yields leaf
+  if not path:
+    return leaf
+  key, rest = path[0], path[1:]
+  if isinstance(key, int):
+    into = into if isinstance(into, list) else []
+    while len(into) <= key:
+      into.append(None)
+    into[key] = nest(rest, leaf, into[key])
+  else:
+    into = into if isinstance(into, dict) else {}
+    into[key] = nest(rest, leaf, into.get(key))
+  return into
+
+def accessor_paths(transformers: list[str]) -> list[list]:
+  paths = []
+  for t in transformers or []:
+    for accessors in SELF_ACCESSORS.findall(t):
+      keys = [k.strip("'\"") for k in re.findall(r"\[([^\]]+)\]", accessors)]
+      paths.append([int(k) if k.isdigit() else k for k in keys])
+  return paths
+
+def synthetic_value(transformers: list[str], seed: float) -> any:
+  paths = accessor_paths(transformers)
+  if not paths:
+    return 1.0 + seed
+  value = None
+  for path in paths:
+    value = nest(path, 1.0 + seed, value)
+  if isinstance(value, list): # tuples returned by contract calls and decoded events
+    value = tuple(1.0 + seed if v is None else v for v in value)
+  return value
+
+def selector_path(selector: str) -> list:
+  if not selector or selector.lower() in (".", "root"):
+    return []
+  path = []
+  for key, index in SEGMENTS.findall(selector.lstrip(".")):
+    path.append(int(key) if key.isnumeric() and not index else key)
+    if index:
+      path.append(int(index))
+  return path
+
+def build_ingesters(paths: list[str]) -> list[tuple[str, any]]:
+  from src.utils.proxies import ConfigProxy
+  ingesters = []
+  for path in paths:
+    config = ConfigProxy.load_config(path)
+    name = path.split("/")[-1].rsplit(".", 1)[0]
+    for ingester_type in BENCHED_TYPES:
+      ingesters += [(name, c) for c in getattr(config, ingester_type, [])]
+  return ingesters
+
+def build_documents(c) -> dict[str, any]:
+  # one raw document per target, selectable by every field of the ingester targeting it
+  docs = {}
+  for i, f in enumerate(c.fields):
+    value = synthetic_value(f.transformers, i / 100)
+    docs[f.target] = nest(selector_path(f.selector), value, docs.get(f.target))
+  return docs
+
+def timeit(fn: callable, iterations: int) -> float:
+  for _ in range(min(iterations, 100)): # warmup
+    fn()
+  start = perf_counter_ns()
+  for _ in range(iterations):
+    fn()
+  return (perf_counter_ns() - start) / iterations
+
+def bench_ingester(config: str, c, iterations: int) -> list[dict]:
+  from src.actions.transform import transform_all
+  from src.utils import select_nested
+  try:
+    from src.actions.transform import compile_transformers
+    from src.utils import SelectorTree
+  except ImportError: # trees predating compiled pipelines and selector trees (eg. the base commit)
+    compile_transformers, SelectorTree = None, None
+
+  if compile_transformers:
+    compile_transformers(c)
+  selected = c.ingester_type == "http_api"
+  if selected:
+    docs = build_documents(c)
+    raw = {f.name: select_nested(f.selector, docs[f.target]) for f in c.fields}
+  else: # values as output by stream reducers and contract calls
+    raw = {f.name: synthetic_value(f.transformers, i / 100) for i, f in enumerate(c.fields)}
+
+  if selected: # as http_api, one selector tree per target
+    fields_by_target = {}
+    for f in c.fields:
+      fields_by_target.setdefault(f.target, []).append(f)
+    if SelectorTree:
+      trees = {target: SelectorTree([f.selector for f in fields]) for target, fields in fields_by_target.items()}
+
+  def select():
+    if not SelectorTree:
+      for f in c.fields:
+        select_nested(f.selector, docs[f.target])
+      return
+    for target, tree in trees.items():
+      tree.select(docs[target])
+
+  def transform():
+    for f in c.fields:
+      f.value = raw[f.name]
+    transform_all(c)
+
+  def serialize():
+    pickle.dumps(c.values_dict())
+
+  c.ingestion_time = datetime.now(UTC)
+  n = len(c.fields)
+  results = []
+  for stage, fn in [("select", select), ("transform", transform), ("serialize", serialize)]:
+    if stage == "select" and not selected:
+      continue
+    ns = timeit(fn, iterations)
+    results.append({
+      "config": config, "ingester": c.name, "type": c.ingester_type, "stage": stage, "fields": n,
+      "iterations": iterations, "ns_per_ingester": round(ns), "ns_per_field": round(ns / max(n, 1)),
+    })
+  return results
+
+def compare(results: list[dict], baseline: list[dict]) -> list[list]:
+  previous = {(r["config"], r["ingester"], r["stage"]): r for r in baseline}
+  rows = []
+  for r in results:
+    p = previous.get((r["config"], r["ingester"], r["stage"]))
+    delta = f"{(r['ns_per_field'] / p['ns_per_field'] - 1) * 100:+.1f}%" if p and p["ns_per_field"] else "n/a"
+    rows.append([r["ingester"][:24], r["stage"], p["ns_per_field"] if p else "n/a", r["ns_per_field"], delta])
+  return rows
+
+def main():
+  ap = ArgParser(description="Chomp ingestion hot path micro-benchmarks")
+  ap.add_arguments([
+    (("-c", "--configs"), str, "./examples/*.yml", None, "Ingesters YAML configurations to derive shapes from (glob)"),
+    (("-n", "--iterations"), int, 1000, None, "Iterations per ingester and stage"),
+    (("-o", "--output"), str, "", None, "Write JSON results to this path"),
+    (("-b", "--baseline"), str, "", None, "Compare with JSON results from a previous run"),
+  ])
+  args = ap.parse_args()
+  state.init(SimpleNamespace(verbose=False, threaded=True, max_retries=1, config_path=""))
+
+  results = []
+  for config, c in build_ingesters(sorted(glob(args.configs))):
+    try:
+      results += bench_ingester(config, c, args.iterations)
+    except Exception as e:
+      print(f"Skipping {c.name} ({c.ingester_type}): {e}")
+
+  report = {
+    "commit": git_commit(),
+    "date": datetime.now(UTC).isoformat(),
+    "python": platform.python_version(),
+    "machine": platform.machine(),
+    "results": results,
+  }
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump(report, f, indent=2)
+
+  if args.baseline:
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+    print(f"Baseline {baseline['commit']} vs {report['commit']}")
+    print(prettify(compare(results, baseline["results"]), ["Ingester", "Stage", "Before (ns/field)", "After (ns/field)", "Delta"]))
+  else:
+    rows = [[r["ingester"][:24], r["stage"], r["fields"], r["ns_per_ingester"], r["ns_per_field"]] for r in results]
+    print(prettify(rows, ["Ingester", "Stage", "Fields", "ns/ingester", "ns/field"]))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,21 @@
+from types import SimpleNamespace
+
+import pytest
+
+import src.state as state
+
+# runtime state as initialized by main.py, without any backend connection (proxies connect lazily)
+state.init(SimpleNamespace(verbose=False, threaded=False, config_path="", max_retries=2, retry_cooldown=0, proc_id="test"))
+
+@pytest.fixture
+def redis():
+  # in-memory redis (with lua scripting) behind state.redis, scripts are registered again on the fake client
+  fakeredis = pytest.importorskip("fakeredis")
+  pytest.importorskip("lupa")
+  import src.cache as cache
+  import src.ratelimit as ratelimit
+  state.redis._redis = fakeredis.FakeAsyncRedis()
+  cache.release_script = ratelimit.take_script = None
+  yield state.redis
+  state.redis._redis = None
+  cache.release_script = ratelimit.take_script = None
@@ -0,0 +1,70 @@
+from math import isnan
+
+import numpy as np
+import pytest
+
+from src.utils import Aggregator, Moments, Ohlc, Sketch, Vwap, parse_stream_reducer
+
+RNG = np.random.default_rng(7)
+PRICES = RNG.lognormal(mean=3, sigma=0.5, size=5000)
+VOLUMES = RNG.uniform(0.1, 10, size=5000)
+
+def feed(aggregator: Aggregator, *streams: np.ndarray) -> Aggregator:
+  for values in zip(*streams):
+    aggregator.update(*map(float, values))
+  return aggregator
+
+def test_ohlc():
+  assert feed(Ohlc(), PRICES).collect() == (PRICES[0], PRICES.max(), PRICES.min(), PRICES[-1])
+  for output, expected in zip(Ohlc.FIELDS, (PRICES[0], PRICES.max(), PRICES.min(), PRICES[-1])):
+    assert feed(Ohlc(output), PRICES).collect() == expected
+  assert feed(Ohlc(), [3.0, 1.0, 2.0]).value() == (3.0, 3.0, 1.0, 2.0) # first value is both high and low
+
+def test_vwap():
+  assert feed(Vwap(), PRICES, VOLUMES).collect() == pytest.approx(np.average(PRICES, weights=VOLUMES))
+  assert isnan(feed(Vwap(), [1.0], [0.0]).value()) # no volume traded
+
+@pytest.mark.parametrize("output, expected", [("mean", np.mean), ("var", np.var), ("std", np.std)])
+def test_moments(output, expected):
+  assert feed(Moments(output), PRICES).collect() == pytest.approx(expected(PRICES))
+
+@pytest.mark.parametrize("q", [0, 0.01, 0.25, 0.5, 0.9, 0.99, 1])
+@pytest.mark.parametrize("accuracy", [0.01, 0.05])
+def test_sketch_relative_error_bound(q, accuracy):
+  values = np.concatenate([-PRICES[:1000], np.zeros(100), PRICES])
+  exact = np.quantile(values, q, method="lower") # rank floor(q * (n - 1))
+  estimate = feed(Sketch(q, accuracy), values).collect()
+  assert abs(estimate - exact) <= accuracy * abs(exact) + 1e-12
+
+def test_sketch_memory_bounded_by_range():
+  sketch = feed(Sketch(0.5, 0.01), np.tile(PRICES, 4))
+  assert sketch.count == 4 * len(PRICES) and len(sketch.positive) < 500
+
+def test_sketch_rejects_invalid_quantile():
+  with pytest.raises(ValueError):
+    Sketch(1.5)
+
+@pytest.mark.parametrize("aggregator", [Ohlc("close"), Vwap(), Moments("mean"), Moments("std"), Sketch(0.5)])
+def test_empty_epoch_is_nan(aggregator):
+  assert isnan(aggregator.collect())
+  aggregator.update(*([1.0] * (2 if isinstance(aggregator, Vwap) else 1)))
+  assert not isnan(aggregator.collect())
+  assert isnan(aggregator.collect()) # reset once collected
+
+def test_empty_epoch_results():
+  assert all(isnan(v) for v in Ohlc().collect())
+  assert Aggregator().collect() == 0
+
+def test_parse_stream_reducer():
+  factory, selectors = parse_stream_reducer("vwap(.p, .q)")
+  assert selectors == [".p", ".q"] and isinstance(factory(), Vwap)
+  factory, selectors = parse_stream_reducer("quantile(.p, 0.95, 0.02)")
+  sketch = factory()
+  assert selectors == [".p"] and sketch.q == 0.95 and sketch.gamma == pytest.approx(1.02 / 0.98)
+  assert parse_stream_reducer("count()")[1] == []
+  with pytest.raises(ValueError):
+    parse_stream_reducer("vwap(.p)")
+
+@pytest.mark.parametrize("reducer", ["lambda values: sum(values)", "lambda v: max(v)", "np.mean(values)", "unknown(.p)"])
+def test_lambda_reducers_not_streamed(reducer):
+  assert parse_stream_reducer(reducer) is None
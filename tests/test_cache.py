@@ -0,0 +1,43 @@
+from asyncio import CancelledError, create_task, gather, run, sleep, wait_for
+
+import pytest
+
+import src.cache as cache
+from src.cache import INFLIGHT, lock_key, release_lock, singleflight
+
+def test_singleflight_coalesces(redis):
+  calls = []
+  async def fetch():
+    calls.append(1)
+    await sleep(0.05)
+    return "value"
+  async def main():
+    return await gather(*[singleflight("res", fetch, 60) for _ in range(5)])
+  assert run(main()) == ["value"] * 5
+  assert len(calls) == 1 and not INFLIGHT
+
+def test_singleflight_leader_cancelled(redis):
+  async def fetch():
+    await sleep(10)
+  async def main():
+    leader = create_task(singleflight("slow", fetch, 60))
+    await sleep(0.01)
+    waiter = create_task(singleflight("slow", fetch, 60))
+    await sleep(0.01)
+    leader.cancel()
+    with pytest.raises(CancelledError):
+      await leader
+    with pytest.raises(RuntimeError): # resolved, not hanging
+      await wait_for(waiter, 1)
+    assert not INFLIGHT
+    assert not await redis.keys(f"{cache.NS}:lock:*") # released
+  run(main())
+
+def test_release_lock_compare_and_delete(redis):
+  async def main():
+    key = lock_key("x")
+    await redis.set(key, "other-worker")
+    assert not await release_lock(key) and await redis.exists(key)
+    await redis.set(key, "test") # conftest proc_id
+    assert await release_lock(key) and not await redis.exists(key)
+  run(main())
@@ -0,0 +1,115 @@
+from asyncio import create_task, gather, get_running_loop, run, sleep
+from time import monotonic
+from types import SimpleNamespace
+
+from eth_abi import decode, encode
+
+import src.calls as calls
+import src.state as state
+from src.calls import ChainBatcher, call_many
+
+TOKEN = "0x" + "11" * 20
+REVERTING = "0x" + "22" * 20
+
+def fake_web3(monkeypatch, max_calls=1000) -> list[int]:
+  # multicall3 node: balanceOf(address) returns the address' last byte, REVERTING reverts, oversized batches run out of gas
+  sizes = []
+  async def eth_call(tx, block):
+    batch = decode(["(address,bool,bytes)[]"], tx["data"][4:])[0] # after the selector
+    if len(batch) > max_calls:
+      raise ValueError("out of gas")
+    sizes.append(len(batch))
+    return encode(["(bool,bytes)[]"], [[(target != REVERTING, encode(["uint256"], [calldata[-1]])) for target, _, calldata in batch]])
+  w3 = SimpleNamespace(provider=SimpleNamespace(endpoint_uri="https://rpc.test"), eth=SimpleNamespace(call=eth_call))
+  async def call(chain_id, fn, fatal=None, **kwargs):
+    try:
+      return await fn(w3)
+    except Exception as e:
+      raise e if not fatal or fatal(e) else RuntimeError(f"all endpoints failed: {e}")
+  async def throttle_rpc(url, cost=1):
+    pass
+  monkeypatch.setattr(state, "web3", SimpleNamespace(call=call))
+  monkeypatch.setattr(calls, "throttle_rpc", throttle_rpc)
+  calls.BATCHER_BY_CHAIN.clear()
+  return sizes
+
+def holder(i: int) -> str:
+  return "0x" + f"{i:040x}"
+
+def test_pack_limits(monkeypatch):
+  monkeypatch.setattr(calls, "MULTICALL_MAX_CALLS", 3)
+  monkeypatch.setattr(calls, "MULTICALL_MAX_CALLDATA", 2 * (36 + calls.CALL_OVERHEAD))
+  batcher = ChainBatcher(1)
+  call = lambda i: ((TOKEN, b"\x00" * 36), (None, []))
+  assert [len(b) for b in batcher.pack([call(i) for i in range(5)])] == [2, 2, 1] # calldata bound
+  monkeypatch.setattr(calls, "MULTICALL_MAX_CALLDATA", 10**6)
+  assert [len(b) for b in batcher.pack([call(i) for i in range(7)])] == [3, 3, 1] # calls bound
+
+def test_call_many_dedupes_and_routes(monkeypatch):
+  sizes = fake_web3(monkeypatch)
+  sig = "balanceOf(address)(uint256)"
+  async def main():
+    return await call_many(1, [(TOKEN, sig, [holder(i % 3)]) for i in range(6)] + [(REVERTING, sig, [holder(7)])])
+  values = run(main())
+  assert values[:6] == [0, 1, 2, 0, 1, 2] and isinstance(values[6], ValueError)
+  assert sizes == [4] # one aggregate3 of the unique calls
+
+def test_oversized_aggregate_is_split(monkeypatch):
+  sizes = fake_web3(monkeypatch, max_calls=2)
+  sig = "balanceOf(address)(uint256)"
+  async def main():
+    return await call_many(1, [(TOKEN, sig, [holder(i)]) for i in range(5)])
+  assert run(main()) == [0, 1, 2, 3, 4]
+  assert sorted(sizes) == [1, 2, 2]
+
+def test_block_number_shared_and_refetched_once_cancelled(monkeypatch):
+  fetched = []
+  async def fetch_block_number(chain_id):
+    fetched.append(chain_id)
+    await sleep(0.05)
+    return 100 + len(fetched)
+  monkeypatch.setattr(calls, "fetch_block_number", fetch_block_number)
+  calls.BLOCK_BY_CHAIN.clear()
+  async def main():
+    waiters = [create_task(calls.block_number(1)) for _ in range(3)]
+    await sleep(0.01)
+    waiters[0].cancel() # one caller timing out does not fail the others
+    assert await gather(*waiters[1:]) == [101, 101] and len(fetched) == 1
+    cancelled = get_running_loop().create_future()
+    cancelled.cancel() # eg. cancelled on shutdown
+    calls.BLOCK_BY_CHAIN[1] = (monotonic(), cancelled)
+    assert await calls.block_number(1) == 102 and len(fetched) == 2
+  try:
+    run(main())
+  finally:
+    calls.BLOCK_BY_CHAIN.clear()
+
+def test_call_many_cached(monkeypatch, redis):
+  sizes, block = fake_web3(monkeypatch), [100]
+  async def fetch_block_number(chain_id):
+    return block[0]
+  monkeypatch.setattr(calls, "fetch_block_number", fetch_block_number)
+  monkeypatch.setattr(calls, "CALL_CACHE_BLOCK_SEC", 0) # block number refetched on every call
+  calls.IMMUTABLE_CALLS.clear()
+  calls.BLOCK_BY_CHAIN.clear()
+  sig = "balanceOf(address)(uint256)"
+  batch = [(TOKEN, sig, [holder(i)]) for i in range(5)] + [(REVERTING, sig, [holder(9)])]
+  policies = ["immutable", "block", 1, "h1", None, "immutable"]
+  async def main():
+    values = await calls.call_many_cached(1, batch, policies)
+    assert values[:5] == [0, 1, 2, 3, 4] and isinstance(values[5], ValueError)
+    assert sizes == [6]
+    assert 3590 < await redis.ttl(calls.call_key(1, *batch[3])) <= 3600 and await redis.get(calls.call_key(1, *batch[5])) is None
+    assert (await calls.call_many_cached(1, batch, policies))[:5] == [0, 1, 2, 3, 4]
+    assert sizes == [6, 2] # cached calls left out, uncached and failed calls are called through
+    block[0] = 101
+    await calls.call_many_cached(1, batch, policies)
+    assert sizes[-1] == 3 # block scoped entry invalidated by the new block
+    await sleep(1.1)
+    await calls.call_many_cached(1, batch, policies)
+    assert sizes[-1] == 3 # ttl expired, block unchanged
+  try:
+    run(main())
+  finally:
+    calls.IMMUTABLE_CALLS.clear()
+    calls.BLOCK_BY_CHAIN.clear()
@@ -0,0 +1,20 @@
+import numpy as np
+
+from src.utils import Column, Epoch
+
+def test_column_grows_lazily_then_wraps():
+  col = Column(1000)
+  assert len(col.buffer) < 1000 # not preallocated
+  col.extend(range(5000))
+  assert len(col.buffer) == 2000 and len(col) == 1000
+  assert np.array_equal(np.asarray(col), np.arange(4000, 5000))
+
+def test_epoch_nested_defaults():
+  epoch = Epoch(4)
+  sym = epoch.setdefault("BTCUSDT", {})
+  assert isinstance(sym, Epoch) and sym.capacity == 4
+  bids = sym.setdefault("bids", [])
+  bids.extend(range(10))
+  assert epoch["BTCUSDT"]["bids"].tolist() == [6, 7, 8, 9]
+  epoch["ETHUSDT"] = {"asks": [1.0, 2.0]}
+  assert isinstance(epoch["ETHUSDT"]["asks"], Column)
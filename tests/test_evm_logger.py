@@ -0,0 +1,227 @@
+from asyncio import run
+from importlib import import_module
+from types import SimpleNamespace
+
+from eth_abi import decode, encode
+import numpy as np
+import pytest
+from web3 import Web3
+
+import src.state as state
+from src.model import Ingester, ResourceField
+from src.utils import to_hex
+
+evm_logger = import_module("src.ingesters.evm_logger")
+
+@pytest.fixture
+def chain(monkeypatch) -> list[tuple[int, int]]:
+  # provider returning one log per block and rejecting ranges over 300 blocks, fetched ranges are recorded
+  fetched = []
+  async def get_logs(chain_id, f, from_block, to_block):
+    if f.get("fail"):
+      raise f["fail"]
+    if to_block - from_block + 1 > 300:
+      raise ValueError("eth_getLogs block range is too large, max 300")
+    fetched.append((from_block, to_block))
+    return [{"blockNumber": n} for n in range(from_block, to_block + 1)]
+  monkeypatch.setattr(evm_logger, "get_logs", get_logs)
+  monkeypatch.setattr(evm_logger, "LOGS_CHUNK_BLOCKS", 1000)
+  monkeypatch.setattr(evm_logger, "LOGS_CONCURRENCY", 2)
+  evm_logger.CHUNK_BLOCKS_BY_CHAIN.clear()
+  evm_logger.REJECTED_CHUNK_BLOCKS_BY_CHAIN.clear()
+  return fetched
+
+def test_chunks_adapt_to_rejected_ranges(chain):
+  logs, next_block = run(evm_logger.get_logs_chunked(1, {}, 0, 4999))
+  assert [l["blockNumber"] for l in logs] == list(range(5000)) # gapless, in order
+  assert next_block == 5000 and max(e - s + 1 for s, e in chain) <= 300
+  assert evm_logger.REJECTED_CHUNK_BLOCKS_BY_CHAIN[1][0] <= 500
+  assert 250 <= evm_logger.CHUNK_BLOCKS_BY_CHAIN[1] < 500 # converged below the rejected range
+
+def test_rejected_range_bound_expires(chain, monkeypatch):
+  run(evm_logger.get_logs_chunked(1, {}, 0, 4999))
+  assert evm_logger.rejected_chunk_blocks(1) <= 500
+  monkeypatch.setattr(evm_logger, "LOGS_REJECTED_TTL_SEC", 0)
+  assert evm_logger.rejected_chunk_blocks(1) == evm_logger.LOGS_MAX_CHUNK_BLOCKS + 1
+
+@pytest.mark.parametrize("error", ["Rate limit budget of rpc.test exhausted", "429 Too Many Requests", "daily request limit reached"])
+def test_rate_limits_are_not_range_errors(chain, error):
+  assert not evm_logger.is_range_error(ValueError(error))
+  logs, next_block = run(evm_logger.get_logs_chunked(1, {"fail": ValueError(error)}, 0, 999))
+  assert not logs and next_block == 0 # stopped, cursor not advanced
+  assert 1 not in evm_logger.CHUNK_BLOCKS_BY_CHAIN and 1 not in evm_logger.REJECTED_CHUNK_BLOCKS_BY_CHAIN
+
+@pytest.mark.parametrize("error", ["query returned more than 10000 results", "Log response size exceeded", "exceed maximum block range: 5000"])
+def test_range_errors(error):
+  assert evm_logger.is_range_error(ValueError(error))
+
+def test_live_cursor_persisted_after_store(redis, monkeypatch):
+  contract = "1:0x" + "11" * 20
+  c = Ingester(name="transfers", ingester_type="evm_logger", interval="s10", fields=[
+    ResourceField(name="value", target=contract, selector="Transfer(indexed address,indexed address,uint256)")])
+  stored = []
+  async def store_events(c, chain_id, events_by_id):
+    if not stored:
+      stored.append(None)
+      raise ConnectionError("tsdb down")
+    stored.append(events_by_id)
+    return 1
+  async def noop(*args, **kwargs):
+    pass
+  async def add_ingester(c, fn, start):
+    return fn
+  async def get_logs_chunked(chain_id, f, from_block, to_block, max_chunks=0):
+    return [], to_block + 1
+  async def block_number(chain_id):
+    return 100
+  monkeypatch.setattr(evm_logger, "scheduler", SimpleNamespace(add_ingester=add_ingester))
+  monkeypatch.setattr(evm_logger, "ensure_claim_task", noop)
+  monkeypatch.setattr(evm_logger, "store_events", store_events)
+  monkeypatch.setattr(evm_logger, "get_logs_chunked", get_logs_chunked)
+  monkeypatch.setattr(evm_logger, "block_number", block_number)
+  monkeypatch.setattr(state, "tsdb", SimpleNamespace(precision="us", create_table=noop))
+  key = evm_logger.cursor_key(c.name, contract)
+  async def main():
+    await redis.set(key, 90)
+    [ingest] = await evm_logger.schedule(c)
+    await ingest(c) # store failed: blocks 90-100 refetched next tick
+    assert int(await redis.get(key)) == 90
+    await ingest(c)
+    assert int(await redis.get(key)) == 101
+  run(main())
+
+def test_event_dates_unique_across_shared_block_timestamps():
+  # eg. Arbitrum: several blocks per second sharing a timestamp, some with thousands of logs
+  keys = [(block, i) for block in range(1000, 1004) for i in range(2000)]
+  dates = [evm_logger.event_date(1_700_000_000, block, i) for block, i in keys]
+  assert dates == sorted(set(dates)) and all(d.timestamp() // 1 == 1_700_000_000 for d in dates)
+
+def test_store_events_rows(monkeypatch):
+  contract = "1:0x" + "11" * 20
+  c = Ingester(name="transfers", ingester_type="evm_logger", interval="s10", fields=[
+    ResourceField(name="amount", target=contract, selector="Transfer(indexed address,indexed address,uint256)", transformers=["{self}[2] / 1e18"])])
+  inserted = []
+  async def block_timestamps(chain_id, blocks):
+    return {n: 1_700_000_000 for n in blocks} # shared timestamp
+  async def insert_many(c, values, table=""):
+    inserted.append(([f.name for f in c.fields], values))
+  monkeypatch.setattr(evm_logger, "block_timestamps", block_timestamps)
+  monkeypatch.setattr(state, "tsdb", SimpleNamespace(insert_many=insert_many))
+  rows = np.empty(2, dtype=[("p0", object), ("p1", object), ("p2", np.uint64)])
+  rows["p2"] = [10 ** 18, 3 * 10 ** 18]
+  logs = [{"blockNumber": 7, "logIndex": 1}, {"blockNumber": 8, "logIndex": 1}]
+  assert run(evm_logger.store_events(c, 1, {f"{contract}:{c.fields[0].selector}": (logs, rows)})) == 2
+  [(columns, values)] = inserted
+  assert columns == ["amount", "block", "log_index"]
+  assert [v[1:] for v in values] == [(1.0, 7, 1), (3.0, 8, 1)] and values[0][0] != values[1][0]
+
+def event_log(signature: str, values: list) -> dict:
+  # log of an event as emitted on chain, encoded by eth_abi (indexed strings and bytes are hashed)
+  _, types, indexed = evm_logger.parse_event_signature(signature)
+  topics = [Web3.keccak(text=evm_logger.canonical_signature(signature))]
+  for t, is_indexed, v in zip(types, indexed, values):
+    if is_indexed:
+      topics.append(Web3.keccak(v.encode() if t == "string" else v) if t in ("string", "bytes") else encode([t], [v]))
+  data = encode([t for t, i in zip(types, indexed) if not i], [v for v, i in zip(values, indexed) if not i])
+  return {"topics": topics, "data": data}
+
+def expected(signature: str, log: dict) -> list:
+  # eth_abi reference decoding, indexed strings and bytes are their topic
+  _, types, indexed = evm_logger.parse_event_signature(signature)
+  data = iter(decode([t for t, i in zip(types, indexed) if not i], log["data"]))
+  topics = iter(log["topics"][1:])
+  return [(bytes(next(topics)) if t in ("string", "bytes") else decode([t], next(topics))[0]) if i else next(data) for t, i in zip(types, indexed)]
+
+def normalize(v: any) -> any:
+  if isinstance(v, np.generic):
+    v = v.item()
+  if isinstance(v, str) and v.startswith("0x"):
+    return v.lower() # eth_abi checksums addresses
+  if isinstance(v, (tuple, list)):
+    return tuple(normalize(x) for x in v)
+  return v
+
+@pytest.mark.parametrize("signature, values", [
+  ("Swap(indexed address,indexed int64,int256,uint256,int8,uint128,bool,bytes4,address)", [ # sliced words
+    ["0x" + "ab" * 20, -5, -1, 7, -128, 1, True, b"\x01\x02\x03\x04", "0x" + "01" * 20],
+    ["0x" + "cd" * 20, 2 ** 63 - 1, -(2 ** 200), 2 ** 255 + 1, 127, 2 ** 100, False, b"\xff" * 4, "0x" + "ff" * 20], # > 64 bits
+    ["0x" + "00" * 20, -(2 ** 63), -(2 ** 63), 2 ** 64 - 1, 0, 0, False, b"\x00" * 4, "0x" + "00" * 20],
+  ]),
+  ("Post(indexed string,indexed bytes,string,bytes,uint256[],int256,indexed uint256)", [ # dynamic, indexed dynamic
+    ["topic", b"\x01", "hello", b"\x00" * 40, [1, 2 ** 200], -3, 2 ** 256 - 1],
+    ["", b"", "", b"", [], 2 ** 255 - 1, 0],
+  ]),
+  ("Order(indexed address,(address,uint256),(uint8,int256)[],int256)", [ # tuples, fully eth_abi decoded
+    ["0x" + "ab" * 20, ("0x" + "cd" * 20, 2 ** 70), [(1, -1), (2, -(2 ** 100))], -7],
+  ]),
+])
+def test_event_decoder_matches_eth_abi(signature, values):
+  logs = [event_log(signature, v) for v in values]
+  decoder = evm_logger.EventDecoder(signature)
+  assert all(decoder.accepts(l) for l in logs)
+  if signature.startswith("Swap"):
+    assert None not in decoder.slots # no eth_abi fallback
+  rows = decoder.decode(logs)
+  for row, log in zip(rows, logs):
+    assert [normalize(v) for v in row.tolist()] == [normalize(v) for v in expected(signature, log)]
+
+def test_invalid_event_signature():
+  with pytest.raises(ValueError, match="Invalid event signature"):
+    evm_logger.parse_event_signature("Transfer")
+  assert evm_logger.canonical_signature("Swap(indexed address, (address, uint256)[] , int24)") == "Swap(address,(address,uint256)[],int24)"
+
+@pytest.mark.parametrize("precision, distinct", [("us", True), ("ms", False)])
+def test_event_keys_under_precision(precision, distinct):
+  # two logs of one block keyed by their timestamp at the tsdb's precision
+  dates = [evm_logger.event_date(1_700_000_000, 7, i).replace(tzinfo=None) for i in (1, 2)]
+  keys = {np.datetime64(d, precision) for d in dates}
+  assert (len(keys) == 2) == distinct
+
+def test_coarse_precision_rejected(monkeypatch):
+  c = Ingester(name="transfers", ingester_type="evm_logger", interval="s10", fields=[
+    ResourceField(name="value", target="1:0x" + "11" * 20, selector="Transfer(indexed address,indexed address,uint256)")])
+  async def noop(*args, **kwargs):
+    pass
+  monkeypatch.setattr(evm_logger, "scheduler", SimpleNamespace(add_ingester=noop))
+  monkeypatch.setattr(state, "tsdb", SimpleNamespace(precision="ms", create_table=noop))
+  with pytest.raises(ValueError, match="precision"):
+    run(evm_logger.schedule(c))
+  with pytest.raises(ValueError, match="precision"):
+    run(evm_logger.backfill(c, 0, 100))
+
+def test_stalled_backfill_fails_with_checkpoint(redis, monkeypatch):
+  contract = "1:0x" + "11" * 20
+  c = Ingester(name="transfers", ingester_type="evm_logger", interval="s10", fields=[
+    ResourceField(name="value", target=contract, selector="Transfer(indexed address,indexed address,uint256)")])
+  fetched, stalled = [], {100}
+  async def get_logs_chunked(chain_id, f, from_block, to_block, max_chunks=0):
+    fetched.append(from_block)
+    if from_block in stalled: # eg. provider failing on a non range error
+      return [], from_block
+    return [{"blockNumber": n} for n in range(from_block, to_block + 1)], to_block + 1
+  async def store_events(c, chain_id, logs):
+    return len(logs)
+  async def noop(*args, **kwargs):
+    pass
+  monkeypatch.setattr(evm_logger, "get_logs_chunked", get_logs_chunked)
+  monkeypatch.setattr(evm_logger, "decode_logs", lambda ef, logs: logs)
+  monkeypatch.setattr(evm_logger, "store_events", store_events)
+  monkeypatch.setattr(evm_logger, "BACKFILL_SEGMENT_BLOCKS", 100)
+  monkeypatch.setattr(evm_logger, "BACKFILL_WORKERS_PER_RPC", 1)
+  monkeypatch.setattr(state, "tsdb", SimpleNamespace(precision="us", create_table=noop))
+  monkeypatch.setattr(state, "web3", SimpleNamespace(pool=lambda chain_id: SimpleNamespace(endpoints=["rpc"])))
+  key = evm_logger.backfill_key(c.name, contract)
+  async def main():
+    with pytest.raises(ValueError, match="stalled"):
+      await evm_logger.backfill(c, 0, 299)
+    assert fetched == [0] + [100] * (state.args.max_retries + 1) # capped, next segments not started
+    assert int(await redis.get(key)) == 100 # checkpoint of the contiguous progress
+    stalled.clear()
+    fetched.clear()
+    assert await evm_logger.backfill(c, 0, 299) == 200 # resumed
+    assert fetched == [100, 200] and int(await redis.get(key)) == 300
+  run(main())
+
+def test_to_hex_prefixed_once():
+  h = Web3.keccak(text="Transfer(address,address,uint256)")
+  assert to_hex(h) == to_hex(bytes(h)) == "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
@@ -0,0 +1,50 @@
+from asyncio import Event, create_task, run, sleep
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from src.utils.proxies import HttpProxy
+
+def test_stats_tracks_requests_in_flight():
+  async def main():
+    release = Event()
+    async def handler(request):
+      await release.wait()
+      return web.json_response({"ok": True})
+    app = web.Application()
+    app.router.add_get("/", handler)
+    http = HttpProxy()
+    async with TestServer(app) as server:
+      async def get():
+        async with http.get(str(server.make_url("/"))) as res:
+          return await res.json()
+      pending = [create_task(get()) for _ in range(3)]
+      await sleep(0.1)
+      host = f"{server.host}:{server.port}"
+      stats = http.stats()
+      assert stats["in_flight"] == 3 and stats["in_flight_by_host"] == {host: 3}
+      assert stats["sessions"] == 1 and stats["limit"] == 256 and stats["limit_per_host"] == 16
+      release.set()
+      assert [await p for p in pending] == [{"ok": True}] * 3
+      stats = http.stats()
+      assert stats["in_flight"] == 0 and stats["in_flight_by_host"] == {}
+      assert stats["requests"] == 3 and stats["errors"] == 0 and stats["connections_created"] == 3
+      await http.close()
+    assert http.stats()["sessions"] == 0
+  run(main())
+
+def test_stats_releases_failed_requests():
+  async def main():
+    http = HttpProxy()
+    server = TestServer(web.Application())
+    await server.start_server()
+    url = str(server.make_url("/"))
+    await server.close() # nothing listening anymore
+    try:
+      await http.get(url)
+    except Exception:
+      pass
+    stats = http.stats()
+    assert stats["errors"] == 1 and stats["in_flight"] == 0 and stats["in_flight_by_host"] == {}
+    await http.close()
+  run(main())
@@ -0,0 +1,138 @@
+from asyncio import run
+from importlib import import_module
+from types import SimpleNamespace
+
+import pytest
+
+import src.state as state
+from src.model import Ingester, ResourceField
+
+http_api = import_module("src.ingesters.http_api")
+
+URL = "https://api.test/ticker"
+
+class FakeResponse:
+  def __init__(self, status: int, body="", headers=None):
+    self.status, self.body, self.headers = status, body, headers or {}
+
+  async def text(self) -> str:
+    return self.body
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, *exc):
+    pass
+
+class FakeSession:
+  # serves queued responses in order and records request headers
+  def __init__(self, *responses: FakeResponse):
+    self.responses, self.requests = list(responses), []
+
+  def get(self, url: str, headers: dict) -> FakeResponse:
+    self.requests.append((url, dict(headers)))
+    return self.responses.pop(0)
+
+@pytest.fixture
+def session(monkeypatch):
+  async def throttle(url):
+    return True
+  async def adapt(url, status, headers):
+    pass
+  monkeypatch.setattr(http_api, "throttle", throttle)
+  monkeypatch.setattr(http_api, "adapt", adapt)
+  http_api.VALIDATORS.clear()
+  def serve(*responses: FakeResponse) -> FakeSession:
+    s = FakeSession(*responses)
+    monkeypatch.setattr(state, "http", s, raising=False)
+    return s
+  yield serve
+  http_api.VALIDATORS.clear()
+
+def test_conditional_headers_and_304_body_reuse(session):
+  s = session(
+    FakeResponse(200, '{"p": 1}', {"ETag": '"v1"', "Last-Modified": "Wed, 01 Jan 2025 00:00:00 GMT"}),
+    FakeResponse(304))
+  assert run(http_api.fetch_json(URL)) == '{"p": 1}'
+  assert s.requests[0] == (URL, {}) # nothing validated yet
+  assert run(http_api.fetch_json(URL)) == '{"p": 1}' # not modified, last body reused
+  assert s.requests[1][1] == {"If-None-Match": '"v1"', "If-Modified-Since": "Wed, 01 Jan 2025 00:00:00 GMT"}
+
+def test_no_validators_without_conditional_support(session):
+  s = session(FakeResponse(200, '{"p": 1}'), FakeResponse(200, '{"p": 2}'))
+  assert run(http_api.fetch_json(URL)) == '{"p": 1}'
+  assert run(http_api.fetch_json(URL)) == '{"p": 2}'
+  assert s.requests[1][1] == {} and URL not in http_api.VALIDATORS
+
+def test_error_status_returns_empty(session):
+  session(FakeResponse(500, "oops"))
+  assert run(http_api.fetch_json(URL)) == ""
+
+@pytest.fixture
+def ticks(monkeypatch) -> SimpleNamespace:
+  # runs the scheduled ingest directly, recording transformed and unchanged stores
+  calls = SimpleNamespace(parsed=0, transformed=[], stored=0, ingest=None)
+  async def add_ingester(c, fn, start=False):
+    calls.ingest = fn
+  async def noop(*args, **kwargs):
+    return True
+  async def singleflight(name, callback, expiry):
+    return await callback()
+  async def transform_and_store(c):
+    c.ingestion_time = 1
+    calls.transformed.append([f.value for f in c.fields])
+  async def store(c):
+    calls.stored += 1
+  parse_json = http_api.parse_json
+  def counting_parse(data):
+    calls.parsed += 1
+    return parse_json(data)
+  monkeypatch.setattr(http_api.scheduler, "add_ingester", add_ingester)
+  monkeypatch.setattr(http_api, "ensure_claim_task", noop)
+  monkeypatch.setattr(http_api, "singleflight", singleflight)
+  monkeypatch.setattr(http_api, "transform_and_store", transform_and_store)
+  monkeypatch.setattr(http_api, "store", store)
+  monkeypatch.setattr(http_api, "parse_json", counting_parse)
+  return calls
+
+def ingester(on_unchanged: str) -> Ingester:
+  return Ingester(name="ticker", ingester_type="http_api", interval="s10", on_unchanged=on_unchanged, fields=[
+    ResourceField(name="price", target=URL, selector=".price", type="float64"),
+    ResourceField(name="volume", target=URL, selector=".volume", type="float64")])
+
+@pytest.mark.parametrize("on_unchanged, stored", [("store", 1), ("skip", 0)])
+def test_200_then_304_is_unchanged(session, ticks, on_unchanged, stored):
+  s = session(FakeResponse(200, '{"price": 1.5, "volume": 10}', {"ETag": '"v1"'}), FakeResponse(304))
+  c = ingester(on_unchanged)
+  async def main():
+    await http_api.schedule(c)
+    await ticks.ingest(c)
+    await ticks.ingest(c)
+  run(main())
+  assert len(s.requests) == 2 and s.requests[1][1] == {"If-None-Match": '"v1"'}
+  assert ticks.transformed == [[1.5, 10]] and ticks.parsed == 1 # 304 body short-circuited by its digest
+  assert ticks.stored == stored
+
+def test_identical_then_changed_payloads(session, ticks):
+  session(
+    FakeResponse(200, '{"price": 1.5, "volume": 10}'),
+    FakeResponse(200, '{"price": 1.5, "volume": 10}'),
+    FakeResponse(200, '{"price": 2.5, "volume": 20}'))
+  c = ingester("skip")
+  async def main():
+    await http_api.schedule(c)
+    for _ in range(3):
+      await ticks.ingest(c)
+  run(main())
+  assert ticks.transformed == [[1.5, 10], [2.5, 20]] and ticks.parsed == 2 and ticks.stored == 0
+
+def test_failed_fetch_is_not_unchanged(session, ticks):
+  session(FakeResponse(200, '{"price": 1.5, "volume": 10}'), FakeResponse(500))
+  c = ingester("skip")
+  async def main():
+    await http_api.schedule(c)
+    await ticks.ingest(c)
+    with pytest.raises(KeyError): # no data for the failed route
+      await ticks.ingest(c)
+  run(main())
+  assert ticks.transformed == [[1.5, 10]]
@@ -0,0 +1,25 @@
+from asyncio import run
+
+import pytest
+
+import src.ratelimit as ratelimit
+from src.ratelimit import RateLimited, bucket_keys, throttle, throttle_rpc
+
+def test_throttle_skips_and_refunds_when_exhausted(redis, monkeypatch):
+  monkeypatch.setattr(ratelimit, "RATE_LIMIT_MAX_WAIT_SEC", 0.5)
+  monkeypatch.setattr(ratelimit, "RATE_LIMIT_RPS", 1)
+  monkeypatch.setattr(ratelimit, "RATE_LIMIT_BURST", 1)
+  async def main():
+    assert await throttle("https://api.test/a") # burst token
+    assert not await throttle("https://api.test/b") # 1s wait > 0.5s max: skipped, not raised
+    tokens = float(await redis.hget(bucket_keys("api.test")[0], "tokens"))
+    assert tokens > -0.5 # the skipped request's cost was refunded
+    with pytest.raises(RateLimited): # RPC calls fail over instead
+      await throttle_rpc("https://api.test/rpc")
+  run(main())
+
+def test_throttle_fails_open(monkeypatch):
+  async def broken(**kwargs):
+    raise ConnectionError("redis down")
+  monkeypatch.setattr(ratelimit, "take_script", broken)
+  assert run(throttle("https://api.test/a"))
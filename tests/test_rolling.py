@@ -0,0 +1,37 @@
+from time import time
+
+import numpy as np
+import pytest
+
+from src.utils import RollingWindow
+
+def test_rolling_window_matches_numpy():
+  rng = np.random.default_rng(1)
+  values = rng.normal(100, 10, 500)
+  now = time()
+  w = RollingWindow(span=100)
+  for i, v in enumerate(values):
+    w.push(float(v), now - 498.5 + i) # the last point is ahead of reduce() eviction time
+    expected = values[max(0, i - 100):i + 1] # ts within [ts - span, ts]
+    assert len(w) == len(expected)
+    assert w.mean == pytest.approx(expected.mean())
+    assert w.var == pytest.approx(expected.var())
+    assert w.min == expected.min() and w.max == expected.max()
+  window = values[-101:]
+  for fn in ("mean", "sum", "std", "var", "min", "max", "median"):
+    assert w.reduce(fn) == pytest.approx(getattr(np, fn)(window)), fn
+
+def test_rolling_window_maxlen():
+  w = RollingWindow(span=3600, maxlen=3)
+  for v in (5.0, 1.0, 3.0, 4.0):
+    w.push(v)
+  assert w.values().tolist() == [1.0, 3.0, 4.0]
+  assert (w.min, w.max, w.reduce("sum")) == (1.0, 4.0, 8.0)
+
+def test_rolling_window_expiry():
+  w = RollingWindow(span=10)
+  w.push(1.0, time() - 60)
+  assert w.reduce("sum") == 0.0 # evicted at reduction time
+  assert np.isnan(w.reduce("mean")) and np.isnan(w.reduce("min"))
+  with pytest.raises(ValueError):
+    w.reduce("mode")
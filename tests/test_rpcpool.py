@@ -0,0 +1,96 @@
+from asyncio import CancelledError, create_task, gather, run, sleep
+import json
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+import pytest
+
+import src.utils.rpcpool as rpcpool
+from src.utils import BatchHTTPProvider, RpcEndpoint, RpcPool
+
+def provider(respond: callable) -> tuple[BatchHTTPProvider, list[int]]:
+  # provider whose endpoint answers the decoded batch with respond(requests)
+  p, sizes = BatchHTTPProvider("https://rpc.test"), []
+  async def post(data: bytes) -> bytes:
+    requests = json.loads(data)
+    sizes.append(len(requests))
+    return json.dumps(respond(requests)).encode()
+  p.post = post
+  return p, sizes
+
+def result(request: dict) -> dict:
+  return {"jsonrpc": "2.0", "id": request["id"], "result": request["params"][0]}
+
+def call_all(p: BatchHTTPProvider, n: int) -> list:
+  async def main():
+    return await gather(*[p.make_request("eth_getBalance", [hex(i)]) for i in range(n)])
+  return [r["result"] for r in run(main())]
+
+def test_batch_routed_by_id():
+  p, sizes = provider(lambda requests: [result(r) for r in reversed(requests)]) # out of order
+  assert call_all(p, 10) == [hex(i) for i in range(10)]
+  assert sizes == [10] # one http request
+
+def test_rejected_batch_is_split():
+  def respond(requests):
+    if len(requests) > 4:
+      return {"jsonrpc": "2.0", "id": None, "error": {"code": -32600, "message": "batch size too large"}}
+    return [result(r) for r in requests]
+  p, sizes = provider(respond)
+  assert call_all(p, 10) == [hex(i) for i in range(10)]
+  assert sizes[:3] == [10, 5, 5] and p.batch_size <= 4 # halved until accepted
+
+def test_partial_batch_is_retried():
+  p, sizes = provider(lambda requests: [result(r) for r in requests[:3]]) # calls past the provider's limit are dropped
+  assert call_all(p, 7) == [hex(i) for i in range(7)]
+  assert sizes[:3] == [7, 3, 1] and p.batch_size <= 4 # lowered to the processed count, then regrown
+
+def pool(*names: str) -> RpcPool:
+  return RpcPool([RpcEndpoint(url=name, async_client=name) for name in names]) # clients stand for their endpoint
+
+def test_posts_through_own_session_without_shared_one():
+  async def handler(request):
+    return web.json_response([result(r) for r in await request.json()])
+  app = web.Application()
+  app.router.add_post("/", handler)
+  async def main():
+    async with TestServer(app) as server:
+      p = BatchHTTPProvider(str(server.make_url("/")))
+      values = await gather(*[p.make_request("eth_getBalance", [hex(i)]) for i in range(3)])
+      session = p.session()
+      await p.disconnect()
+      return [v["result"] for v in values], p.requests, session.closed
+  assert run(main()) == ([hex(i) for i in range(3)], 1, True)
+
+def test_hedged_failover_skips_tried_endpoints(monkeypatch):
+  monkeypatch.setattr(rpcpool, "RPC_HEDGE_DEFAULT_MS", 10)
+  calls = []
+  async def fn(client):
+    calls.append(client)
+    if client != "c":
+      await sleep(0.05)
+      raise ValueError(f"{client} failed")
+    return client
+  p = pool("a", "b", "c")
+  assert run(p.call(fn, hedge=True)) == "c"
+  assert calls == ["a", "b", "c"] and p.hedged == 1 # b raced a, then c (not b again)
+
+def test_cancelled_race_cancels_both_calls(monkeypatch):
+  monkeypatch.setattr(rpcpool, "RPC_HEDGE_DEFAULT_MS", 10)
+  cancelled = []
+  async def fn(client):
+    try:
+      await sleep(10)
+    except CancelledError:
+      cancelled.append(client)
+      raise
+  async def main():
+    p = pool("a", "b")
+    task = create_task(p.call(fn, hedge=True))
+    await sleep(0.05) # hedged
+    task.cancel()
+    with pytest.raises(CancelledError):
+      await task
+    await sleep(0)
+    assert sorted(cancelled) == ["a", "b"] and all(e.inflight == 0 for e in p.endpoints)
+  run(main())
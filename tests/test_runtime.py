@@ -0,0 +1,82 @@
+from importlib import import_module
+
+import numpy as np
+
+import src.state as state
+from src.utils import Column, Epoch, new_epochs, shared_epochs, attach_epochs
+
+runtime = import_module("src.utils.runtime")
+
+def route_epochs():
+  epochs = new_epochs(capacity=8)
+  epochs[0]["p"] = [1.5, 2.5, 3.5]
+  epochs[0]["ints"] = 7
+  epochs[0].setdefault("BTC", {"sizes": [1, 2]}) # nested epoch
+  epochs.appendleft(Epoch(8))
+  epochs[0]["p"] = [4.0]
+  return epochs
+
+def test_shared_epochs_roundtrip():
+  shared = shared_epochs()
+  try:
+    name, layout = shared.share(route_epochs())
+    shm, epochs = attach_epochs(name, layout)
+    assert isinstance(epochs[0], Epoch) and isinstance(epochs[1]["p"], Column)
+    assert epochs[1]["p"].tolist() == [1.5, 2.5, 3.5] and epochs[0]["p"].tolist() == [4.0]
+    assert type(epochs[1]["ints"]) is int # raw values keep their type
+    assert isinstance(epochs[1]["BTC"], Epoch) and epochs[1]["BTC"]["sizes"].tolist() == [1.0, 2.0]
+    del epochs
+    shm.close()
+    # the segment is reused while large enough
+    assert shared.share(route_epochs())[0] == name
+  finally:
+    shared.close()
+
+def test_reduce_remote_in_process_pool():
+  ws_api = import_module("src.ingesters.ws_api")
+  shared = shared_epochs()
+  try:
+    name, layout = shared.share(route_epochs())
+    reducers = ["lambda epochs: sum(epochs[1]['p'])", "lambda epochs: epochs[1]['BTC']['sizes']", "lambda epochs: epochs[0]['p']"]
+    total, sizes, col = state.process_pool.submit(ws_api.reduce_remote, reducers, name, layout).result(timeout=60)
+    assert total == 7.5 and sizes.tolist() == [1.0, 2.0]
+    assert isinstance(col, np.ndarray) and col.tolist() == [4.0] # detached from shared memory
+  finally:
+    shared.close()
+
+DOC = {
+  "data": [{"bid": 1.5, "ask": 0, "book": {"depth": [3, 4]}}, {"bid": 2.5, "ask": "", "halted": False}],
+  "meta": {"ok": False, "count": 0, "name": ""},
+  "0": "zero",
+}
+
+SELECTORS = [
+  ".data[0].bid", ".data[0].ask", ".data[0].book.depth[1]", ".data[1].bid", # shared prefixes
+  ".data[1].ask", ".data[1].halted", ".meta.ok", ".meta.count", ".meta.name", # falsy values
+  ".data[0]", ".data", "root", ".", None, ".data[0].book.depth[0]",
+  ".data[2].bid", ".data[0].missing", ".meta.ok.nested", ".data.bid", ".meta[0]", ".0", # missing
+]
+
+def test_selector_tree_matches_select_nested(monkeypatch):
+  monkeypatch.setattr(runtime, "log_warn", lambda msg: None)
+  runtime.MISSED_SELECTORS.clear()
+  tree = runtime.SelectorTree(SELECTORS)
+  assert tree.select(DOC) == [runtime.select_nested(s, DOC) for s in SELECTORS]
+  assert tree.select(DOC)[4:9] == ["", False, False, 0, ""] # falsy values are not misses
+  assert tree.select({}) == [runtime.select_nested(s, {}) for s in SELECTORS]
+  assert tree.select([]) == [runtime.select_nested(s, []) for s in SELECTORS]
+
+def test_selector_tree_walks_shared_prefixes_once():
+  tree = runtime.SelectorTree([".data[0].bid", ".data[0].ask", ".data[1].bid"])
+  assert list(tree.root[1]) == ["data"] and list(tree.root[1]["data"][1]) == [0, 1]
+  assert sorted(tree.root[1]["data"][1][0][1]) == ["ask", "bid"]
+
+def test_selector_tree_logs_missing_keys_once(monkeypatch):
+  logged = []
+  monkeypatch.setattr(runtime, "log_warn", logged.append)
+  runtime.MISSED_SELECTORS.clear()
+  tree = runtime.SelectorTree([".data[0].bid", ".data[0].ask", ".data[3].bid"])
+  for _ in range(3):
+    assert tree.select({"data": [{"bid": 1}]}) == [1, None, None]
+  assert len(logged) == 2 and ".data[0].ask" in logged[0] and ".data[3]" in logged[1]
+  runtime.MISSED_SELECTORS.clear()
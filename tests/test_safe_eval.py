@@ -0,0 +1,24 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from src.utils.safe_eval import LRUCache
+
+def test_lru_cache_eviction():
+  cache = LRUCache(2)
+  cache.set("a", 1)
+  cache.set("b", 2)
+  assert cache.get("a") == 1 # a is now the most recently used
+  cache.set("c", 3)
+  assert cache.get("b") is None and cache.get("a") == 1 and cache.get("c") == 3
+  assert cache.stats() == {"hits": 3, "misses": 1, "size": 2, "maxsize": 2}
+
+def test_lru_cache_concurrent_eviction():
+  cache = LRUCache(8)
+  def hammer(seed: int) -> int:
+    for i in range(20_000):
+      key = (seed * 7 + i) % 32
+      if cache.get(key) is None:
+        cache.set(key, key)
+    return len(cache)
+  with ThreadPoolExecutor(8) as pool:
+    assert all(size <= 8 for size in pool.map(hammer, range(8))) # no KeyError raised by get/evict races
+  assert cache.hits + cache.misses == 8 * 20_000
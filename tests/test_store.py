@@ -0,0 +1,27 @@
+from asyncio import run
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import src.state as state
+from src.actions.store import TickWriter, flush_ticks
+from src.model import Ingester, ResourceField
+
+def test_tick_writer_rows(monkeypatch):
+  inserted = []
+  async def create_table(c):
+    pass
+  async def insert_many(c, rows):
+    inserted.extend(rows)
+  monkeypatch.setattr(state, "tsdb", SimpleNamespace(create_table=create_table, insert_many=insert_many))
+  c = Ingester(name="trades", ingester_type="ws_api", ticks=[ResourceField(name="price", selector=".p", type="float64")])
+  writer = TickWriter(c, batch_size=100_000)
+  assert [f.name for f in writer.resource.fields] == ["price", "stream", "seq"]
+  async def main():
+    for i in range(5000): # way above 1000 ticks/s
+      writer.append({"p": str(i)}, "wss://stream.test/ws/btcusdt@trade")
+    await flush_ticks() # eg. on shutdown
+  run(main())
+  dates = [row[0] for row in inserted]
+  assert len(inserted) == 5000 and dates == sorted(set(dates)) # unique, increasing
+  assert (dates[-1] - datetime.now(timezone.utc)).total_seconds() < 0.01 # not drifting ahead of the wall clock
+  assert inserted[-1][1:] == (4999.0, "wss://stream.test/ws/btcusdt@trade", 5000)
@@ -0,0 +1,163 @@
+from asyncio import run
+from importlib import import_module
+from time import sleep
+
+import numpy as np
+import pytest
+
+from src.model import Ingester, ResourceField
+from src.utils import safe_eval
+t = import_module("src.actions.transform") # shadowed by the transform function in src.actions
+
+def ingester(*fields: tuple[str, list[str]], interval="s10", **kwargs) -> Ingester:
+  return Ingester(name="test", interval=interval, fields=[ResourceField(name=name, transformers=transformers) for name, transformers in fields], **kwargs)
+
+SIBLINGS = {"usdc": 0.999, "decimals": 6, "ratio": 0.5}
+
+@pytest.mark.parametrize("transformer, value", [
+  ("round6", 1.23456789), ("upper", "abc"), ("to_snake", "Hello World"), ("int", "42"), ("sha256digest", 42), # base
+  ("{self} * 2", 3), ("({self} + 1) ** 2 / 4", 2.5), ("{self}['p'] * 2", {"p": 2}), ("{self[1]} / 10 ** 2", (0, 1234)), # self
+  ("{self} * {usdc}", 100), ("{self}[1] / 10 ** {decimals}", (0, 1234567)), ("({self} + {usdc}) * {ratio}", 1.5), # siblings
+  ("round({self} * {ratio}, 2)", 1.2345), # calls on expressions
+])
+def test_compile_transformer_matches_baseline(transformer, value):
+  # baseline semantics: base transformers by name, expressions injected with str.format then safe_eval'd
+  c = ingester(("x", [transformer]), *[(name, []) for name in SIBLINGS])
+  c.data_by_field.update(SIBLINGS)
+  c.fields[0].value = value
+  expected = t.BASE_TRANSFORMERS[transformer](c, value) if transformer in t.BASE_TRANSFORMERS \
+    else safe_eval(transformer.format(self=value, **SIBLINGS))
+  t.compile_transformers(c)
+  assert t.compile_transformer(transformer)(c, c.fields[0]) == expected
+
+@pytest.mark.parametrize("transformer", ["round({self}) + round({usdc})", "abs({self}) - abs({usdc})", "round({self}, 1) * round({ratio}, 2)"])
+def test_param_like_expressions_evaluated_as_expressions(transformer):
+  # leading native transformer names, not a single call: evaluated as the baseline did
+  assert t.parse_param_transformer(transformer) is None
+  c = ingester(("x", [transformer]), *[(name, []) for name in SIBLINGS])
+  c.data_by_field.update(SIBLINGS)
+  c.fields[0].value = -3.14159
+  t.compile_transformers(c)
+  assert c.fields[0].pipeline[0](c, c.fields[0]) == safe_eval(transformer.format(self=-3.14159, **SIBLINGS))
+
+@pytest.mark.parametrize("transformer, expected", [
+  ("round(2)", 1.23), ("div({decimals})", 1.2345 / 6), ("clamp(0, 1)", 1), ("decimals({decimals})", 1.2345e-6), ("scale(10 ** -2)", 0.012345),
+])
+def test_compile_param_transformer(transformer, expected):
+  c = ingester(("x", [transformer]), ("decimals", []))
+  c.data_by_field["decimals"] = 6
+  c.fields[0].value = 1.2345
+  t.compile_transformers(c)
+  assert c.fields[0].pipeline[0](c, c.fields[0]) == pytest.approx(expected)
+
+def test_compile_series_transformers():
+  c = ingester(("p", ["{self} - {self::mean(m1)}"]), ("q", ["{self} / {p::max(m1)}"]))
+  t.compile_transformers(c)
+  for v in (1.0, 2.0, 6.0): # previous values of p
+    t.SERIES_WINDOWS[t.series_key(c, "p")]["m1"].push(v)
+  p, q = c.fields
+  p.value, q.value = 10.0, 3.0
+  c.data_by_field.update(p=10.0, q=3.0)
+  try:
+    assert p.pipeline[0](c, p) == 10.0 - np.mean([1.0, 2.0, 6.0]) # own series
+    assert q.pipeline[0](c, q) == 3.0 / 6.0 # sibling series
+  finally:
+    t.SERIES_WINDOWS.pop(t.series_key(c, "p"))
+
+@pytest.mark.parametrize("transformer", ["{self} * {missing}", "{self} - {missing::mean(h1)}", "div({missing})"])
+def test_compile_unknown_sibling_rejected(transformer):
+  with pytest.raises(ValueError, match="Invalid transformer reference"):
+    t.compile_transformers(ingester(("x", [transformer]), ("y", [])))
+
+@pytest.mark.parametrize("transformer", ["{self::foo(h1)}", "{self::mean(xx)}", "{} * 2", "{self!r}"])
+def test_compile_invalid_transformer_rejected(transformer):
+  with pytest.raises(ValueError):
+    t.compile_transformer(transformer)
+
+def test_transform_waves_order_dependencies():
+  c = ingester(("total", ["{a} + {b}"]), ("a", ["{self} * 2"]), ("b", ["{self} + 1"]))
+  t.compile_transformers(c)
+  assert [[f.name for f in wave] for wave in c.transform_waves] == [["a", "b"], ["total"]]
+
+def test_transform_all_threaded():
+  c = ingester(("a", ["{self} * 2"]), ("b", ["{self} + 1"]), ("total", ["{a} + {b}"]))
+  for f, value in zip(c.fields, (1, 2, None)):
+    f.value = value
+  assert run(t.transform_all_threaded(c)) == 3
+  assert c.data_by_field == {"a": 2, "b": 3, "total": 5}
+
+def test_transform_all_threaded_timeout(monkeypatch):
+  monkeypatch.setattr(t, "TRANSFORM_TIMEOUT_SEC", 0.05)
+  t.BASE_TRANSFORMERS["slow"] = lambda r, self: sleep(0.2) or self + 1
+  try:
+    c = ingester(("slow", ["slow"]), ("fast", ["{self} + 1"]))
+    for f in c.fields:
+      f.value = 1
+    assert run(t.transform_all_threaded(c)) == 1 # the slow field is skipped, not the tick
+    assert c.data_by_field["fast"] == 2
+    sleep(0.3) # the abandoned transformer completes
+    assert c.fields[0].value == 1 and "slow" not in c.data_by_field
+  finally:
+    del t.BASE_TRANSFORMERS["slow"]
+    t.COMPILED_TRANSFORMERS.pop("slow", None)
+
+def scalar_rows(c: Ingester, columns: dict, n: int) -> list[dict]:
+  # row by row reference through the scalar pipelines
+  rows = []
+  for i in range(n):
+    for f in c.fields:
+      f.value = columns[f.name][i]
+    assert t.transform_all(c) == len(c.fields)
+    rows.append(dict(c.data_by_field))
+  return rows
+
+def test_transform_batch_matches_scalar():
+  c = ingester(
+    ("price", ["{self}[1] / 10 ** 2"]), # tuples (eg. latestRoundData())
+    ("qty", ["float", "round(3)"]),
+    ("notional", ["{price} * {qty}"]),
+    ("ret", ["pct_change"]),
+    ("name", ["upper"]))
+  c.fields[-1].type = "string"
+  n = 50
+  columns = {
+    "price": [(i, 1000 + i * 10) for i in range(n)],
+    "qty": [i * 0.1234567 for i in range(n)],
+    "notional": [None] * n,
+    "ret": [1 + i for i in range(n)],
+    "name": [f"t{i}" for i in range(n)],
+  }
+  batch = t.transform_batch(c, {k: np.array(v, dtype=object) if k == "price" else v for k, v in columns.items()})
+  scalar = scalar_rows(ingester(*[(f.name, f.transformers) for f in c.fields]), columns, n)
+  for name in columns:
+    expected = [row[name] for row in scalar]
+    if name == "ret":
+      assert np.isnan(batch[name][0]) and np.allclose(batch[name][1:], expected[1:])
+    elif name == "name":
+      assert batch[name].tolist() == expected
+    else:
+      assert np.allclose(batch[name], expected), name
+
+def test_transform_batch_rolling_series():
+  c = ingester(("p", ["{self} - {self::mean(m1)}"])) # 6 rows lookback
+  values = np.arange(20, dtype=np.float64)
+  out = t.transform_batch(c, {"p": values})["p"]
+  means = [values[max(0, i - 5):i + 1].mean() for i in range(20)]
+  assert np.allclose(out, values - means)
+
+
+def test_transform_batch_structured_rows():
+  # decoded events (evm_logger), one field per event param
+  c = ingester(("amount", ["{self}[2] / 1e18"]), ("sender", ["{self}[0]"]))
+  c.fields[1].type = "string"
+  rows = np.empty(3, dtype=[("p0", object), ("p1", object), ("p2", np.int64)])
+  rows["p0"], rows["p1"], rows["p2"] = ["0xa", "0xb", "0xc"], ["0xd"] * 3, [10 ** 18, 2 * 10 ** 18, -(10 ** 18)]
+  out = t.transform_batch(c, {"amount": rows, "sender": rows})
+  assert out["amount"].tolist() == [1.0, 2.0, -1.0]
+  assert out["sender"].tolist() == ["0xa", "0xb", "0xc"]
+
+def test_is_offloadable():
+  for transformers, offloadable in ((["{self} * 2", "round(2)"], True), (["pct_change"], False), (["{self} - {self::mean(h1)}"], False)):
+    c = ingester(("p", transformers))
+    t.compile_transformers(c)
+    assert t.is_offloadable(c) == offloadable, transformers
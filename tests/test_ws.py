@@ -0,0 +1,76 @@
+from asyncio import Event, create_task, run, sleep
+import json
+
+import src.utils.proxies as proxies
+from src.utils.proxies import WsProxy
+
+class FakeSocket:
+  def __init__(self, url: str, opened: Event):
+    self.url, self.sent, self.opened, self.closed = url, [], opened, Event()
+
+  async def send(self, msg: str):
+    self.sent.append(json.loads(msg))
+
+  async def __aenter__(self):
+    await self.opened.wait() # connection pending
+    return self
+
+  async def __aexit__(self, *exc):
+    pass
+
+  def __aiter__(self):
+    return self
+
+  async def __anext__(self):
+    await self.closed.wait()
+    raise StopAsyncIteration
+
+def test_split_stream_lowercases_symbols():
+  base, stream, provider = WsProxy.split_stream("wss://stream.binance.com:9443/ws/BTCUSDT@kline_1M")
+  assert base == "wss://stream.binance.com:9443" and stream == "btcusdt@kline_1M" and provider
+
+def test_subscribed_while_connecting(monkeypatch):
+  opened, sockets = Event(), []
+  def connect(url, **kwargs):
+    sockets.append(FakeSocket(url, opened))
+    return sockets[-1]
+  monkeypatch.setattr(proxies.websockets, "connect", connect)
+  async def main():
+    ws = WsProxy()
+    conn = ws.subscribe("wss://stream.binance.com:9443/ws/btcusdt@trade", print)
+    await sleep(0.01) # url snapshot taken, connect pending
+    ws.subscribe("wss://stream.binance.com:9443/ws/ETHUSDT@trade", print)
+    opened.set()
+    await sleep(0.01)
+    assert sockets[0].url.endswith("streams=btcusdt@trade")
+    assert sockets[0].sent == [{"method": "SUBSCRIBE", "params": ["ethusdt@trade"], "id": 2}]
+    assert conn.ws is sockets[0]
+    await ws.close()
+  run(main())
+
+def test_conflate_only_when_full(monkeypatch):
+  monkeypatch.setattr(proxies, "WS_OVERFLOW", "conflate")
+  monkeypatch.setattr(proxies, "WS_QUEUE_SIZE", 4)
+  conn = proxies.WsConnection(url="wss://ws.test")
+  async def main():
+    for raw in ['{"topic":"a","p":1}', '{"topic":"b","p":1}', '{"topic":"a","p":2}', 'ping']:
+      await WsProxy()._enqueue(conn, raw)
+    assert len(conn.queue) == 4 and not conn.counters["conflated"] # not full yet
+    await WsProxy()._enqueue(conn, '{"topic":"b","p":2}')
+  run(main())
+  assert [raw for _, raw in conn.queue] == ['{"topic":"b","p":1}', '{"topic":"a","p":2}', 'ping', '{"topic":"b","p":2}']
+  assert conn.counters["conflated"] == 1 and not conn.counters["dropped"]
+
+def test_drain_skips_undecodable_messages():
+  received = []
+  async def main():
+    ws = WsProxy()
+    conn = proxies.WsConnection(url="wss://ws.test")
+    conn.callbacks_by_stream[""] = [received.append]
+    for raw in ['{"p":1}', '{bad', '{"p":2}']:
+      await ws._enqueue(conn, raw)
+    drain = create_task(ws._drain(conn))
+    await sleep(0.01)
+    drain.cancel()
+  run(main())
+  assert received == [{"p": 1}, {"p": 2}]